@@ -1,157 +1,1650 @@
 # -*- coding: utf-8 -*-
+import bisect
+import hashlib
+import hmac
 import math
+import os
+import pkgutil
 import string
 import collections
+import itertools
+import threading
+import timeit
+from array import array
 from io import open
 
+from passwordmetrics import _vectorized
+from passwordmetrics.compiled import CompiledWordlist, is_compiled
+from passwordmetrics.patterns import DETECTORS, Pattern, find_patterns
+
+try:
+    # The C versions of the inner loops, if they were built.
+    from passwordmetrics import _speedups
+except ImportError:
+    _speedups = None
+
 __version__ = '1.1.dev0'
 
+# The configuration of the default scorer, for backwards compatibility.
 config = {}
+_scorer = None
+_cache = None
 
-def configure(groups=None, words=None, substitutions=None):
-    global config
-
-    # Define up the different character groups.
-    if groups is None:
-        # The default splits Latin-1 into seven different groups. The three last should be avoided, really.
-        groups = {'lowercase': set(string.ascii_lowercase),
-                  'uppercase': set(string.ascii_uppercase),
-                  'digits': set(string.digits),
-                  'punctuation': set(string.punctuation),
-                  'whitespace': set(string.whitespace),
-                  'non-printable': set(chr(i) for i in range(128) if chr(i) not in string.printable),
-                  'other': set(chr(i) for i in range(128, 256)), # latin-1
-                  }
-    config['groups'] = groups
-
-    # Configure the word list
-    if words is None:
-        # XXX Open as resource instead
-        words = {}
-        with open('passwordmetrics/wordlist_en.txt', 'rt', encoding='latin-1') as wordlist:
-            for line in wordlist.readlines():
-                word, entropy = line.strip().split(' ')
-                words[word] = float(entropy)
-    config['words'] = words
-
-    # Set up common substitutions:
-    if substitutions is None:
-        substitutions = {'0': 'o', '1': 'i', '2': 'z', '3': 'e', '4': 'a',
-                         '5': 's', '6': 'b', '7': 't', '8': 'b', '9': 'g',
-                         '!': 'i', '#': '3', '$': 's', '&': 'g', '@': 'a',
-                         '[': 'c', '(': 'c', '+': 't'}
-    config['substitutions'] = substitutions
+# Each build of a default scorer is numbered when it starts, so one that
+# finishes late can't replace a newer one.
+_generations = itertools.count(1)
+_generation = 0
+_install_lock = threading.Lock()
 
+# The ways of picking which of the words found in a password count
+SEGMENTATIONS = ('greedy', 'optimal')
 
-def _find_groups(pw):
-    groups = config['groups']
-    unused_groups = set(groups.keys())
-    used_groups = set()
-
-    for c in pw:
-        for group in unused_groups:
-            if c in groups[group]:
-                used_groups.add(group)
-                unused_groups.remove(group)
-                break
+try:
+    string_types = basestring
+    text_type = unicode
+except NameError:  # Python 3
+    string_types = str
+    text_type = str
 
-    return used_groups, unused_groups
+try:
+    from types import MappingProxyType as _read_only
+except ImportError:  # Python 2
+    class _read_only(collections.Mapping):
+        """A read-only view of a mapping"""
+        __slots__ = ('_mapping',)
 
+        def __init__(self, mapping):
+            self._mapping = mapping
 
-def _find_words(pw, words):
-    """Returns the found words and the non-word characters"""
-    max_len = max(map(len, words)) #longest word in the set of words
-    max_chunks = max_len - 1
-    words_found = set()
-    chunks = []
-
-    # Replace leet spellings
-    substituted = ''.join([config['substitutions'].get(c, c).lower() for c in pw])
-
-    # Find all possible words in the password
-    for c in substituted:
-        chunks = [chunk + c for chunk in chunks]
-        chunks.insert(0, c)
-        if len(chunks) > max_len:
-            chunks.pop()
-        for chunk in chunks:
-            if chunk in words:
-                words_found.add(chunk) #add to set of words
-
-    # In "canotier" the above will find 'canotier', 'can', 'not', 'tier',
-    # 'an', 'no' and 'a'. But only 'canotier' should count.
-    rest = pw
-    found = set()
-    # We sort the words on length, and then alphabetically for consistency.
-    # What order words are handled in can make a difference on entropy.
-    # Should you for example have "2can0the" as a password it contains "can",
-    # "not" and "the". If it picks "not" as the first word, this is the only
-    # one that is found, but otherwise it will find "can" and "not". Possibly
-    # this algorithm could be changed to try to find the most non-overlapping
-    # words (and hence the lowest entropy) but this is good enough I think.
-    remaining = substituted
-    for word in sorted(words_found, key=lambda x: (len(x), x), reverse=True):
-        word_length = len(word)
-        while True:
-            pos = remaining.find(word)
-            if pos == -1:
+        def __getitem__(self, key):
+            return self._mapping[key]
+
+        def __iter__(self):
+            return iter(self._mapping)
+
+        def __len__(self):
+            return len(self._mapping)
+
+        def __contains__(self, key):
+            return key in self._mapping
+
+        def __repr__(self):
+            return '_read_only(%r)' % (self._mapping,)
+
+
+def load_wordlist(path):
+    """Loads a word list, either a text list or a compiled one"""
+    if is_compiled(path):
+        return CompiledWordlist(path)
+
+    with open(path, 'rt', encoding='latin-1') as wordlist:
+        return _parse_wordlist(wordlist.readlines())
+
+
+def _parse_wordlist(lines):
+    words = {}
+    for line in lines:
+        word, entropy = line.strip().split(' ')
+        words[word] = float(entropy)
+    return words
+
+
+class _WordAutomaton(object):
+    """An Aho-Corasick automaton for finding all words in a string
+
+    Building it is linear in the total size of the word list, and it's done
+    once in configure(). After that finding all the words in a password is
+    a single pass over the password, no matter how big the word list is.
+    """
+    __slots__ = ('goto', 'fail', 'output')
+
+    def __init__(self, words):
+        # Build the trie. Node 0 is the root.
+        goto = [{}]
+        own = [None]
+        for word in words:
+            if not word:
+                continue
+            state = 0
+            for c in word:
+                next_state = goto[state].get(c)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][c] = next_state
+                    goto.append({})
+                    own.append(None)
+                state = next_state
+            own[state] = word
+
+        # Set up the failure links breadth first, so that the failure link of
+        # a node always points to a node that is already finished. Each node
+        # then gets all the words that end there, including those that are
+        # found by following the failure links.
+        fail = [0] * len(goto)
+        output = [()] * len(goto)
+        queue = collections.deque()
+        for state in goto[0].values():
+            if own[state] is not None:
+                output[state] = (own[state],)
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for c, next_state in goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(c, 0)
+                fail[next_state] = f
+                if own[next_state] is not None:
+                    output[next_state] = (own[next_state],) + output[f]
+                else:
+                    output[next_state] = output[f]
+
+        self.goto = goto
+        self.fail = fail
+        self.output = output
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def advance(self, states, alternatives):
+        """Reads one character that may be any of the alternatives
+
+        The automaton can be in several states at once, one for each way
+        of reading the characters so far. Returns the new states and the
+        words that end here.
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        next_states = set()
+        for state in states:
+            for c in alternatives:
+                # Each alternative is read from the same state.
+                s = state
+                next_state = goto[s].get(c)
+                while next_state is None and s:
+                    s = fail[s]
+                    next_state = goto[s].get(c)
+                next_states.add(next_state or 0)
+        if len(next_states) > 1:
+            # Any other state will find all that the root state would.
+            next_states.discard(0)
+        words = set()
+        for state in next_states:
+            words.update(output[state])
+        return tuple(next_states), tuple(words)
+
+    def scan(self, pw, alternatives):
+        """Returns the words that end at each character of the password
+
+        alternatives maps characters to the tuple of characters they can be
+        read as. Characters not in it are read as their lowercase self.
+        """
+        if _speedups is not None and type(pw) is text_type:
+            return _speedups.scan(self.goto, self.fail, self.output, pw, alternatives)
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        result = []
+        states = (0,)
+        for c in pw:
+            chars = alternatives.get(c) or (c.lower(),)
+            if len(states) == 1 and len(chars) == 1:
+                # The usual case, there is only one way to read the password.
+                state = states[0]
+                c = chars[0]
+                next_state = goto[state].get(c)
+                while next_state is None and state:
+                    state = fail[state]
+                    next_state = goto[state].get(c)
+                states = (next_state or 0,)
+                result.append(output[next_state or 0])
+            else:
+                states, words = self.advance(states, chars)
+                result.append(words)
+        return result
+
+
+class _DefaultWordlist(object):
+    """The English word list that comes with passwordmetrics
+
+    It's read from the package and compiled the first time it's used, not
+    when it's configured, so importing and configuring are fast, and
+    processes that never score a password never load it. Use preload() to
+    load it in advance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._words = None
+        self._automaton = None
+
+    def __reduce__(self):
+        # Other processes load their own copy, when they need it.
+        return (_get_default_wordlist, ())
+
+    def load(self):
+        """Loads the word list, if it isn't already"""
+        if self._automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    data = pkgutil.get_data('passwordmetrics', 'wordlist_en.txt')
+                    words = _parse_wordlist(data.decode('latin-1').splitlines())
+                    automaton = _WordAutomaton(words)
+                    self._words = words
+                    self._automaton = automaton
+        return self._automaton
+
+    @property
+    def loaded(self):
+        return self._automaton is not None
+
+    def scan(self, pw, alternatives):
+        return (self._automaton or self.load()).scan(pw, alternatives)
+
+    def advance(self, states, alternatives):
+        return (self._automaton or self.load()).advance(states, alternatives)
+
+    def __getitem__(self, word):
+        if self._words is None:
+            self.load()
+        return self._words[word]
+
+    def get(self, word, default=None):
+        if self._words is None:
+            self.load()
+        return self._words.get(word, default)
+
+    def __contains__(self, word):
+        if self._words is None:
+            self.load()
+        return word in self._words
+
+    def __iter__(self):
+        if self._words is None:
+            self.load()
+        return iter(self._words)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        if self._words is None:
+            self.load()
+        return list(self._words.items())
+
+    def __len__(self):
+        if self._words is None:
+            self.load()
+        return len(self._words)
+
+
+_default_wordlist = _DefaultWordlist()
+
+
+def _get_default_wordlist():
+    return _default_wordlist
+
+
+def preload(background=False):
+    """Loads the default word list now, rather than on first use
+
+    With background it's loaded in a daemon thread, and the thread is
+    returned. Scoring a password before it's done waits for it.
+    """
+    if not background:
+        _default_wordlist.load()
+        return None
+    thread = threading.Thread(target=_default_wordlist.load, name='passwordmetrics-preload')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+# Marks Latin-1 characters that are in no group, or in more than one.
+_NO_GROUP = 255
+
+
+class _GroupTable(object):
+    """Maps characters to the character groups they are in
+
+    The groups are numbered in the order of the groups mapping, so sets of
+    groups can be handled as bit masks. Latin-1 characters that are in
+    exactly one group are looked up by ordinal in a table, anything else
+    in a dict of group numbers. first_latin1 has the first group of all
+    Latin-1 characters, for looking up many characters at once.
+    """
+    __slots__ = ('names', 'sets', 'sizes', 'index', 'latin1', 'first_latin1', 'disjoint')
+
+    def __init__(self, groups):
+        self.names = tuple(groups)
+        self.sets = tuple(groups[name] for name in self.names)
+        self.sizes = tuple(len(group) for group in self.sets)
+
+        index = {}
+        for group_id, group in enumerate(self.sets):
+            for c in group:
+                index[c] = index.get(c, ()) + (group_id,)
+        self.index = index
+        self.disjoint = all(len(group_ids) == 1 for group_ids in index.values())
+
+        latin1 = bytearray([_NO_GROUP]) * 256
+        first_latin1 = bytearray([_NO_GROUP]) * 256
+        for c, group_ids in index.items():
+            if (isinstance(c, string_types) and len(c) == 1 and ord(c) < 256 and
+                    group_ids[0] < _NO_GROUP):
+                first_latin1[ord(c)] = group_ids[0]
+                if len(group_ids) == 1:
+                    latin1[ord(c)] = group_ids[0]
+        self.latin1 = latin1
+        self.first_latin1 = first_latin1
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def group_names(self, mask):
+        return set(name for group_id, name in enumerate(self.names) if mask >> group_id & 1)
+
+    def size(self, mask):
+        """The number of characters in the groups of the mask"""
+        if self.disjoint:
+            return sum(size for group_id, size in enumerate(self.sizes) if mask >> group_id & 1)
+        return len(set().union(*[group for group_id, group in enumerate(self.sets)
+                                 if mask >> group_id & 1]))
+
+    def bits(self, mask, unknown=0):
+        """The bits per character of the groups of the mask
+
+        If none of the groups are used, the unknown characters count as a
+        group of their own, of that many characters.
+        """
+        size = self.size(mask) or unknown
+        return math.log(size, 2) if size else 0.0 # ie 128 characters would make 7 bits
+
+
+def _check_arguments(words=None, wordlists=None, segmentation='greedy', max_length=None,
+                     max_candidates=None, **kwargs):
+    """Raises ValueError for arguments no scorer can be built from"""
+    if words is not None and wordlists is not None:
+        raise ValueError('Give either words or wordlists, not both')
+    if segmentation not in SEGMENTATIONS:
+        raise ValueError('segmentation must be one of %s' % ', '.join(SEGMENTATIONS))
+    for name, value in (('max_length', max_length), ('max_candidates', max_candidates)):
+        if value is not None and value < 0:
+            raise ValueError('%s can not be negative' % name)
+
+
+def _paths(kwargs):
+    """The files a configuration is read from"""
+    paths = []
+    if isinstance(kwargs.get('words'), string_types):
+        paths.append(kwargs['words'])
+    for wordlist in (kwargs.get('wordlists') or {}).values():
+        if isinstance(wordlist, string_types):
+            paths.append(wordlist)
+    if isinstance(kwargs.get('blocklist'), string_types):
+        paths.append(kwargs['blocklist'])
+    return paths
+
+
+class Scorer(object):
+    """Scores passwords with one configuration
+
+    The word list, character groups and substitutions are compiled when the
+    scorer is created, and it can't be changed after that. A scorer can
+    therefore be shared between threads, and you can have several, for
+    example one per language.
+
+    The arguments are the same as for configure().
+    """
+    _fields = ('groups', 'words', 'substitutions', 'segmentation', 'max_length',
+               'max_candidates', 'word_sources', 'blocklist', 'patterns', 'fingerprint',
+               '_group_table', '_automaton', '_alternatives')
+    # Weak references, so registries of scorers don't keep old ones alive.
+    __slots__ = _fields + ('__weakref__',)
+
+    def __init__(self, groups=None, words=None, substitutions=None, segmentation='greedy',
+                 max_length=None, max_candidates=None, wordlists=None, blocklist=None,
+                 patterns=None):
+        _check_arguments(words=words, wordlists=wordlists, segmentation=segmentation,
+                         max_length=max_length, max_candidates=max_candidates)
+
+        # Define up the different character groups.
+        if groups is None:
+            # The default splits Latin-1 into seven different groups. The three last should be avoided, really.
+            groups = {'lowercase': set(string.ascii_lowercase),
+                      'uppercase': set(string.ascii_uppercase),
+                      'digits': set(string.digits),
+                      'punctuation': set(string.punctuation),
+                      'whitespace': set(string.whitespace),
+                      'non-printable': set(chr(i) for i in range(128) if chr(i) not in string.printable),
+                      'other': set(chr(i) for i in range(128, 256)), # latin-1
+                      }
+        # Our own copy, so changing the caller's sets doesn't change the scorer.
+        groups = collections.OrderedDict((name, frozenset(group)) for name, group in groups.items())
+        object.__setattr__(self, 'groups', _read_only(groups))
+        object.__setattr__(self, '_group_table', _GroupTable(groups))
+
+        # Configure the word list
+        word_sources = None
+        if wordlists is not None:
+            words, word_sources = _merge_wordlists(wordlists)
+        elif words is None:
+            words = _default_wordlist
+        elif isinstance(words, string_types):
+            words = load_wordlist(words)
+        elif not isinstance(words, (CompiledWordlist, _DefaultWordlist)):
+            # The entropies are looked up here, so they must match the automaton.
+            words = dict(words)
+        if isinstance(words, (CompiledWordlist, _DefaultWordlist)):
+            # The compiled word list finds words straight from the mapped
+            # file, and the default one compiles itself when first used.
+            object.__setattr__(self, 'words', words)
+            object.__setattr__(self, '_automaton', words)
+        else:
+            object.__setattr__(self, 'words', _read_only(words))
+            object.__setattr__(self, '_automaton', _WordAutomaton(words))
+        if word_sources is not None:
+            word_sources = _read_only(word_sources)
+        object.__setattr__(self, 'word_sources', word_sources)
+
+        # Set up common substitutions:
+        if substitutions is None:
+            substitutions = {'0': 'o', '1': 'i', '2': 'z', '3': 'e', '4': 'a',
+                             '5': 's', '6': 'b', '7': 't', '8': 'b', '9': 'g',
+                             '!': 'i', '#': '3', '$': 's', '&': 'g', '@': 'a',
+                             '[': 'c', '(': 'c', '+': 't'}
+        object.__setattr__(self, 'substitutions', _read_only(dict(substitutions)))
+        object.__setattr__(self, '_alternatives', _compile_substitutions(substitutions))
+
+        object.__setattr__(self, 'segmentation', segmentation)
+
+        # Limits on how much work a password can cause.
+        object.__setattr__(self, 'max_length', max_length)
+        object.__setattr__(self, 'max_candidates', max_candidates)
+
+        if isinstance(blocklist, string_types):
+            from passwordmetrics.blocklist import Blocklist
+            blocklist = Blocklist(blocklist)
+        object.__setattr__(self, 'blocklist', blocklist)
+
+        # Keyboard walks, sequences and so on, see passwordmetrics.patterns
+        if patterns is True:
+            patterns = DETECTORS
+        if patterns:
+            patterns = _read_only(collections.OrderedDict(patterns))
+        else:
+            patterns = None
+        object.__setattr__(self, 'patterns', patterns)
+        # Identifies the configuration in caches. It's random rather than
+        # counted, so it's unique across processes, and pickled copies of
+        # the scorer keep it.
+        object.__setattr__(self, 'fingerprint', os.urandom(16))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Scorer objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Scorer objects are immutable')
+
+    def __getstate__(self):
+        # The read-only views can't be pickled, the mappings they show can.
+        return tuple(collections.OrderedDict(value) if isinstance(value, _read_only) else value
+                     for value in (getattr(self, name) for name in self._fields))
+
+    def __setstate__(self, state):
+        for name, value in zip(self._fields, state):
+            if isinstance(value, collections.OrderedDict):
+                value = _read_only(value)
+            object.__setattr__(self, name, value)
+
+    def find_groups(self, pw):
+        """Returns the used and the unused character groups"""
+        return self._group_names(self._used_groups(pw))
+
+    def _used_groups(self, pw):
+        # With overlapping groups the order of the characters matters.
+        return self._group_mask(set(pw) if self._group_table.disjoint else pw)
+
+    def _group_names(self, used):
+        table = self._group_table
+        all_groups = (1 << len(table.names)) - 1
+        return table.group_names(used), table.group_names(all_groups & ~used)
+
+    def _group_mask(self, chars, used=0):
+        """Adds the groups used by the characters to the used bit mask"""
+        table = self._group_table
+        latin1 = table.latin1
+        index = table.index
+        if _speedups is not None and len(table.names) <= 64:
+            return _speedups.group_mask(chars, used, latin1, index, len(table.names))
+        all_groups = (1 << len(table.names)) - 1
+
+        for c in chars:
+            try:
+                code = ord(c)
+            except TypeError:
+                # Bytes on Python 3, which are in no group.
+                continue
+            if code < 256 and latin1[code] != _NO_GROUP:
+                used |= 1 << latin1[code]
+            else:
+                # Characters in several groups mark the first one not yet used.
+                for group_id in index.get(c, ()):
+                    if not used & 1 << group_id:
+                        used |= 1 << group_id
+                        break
+            if used == all_groups:
                 break
-            rest = rest[:pos] + rest[pos+word_length:]
-            remaining = remaining[:pos] + remaining[pos+word_length:]
-            found.add(word)
-
-    # Now check if any of these found words used character replacements.
-    # In that case add those replacements to the "rest" to increase entropy.
-    for word in found:
-        start = 0
-        while True:
-            pos = substituted.find(word, start)
-            if pos == -1:
+
+        return used
+
+    def find_words(self, pw, words=None):
+        """Returns the found words and the non-word characters"""
+        if words is None or words is self.words:
+            words = None
+            automaton = self._automaton
+        else:
+            automaton = _WordAutomaton(words)
+
+        words_ending = self._scan(pw, automaton)
+        found_words, rest, found_patterns = self._pick_words(pw, words_ending, automaton, words)
+        return found_words, rest
+
+    def _find_all(self, pw):
+        """Returns the found words, the non-word characters and the patterns"""
+        words_ending = self._scan(pw, self._automaton)
+        return self._pick_words(pw, words_ending, self._automaton)
+
+    def _scan(self, pw, automaton):
+        # Find all possible words in the password, reading leet spellings
+        # as the letters they stand for.
+        if self.max_length is not None:
+            pw = pw[:self.max_length]
+        return automaton.scan(pw, self._alternatives)
+
+    def _cut(self, words_ending):
+        """Returns how much of the password to look for words in
+
+        That is all of it, unless it's longer than max_length, or has more
+        candidate words than max_candidates.
+        """
+        cut = len(words_ending)
+        if self.max_length is not None:
+            cut = min(cut, self.max_length)
+        if self.max_candidates is not None:
+            candidates = 0
+            for i in range(cut):
+                candidates += len(words_ending[i])
+                if candidates > self.max_candidates:
+                    return i
+        return cut
+
+    def _pick_words(self, pw, words_ending, automaton, words=None):
+        """words is the mapping the automaton was made from, if not self.words"""
+        cut = self._cut(words_ending)
+        if cut < len(pw):
+            # The rest of the password is scored as characters only, which
+            # takes linear time however it looks.
+            found_words, rest, found_patterns = self._pick_words(pw[:cut], words_ending[:cut],
+                                                                 automaton, words)
+            return found_words, rest + pw[cut:], found_patterns
+
+        if self.segmentation == 'optimal':
+            return self._segment(pw, words_ending, words)
+
+        words_found = set()
+        for words in words_ending:
+            words_found.update(words)
+        # We sort the words on length, and then alphabetically for consistency.
+        ordered = sorted(words_found, key=lambda x: (len(x), x), reverse=True)
+        return self._select_words(pw, words_ending, ordered, automaton)
+
+    def _select_words(self, pw, words_ending, ordered, automaton):
+        """Picks the words to count among all the words found in the password
+
+        words_ending has the words that end at each character of the
+        password, and ordered all the words found, longest first and then
+        reverse alphabetically.
+        """
+        substitutions = self.substitutions
+        alternatives = self._alternatives
+
+        # Where each word starts in the password
+        starts = {}
+        for end, words in enumerate(words_ending, 1):
+            for word in words:
+                starts.setdefault(word, []).append(end - len(word))
+
+        # In "canotier" the above will find 'canotier', 'can', 'not', 'tier',
+        # 'an', 'no' and 'a'. But only 'canotier' should count.
+        found = set()
+        # We sort the words on length, and then alphabetically for consistency.
+        # What order words are handled in can make a difference on entropy.
+        # Should you for example have "2can0the" as a password it contains "can",
+        # "not" and "the". If it picks "not" as the first word, this is the only
+        # one that is found, but otherwise it will find "can" and "not". Possibly
+        # this algorithm could be changed to try to find the most non-overlapping
+        # words (and hence the lowest entropy) but this is good enough I think.
+        # (segmentation='optimal' does that, see _segment().)
+        #
+        # Each word is cut out of the remaining characters, and then looked
+        # for again, until it isn't found. Where words have been cut out, the
+        # characters on each side can form new copies of words, so those are
+        # found as the joins are made.
+        longest = max(map(len, ordered)) if ordered else 0
+        remaining = list(range(len(pw)))
+        taken = [False] * len(pw)
+        joined = {}
+
+        def cut(first, positions):
+            for i in positions:
+                taken[i] = True
+            pos = bisect.bisect_left(remaining, first)
+            del remaining[pos:pos + len(positions)]
+
+            if 0 < pos < len(remaining):
+                # Find the words that are over the new join.
+                low = max(pos - longest + 1, 0)
+                chars = ''.join([pw[i] for i in remaining[low:pos + longest - 1]])
+                for end, words in enumerate(automaton.scan(chars, alternatives), low + 1):
+                    for new_word in words:
+                        new_start = end - len(new_word)
+                        if new_start < pos < end and new_word in starts:
+                            joined.setdefault(new_word, []).append(tuple(remaining[new_start:end]))
+
+        # Patterns are cut out like words, before any shorter words.
+        patterns = sorted(self._find_patterns(pw), key=lambda pattern: -len(pattern.token))
+        found_patterns = []
+        for word in ordered + [None]:
+            while patterns and (word is None or len(patterns[0].token) > len(word)):
+                pattern = patterns.pop(0)
+                positions = range(pattern.start, pattern.start + len(pattern.token))
+                if not any(taken[i] for i in positions):
+                    cut(pattern.start, positions)
+                    found_patterns.append(pattern)
+            if word is None:
                 break
-            original = pw[pos:pos+len(word)]
-            for c in original:
-                if c in config['substitutions']:
-                    if c not in rest:
-                        rest += c
-            # Find all copies of the word
-            start = pos + 1
 
-    return found, rest
+            word_length = len(word)
+            word_starts = starts[word]
+            # Once a copy is gone it stays gone, so we never look at it again.
+            cursor = 0
+            while True:
+                # The first copy that is still there...
+                first = None
+                while cursor < len(word_starts):
+                    start = word_starts[cursor]
+                    if not any(taken[start:start + word_length]):
+                        first = start
+                        break
+                    cursor += 1
+                # ...unless there is an earlier one over a join.
+                positions = None
+                copies = joined.get(word)
+                if copies:
+                    copies[:] = [copy for copy in copies if not any(taken[i] for i in copy)]
+                    for copy in copies:
+                        if first is None or copy[0] < first:
+                            first = copy[0]
+                            positions = copy
+                if first is None:
+                    break
+                if positions is None:
+                    positions = range(first, first + word_length)
+                cut(first, positions)
+                found.add(word)
 
+        found_patterns.sort(key=lambda pattern: pattern.start)
+        rest = ''.join([pw[i] for i in remaining])
 
-def _character_entropy(pw):
-    if not pw:
-        return 0, set()
-
-    chars = set()
-    unknown = set()
-    for char in pw:
-        if isinstance(char, int):
-            char = chr(char)
-        for name, group in config['groups'].items():
-            if char in group:
-                chars.update(group)
+        # Now check if any of these found words used character replacements.
+        # In that case add those replacements to the "rest" to increase entropy.
+        for word in found:
+            # Check all copies of the word
+            for start in starts[word]:
+                original = pw[start:start + len(word)]
+                for c in original:
+                    if c in substitutions:
+                        if c not in rest:
+                            rest += c
+
+        return found, rest, found_patterns
+
+    def _segment(self, pw, words_ending, words=None):
+        """Picks the words that give the lowest entropy
+
+        words_ending has the words that end at each character of the
+        password. This finds the split of the password into words and single
+        characters with the lowest total entropy, in one pass. Each character
+        is estimated to cost the bits per character of the groups of the
+        whole password, and so does each substitution used in a word.
+        Patterns are split out the same way as words.
+        """
+        all_words = self.words if words is None else words
+        substitutions = self.substitutions
+        size = self._group_table.size(self._group_mask(set(pw)))
+        bits = math.log(max(size, 2), 2)
+
+        # The number of substitutable characters before each position
+        substituted_before = [0]
+        for c in pw:
+            substituted_before.append(substituted_before[-1] + (c in substitutions))
+
+        patterns_ending = dict((pattern.start + len(pattern.token), pattern)
+                               for pattern in self._find_patterns(pw))
+
+        # cost[i] is the lowest entropy of pw[:i], and choice[i] the word or
+        # pattern that ends it, or None for a single character.
+        cost = [0.0] * (len(pw) + 1)
+        choice = [None] * (len(pw) + 1)
+        for end in range(1, len(pw) + 1):
+            best = cost[end - 1] + bits
+            best_word = None
+            for word in words_ending[end - 1]:
+                start = end - len(word)
+                word_cost = (cost[start] + all_words[word] +
+                             (substituted_before[end] - substituted_before[start]) * bits)
+                # On a tie, prefer words to characters, and longer words.
+                if word_cost < best or word_cost == best and (
+                        best_word is None or (len(word), word) > (len(best_word), best_word)):
+                    best = word_cost
+                    best_word = word
+            pattern = patterns_ending.get(end)
+            if pattern is not None and cost[pattern.start] + pattern.entropy < best:
+                best = cost[pattern.start] + pattern.entropy
+                best_word = pattern
+            cost[end] = best
+            choice[end] = best_word
+
+        found = set()
+        found_patterns = []
+        covered = [False] * len(pw)
+        end = len(pw)
+        while end:
+            word = choice[end]
+            if word is None:
+                end -= 1
+                continue
+            if isinstance(word, Pattern):
+                found_patterns.append(word)
+                word = word.token
+            else:
+                found.add(word)
+            start = end - len(word)
+            covered[start:end] = [True] * len(word)
+            end = start
+        found_patterns.reverse()
+        rest = ''.join(c for c, is_covered in zip(pw, covered) if not is_covered)
+
+        # Like the greedy selection, add the substitutions used in any copy
+        # of the found words.
+        for end, words in enumerate(words_ending, 1):
+            for word in words:
+                if word in found:
+                    for c in pw[end - len(word):end]:
+                        if c in substitutions and c not in rest:
+                            rest += c
+
+        return found, rest, found_patterns
+
+    def _find_patterns(self, pw):
+        if self.patterns is None:
+            return []
+        return find_patterns(pw, self.patterns)
+
+    def character_entropy(self, pw):
+        """Returns the entropy of the characters and the unknown characters"""
+        if not pw:
+            return 0, set()
+
+        table = self._group_table
+        latin1 = table.latin1
+        index = table.index
+        if _speedups is not None and type(pw) is text_type and len(table.names) <= 64:
+            used, unknown, unique = _speedups.character_groups(pw, latin1, index)
+            return unique * table.bits(used, len(unknown)), unknown
+
+        used = 0
+        unknown = set()
+        for char in set(pw):
+            if isinstance(char, int):
+                char = chr(char)
+            code = ord(char)
+            if code < 256 and latin1[code] != _NO_GROUP:
+                used |= 1 << latin1[code]
+            elif char in index:
+                used |= 1 << index[char][0]
+            else:
+                # The character is in none of the groups
+                unknown.add(char)
+
+        return len(set(pw)) * table.bits(used, len(unknown)), unknown
+
+    def _word_and_character_entropy(self, pw):
+        found_words, rest, found_patterns = self._find_all(pw)
+        return self._entropies(found_words, rest, found_patterns) + (found_words,)
+
+    def _entropies(self, found_words, rest, found_patterns=()):
+        c, unknown = self.character_entropy(rest)
+        return self._word_entropy(found_words, found_patterns), c, unknown
+
+    def _word_entropy(self, found_words, found_patterns=()):
+        """The entropy of the words, and of the patterns if any"""
+        all_words = self.words
+        if found_patterns:
+            return math.fsum(itertools.chain((all_words[word] for word in found_words),
+                                             (pattern.entropy for pattern in found_patterns)))
+        # fsum, so the result does not depend on the order of the set.
+        return math.fsum(all_words[word] for word in found_words) if found_words else 0
+
+    def _character_entropies(self, strings):
+        """Returns the character entropy and unknown characters of many strings"""
+        result = _vectorized.character_entropies(self._group_table, strings)
+        if result is None:
+            result = [self.character_entropy(s) for s in strings]
+        return result
+
+    def _metrics_many(self, passwords, compact=False):
+        """Returns the metrics of a list of passwords
+
+        The groups and character entropies are found for all of them at
+        once, which is faster with NumPy.
+        """
+        found = [self._find_all(pw) for pw in passwords]
+        characters = self._character_entropies([rest for found_words, rest, patterns in found])
+        used = _vectorized.group_masks(self._group_table, passwords)
+        if used is None:
+            used = [self._used_groups(pw) for pw in passwords]
+        return [self._metrics(pw, used[i], found[i][0], found[i][1], found[i][2], compact,
+                              characters[i])
+                for i, pw in enumerate(passwords)]
+
+    def _entropies_many(self, passwords):
+        """Returns the word, character and total entropy of a list of passwords"""
+        found = [self._find_all(pw) for pw in passwords]
+        characters = self._character_entropies([rest for found_words, rest, patterns in found])
+        result = []
+        for i, pw in enumerate(passwords):
+            w = self._word_entropy(found[i][0], found[i][2])
+            c = characters[i][0]
+            result.append((w, c, self._check_blocklist(pw, w + c)[1]))
+        return result
+
+    def metrics(self, pw, collector=None, compact=False):
+        """Returns the metrics of a password
+
+        With compact you get a Metrics tuple instead of a dict.
+
+        If a collector is given, it's called with a dict of how long each
+        stage of the scoring took, see StageTimings.
+        """
+        if collector is not None:
+            return self._collect_metrics(pw, collector, compact)
+        used = self._used_groups(pw)
+        found_words, rest, found_patterns = self._find_all(pw)
+        return self._metrics(pw, used, found_words, rest, found_patterns, compact)
+
+    def entropy(self, pw):
+        """Returns only the entropy of a password
+
+        This skips the character groups and doesn't build any collections
+        for the result, so it's the fastest way to score a password.
+        """
+        w, c, unknown, found_words = self._word_and_character_entropy(pw)
+        return self._check_blocklist(pw, w + c)[1]
+
+    def _check_blocklist(self, pw, entropy):
+        """Returns if the password is breached, and the entropy to use"""
+        blocklist = self.blocklist
+        if blocklist is None:
+            return None, entropy
+        if pw in blocklist:
+            # It can be guessed by trying all the passwords in the list.
+            return True, min(entropy, blocklist.entropy)
+        return False, entropy
+
+    def _collect_metrics(self, pw, collector, compact):
+        clock = timeit.default_timer
+        start = clock()
+        used = self._used_groups(pw)
+        groups_done = clock()
+        words_ending = self._scan(pw, self._automaton)
+        scan_done = clock()
+        found_words, rest, found_patterns = self._pick_words(pw, words_ending, self._automaton)
+        words_done = clock()
+        result = self._metrics(pw, used, found_words, rest, found_patterns, compact)
+        end = clock()
+        collector({'length': len(pw),
+                   'candidates': sum(len(words) for words in words_ending),
+                   'words': len(found_words),
+                   'find_groups': groups_done - start,
+                   'scan': scan_done - groups_done,
+                   'select_words': words_done - scan_done,
+                   'character_entropy': end - words_done,
+                   'total': end - start,
+                   })
+        return result
+
+    def _metrics(self, pw, used, found_words, rest, found_patterns=(), compact=False,
+                 characters=None):
+        if characters is None:
+            w, c, unknown = self._entropies(found_words, rest, found_patterns)
+        else:
+            w = self._word_entropy(found_words, found_patterns)
+            c, unknown = characters
+        breached, entropy = self._check_blocklist(pw, w + c)
+        word_sources = self.word_sources
+        if compact:
+            if word_sources is not None:
+                word_sources = tuple((word, word_sources[word]) for word in sorted(found_words))
+            return Metrics(entropy, w, c, len(pw), tuple(sorted(found_words)), used,
+                           self._group_table.names, tuple(sorted(unknown)), word_sources,
+                           breached, None if self.patterns is None else tuple(found_patterns))
+        used_groups, unused_groups = self._group_names(used)
+        result = {'entropy': entropy,
+                  'word_entropy': w,
+                  'character_entropy': c,
+                  'words': found_words,
+                  'used_groups': used_groups,
+                  'unused_groups': unused_groups,
+                  'length': len(pw),
+                  'unknown_chars': unknown,
+                  }
+        if word_sources is not None:
+            result['word_sources'] = dict((word, word_sources[word]) for word in found_words)
+        if breached is not None:
+            result['breached'] = breached
+        if self.patterns is not None:
+            result['patterns'] = list(found_patterns)
+        return result
+
+    def session(self, pw=''):
+        """Returns a Session for incrementally scoring a password"""
+        return Session(self, pw)
+
+    def metrics_iter(self, passwords, workers=None, chunksize=1000, compact=False):
+        """Yields the metrics of each password, in order
+
+        Pass workers to score the passwords in that many processes.
+        """
+        _check_chunks(workers, chunksize)
+        function = _compact_chunk if compact else _metrics_chunk
+        return itertools.chain.from_iterable(
+            _map_chunks(self, function, passwords, workers, chunksize))
+
+    def metrics_batch(self, passwords, entropy_only=False, workers=None, chunksize=1000,
+                      compact=False):
+        """Returns the metrics of many passwords, in order
+
+        With entropy_only the character groups and word sets are not collected,
+        and instead of a list of dicts you get a dict of the 'entropy',
+        'word_entropy' and 'character_entropy' columns as compact arrays.
+        With compact you get a list of Metrics tuples.
+
+        Pass workers to score the passwords in that many processes.
+        """
+        if not entropy_only:
+            return list(self.metrics_iter(passwords, workers, chunksize, compact))
+
+        _check_chunks(workers, chunksize)
+        entropy = array('d')
+        word_entropy = array('d')
+        character_entropy = array('d')
+        for chunk in _map_chunks(self, _entropy_chunk, passwords, workers, chunksize):
+            for w, c, total in chunk:
+                entropy.append(total)
+                word_entropy.append(w)
+                character_entropy.append(c)
+        return {'entropy': entropy,
+                'word_entropy': word_entropy,
+                'character_entropy': character_entropy,
+                }
+
+
+class Session(object):
+    """Scores a password as it is typed, one character at a time
+
+    The session keeps the state of the word scan and the character groups
+    for each prefix of the password, so typing or deleting characters at
+    the end only scans those characters. metrics() still picks the words
+    and finds the character entropy for the whole password. The metrics
+    are the same as you get from the scorer for the whole password.
+    """
+
+    def __init__(self, scorer, pw=''):
+        self.scorer = scorer
+        self.password = ''
+        # The states of the automaton and the used groups after each prefix
+        self._states = [(0,)]
+        self._groups = [0]
+        # The words ending at each character, how many times each word is
+        # found and the found words as (length, word), sorted.
+        self._words = []
+        self._counts = {}
+        self._ordered = []
+        self.append(pw)
+
+    def append(self, text):
+        """Adds characters at the end of the password"""
+        scorer = self.scorer
+        alternatives = scorer._alternatives
+        automaton = scorer._automaton
+        states = self._states[-1]
+        used = self._groups[-1]
+        for c in text:
+            states, words = automaton.advance(states, alternatives.get(c) or (c.lower(),))
+            for word in words:
+                if word in self._counts:
+                    self._counts[word] += 1
+                else:
+                    self._counts[word] = 1
+                    bisect.insort(self._ordered, (len(word), word))
+            used = scorer._group_mask(c, used)
+            self._states.append(states)
+            self._groups.append(used)
+            self._words.append(words)
+        self.password += text
+
+    def backspace(self, count=1):
+        """Removes characters from the end of the password"""
+        self._truncate(max(len(self.password) - count, 0))
+
+    def _truncate(self, length):
+        for words in self._words[length:]:
+            for word in words:
+                self._counts[word] -= 1
+                if not self._counts[word]:
+                    del self._counts[word]
+                    del self._ordered[bisect.bisect_left(self._ordered, (len(word), word))]
+        self.password = self.password[:length]
+        del self._states[length + 1:]
+        del self._groups[length + 1:]
+        del self._words[length:]
+
+    def update(self, pw):
+        """Sets the password, only redoing the work after the first change"""
+        common = 0
+        for a, b in zip(self.password, pw):
+            if a != b:
                 break
+            common += 1
+        self._truncate(common)
+        self.append(pw[common:])
+
+    def metrics(self, compact=False):
+        """Returns the metrics of the password"""
+        scorer = self.scorer
+        pw = self.password
+        if scorer._cut(self._words) < len(pw):
+            found = scorer._pick_words(pw, self._words, scorer._automaton)
+        elif scorer.segmentation == 'optimal':
+            found = scorer._segment(pw, self._words)
         else:
-            # The character is in none of the groups
-            unknown.add(char)
-
-    bit_per_word = math.log(len(chars), 2) # ie 128 characters would make 7 bits
-    return len(set(pw)) * bit_per_word, unknown
-
-
-def metrics(pw):
-    all_words = config['words']
-    used_groups, unused_groups = _find_groups(pw)
-    found_words, rest = _find_words(pw, all_words)
-    w = sum(all_words[word] for word in found_words)
-    c, unknown = _character_entropy(rest)
-    return {'entropy': w + c,
-            'word_entropy': w,
-            'character_entropy': c,
-            'words': found_words,
-            'used_groups': used_groups,
-            'unused_groups': unused_groups,
-            'length': len(pw),
-            'unknown_chars': unknown,
-            }
+            ordered = [word for length, word in reversed(self._ordered)]
+            found = scorer._select_words(pw, self._words, ordered, scorer._automaton)
+        found_words, rest, found_patterns = found
+        return scorer._metrics(pw, self._groups[-1], found_words, rest, found_patterns, compact)
+
+
+class Metrics(collections.namedtuple('Metrics', [
+        'entropy', 'word_entropy', 'character_entropy', 'length', 'words', 'groups',
+        'group_names', 'unknown_chars', 'word_sources', 'breached', 'patterns'])):
+    """The metrics of a password, as a tuple
+
+    metrics(pw, compact=True) returns these, which are smaller and faster to
+    make than the dict. words and unknown_chars are sorted tuples, and groups
+    is a bit mask of the used groups, where bit n is group_names[n].
+    With several word lists, word_sources has a (word, names) pair for each
+    word, with a blocklist breached is set, and with patterns patterns is a
+    tuple of the patterns found, otherwise they are None.
+    as_dict() returns the same dict that metrics() does.
+    """
+    __slots__ = ()
+
+    @property
+    def used_groups(self):
+        return set(name for group_id, name in enumerate(self.group_names)
+                   if self.groups >> group_id & 1)
+
+    @property
+    def unused_groups(self):
+        return set(name for group_id, name in enumerate(self.group_names)
+                   if not self.groups >> group_id & 1)
+
+    def as_dict(self):
+        result = {'entropy': self.entropy,
+                  'word_entropy': self.word_entropy,
+                  'character_entropy': self.character_entropy,
+                  'words': set(self.words),
+                  'used_groups': self.used_groups,
+                  'unused_groups': self.unused_groups,
+                  'length': self.length,
+                  'unknown_chars': set(self.unknown_chars),
+                  }
+        if self.word_sources is not None:
+            result['word_sources'] = dict(self.word_sources)
+        if self.breached is not None:
+            result['breached'] = self.breached
+        if self.patterns is not None:
+            result['patterns'] = list(self.patterns)
+        return result
+
+
+class StageTimings(object):
+    """Collects how long scoring passwords takes, stage by stage
+
+    Pass it as the collector to metrics(). Each call gets a dict with the
+    length of the password, the number of candidate words the scan found
+    and how many words were counted, and the seconds spent in each stage:
+    'find_groups', 'scan' (finding candidate words, substitutions included),
+    'select_words', 'character_entropy' and 'total'.
+
+    Any callable taking that dict can be used as a collector instead, for
+    example to send the timings on to a monitoring system.
+    """
+
+    STAGES = ('find_groups', 'scan', 'select_words', 'character_entropy', 'total')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __call__(self, timings):
+        with self._lock:
+            self.count += 1
+            self.candidates += timings['candidates']
+            for stage in self.STAGES:
+                self.totals[stage] += timings[stage]
+            if self.slowest is None or timings['total'] > self.slowest['total']:
+                self.slowest = timings
+
+    def clear(self):
+        with self._lock:
+            self.count = 0
+            self.candidates = 0
+            self.totals = dict((stage, 0.0) for stage in self.STAGES)
+            # The timings of the slowest password, which has its length but
+            # not the password itself.
+            self.slowest = None
+
+    def stats(self):
+        with self._lock:
+            count = self.count or 1
+            return {'count': self.count,
+                    'mean_candidates': self.candidates / float(count),
+                    'mean': dict((stage, total / count) for stage, total in self.totals.items()),
+                    'slowest': self.slowest,
+                    }
+
+
+def _copy_metrics(result):
+    return dict((key, type(value)(value) if isinstance(value, (set, list)) else value)
+                for key, value in result.items())
+
+
+class MetricsCache(object):
+    """A bounded cache of password metrics
+
+    When it's full, the least recently used metrics are evicted. Entries are
+    keyed on the password and the fingerprint of the scorer, so a new
+    configuration never gets the metrics of an old one.
+
+    With hash_passwords the passwords are not stored, only a keyed hash of
+    them, with a random key that only lives in memory. The cached metrics
+    still include the words found in the passwords.
+    """
+
+    def __init__(self, maxsize=1024, hash_passwords=False):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hash_key = os.urandom(32) if hash_passwords else None
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, scorer, pw):
+        if self._hash_key is not None:
+            if not isinstance(pw, bytes):
+                pw = pw.encode('utf-8', 'surrogatepass')
+            pw = hmac.new(self._hash_key, pw, hashlib.sha256).digest()
+        return scorer.fingerprint, pw
+
+    def metrics(self, scorer, pw, collector=None, compact=False):
+        """Returns the metrics of the password, from the cache if possible
+
+        The collector is only called when the password is scored, not for
+        cache hits.
+        """
+        key = self._key(scorer, pw)
+        with self._lock:
+            result = self._data.pop(key, None)
+            if result is not None:
+                # Move it last, as the most recently used.
+                self._data[key] = result
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if result is None:
+            # Metrics tuples are smaller, and can't be modified by callers.
+            result = scorer.metrics(pw, collector, compact=True)
+            with self._lock:
+                self._data[key] = result
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+        if compact:
+            return result
+        return result.as_dict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                }
+
+
+def _merge_wordlists(wordlists):
+    """Merges named word lists into one, and notes which lists each word is in
+
+    A word list can be a mapping or a file name, or None for the default
+    English list.
+    """
+    words = {}
+    sources = {}
+    for name in sorted(wordlists):
+        wordlist = wordlists[name]
+        if wordlist is None:
+            wordlist = _default_wordlist
+        elif isinstance(wordlist, string_types):
+            wordlist = load_wordlist(wordlist)
+        for word, entropy in wordlist.items():
+            if word in words:
+                # Where the word is more common it's easier to guess.
+                words[word] = min(words[word], entropy)
+                sources[word] += (name,)
+            else:
+                words[word] = entropy
+                sources[word] = (name,)
+    return words, sources
+
+
+def _compile_substitutions(substitutions):
+    """Maps characters to the tuple of lowercase characters they can be read as
+
+    A substitution can be a single character, or several, for characters
+    that can stand for any one of them.
+    """
+    alternatives = {}
+    for c, substitution in substitutions.items():
+        if not isinstance(substitution, (string_types, tuple, list, set, frozenset)):
+            substitution = text_type(substitution)
+        alternatives[c] = tuple(sorted(set(s.lower() for s in substitution)))
+    return alternatives
+
+
+# The scorer of the worker processes of a pool.
+_worker_scorer = None
+
+
+def _set_worker_scorer(scorer):
+    global _worker_scorer
+    _worker_scorer = scorer
+
+
+def _pool(scorer, workers):
+    # Each worker gets the scorer once, when it starts. It's only set in the
+    # workers, so the parent doesn't keep it after the pool is gone.
+    import multiprocessing
+    if hasattr(multiprocessing, 'get_context') and \
+            'fork' in multiprocessing.get_all_start_methods():
+        # Forked workers inherit the scorer, nothing needs pickling.
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing
+    return context.Pool(workers, _set_worker_scorer, (scorer,))
+
+
+def _check_chunks(workers, chunksize):
+    if workers is not None and workers < 0:
+        raise ValueError('workers can not be negative')
+    if chunksize < 1:
+        raise ValueError('chunksize must be at least 1')
+
+
+def _map_chunks(scorer, function, passwords, workers, chunksize):
+    """Calls function with chunks of passwords, yielding the results in order
+
+    With workers the chunks are scored in a pool of processes. Only a couple
+    of chunks per worker are in flight, so the passwords are streamed.
+    """
+    passwords = iter(passwords)
+    chunks = iter(lambda: list(itertools.islice(passwords, chunksize)), [])
+    if not workers:
+        for chunk in chunks:
+            yield function(chunk, scorer)
+        return
+
+    pool = _pool(scorer, workers)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _metrics_chunk(passwords, scorer=None):
+    scorer = scorer or _worker_scorer
+    return scorer._metrics_many(passwords)
+
+
+def _compact_chunk(passwords, scorer=None):
+    scorer = scorer or _worker_scorer
+    return scorer._metrics_many(passwords, compact=True)
+
+
+def _entropy_chunk(passwords, scorer=None):
+    scorer = scorer or _worker_scorer
+    return scorer._entropies_many(passwords)
+
+
+def configure(groups=None, words=None, substitutions=None, segmentation='greedy',
+              max_length=None, max_candidates=None, wordlists=None, blocklist=None,
+              patterns=None, background=False):
+    """Configures the default scorer used by the module level functions
+
+    With background the scorer is built in a daemon thread, and the thread
+    is returned. Until it's done the old configuration is used, and if
+    configure() is called again before then, this one is never used. The
+    arguments are checked, and the files opened, before the thread starts,
+    so mistakes in them raise here. If the build fails anyway, the old
+    configuration is kept and the exception is in the thread's error.
+    """
+    kwargs = dict(groups=groups, words=words, substitutions=substitutions,
+                  segmentation=segmentation, max_length=max_length,
+                  max_candidates=max_candidates, wordlists=wordlists, blocklist=blocklist,
+                  patterns=patterns)
+    generation = next(_generations)
+    if not background:
+        _install(Scorer(**kwargs), generation)
+        return None
+    _check_arguments(**kwargs)
+    for path in _paths(kwargs):
+        open(path, 'rb').close()
+    thread = _Builder(kwargs, generation)
+    thread.start()
+    return thread
+
+
+class _Builder(threading.Thread):
+    """Builds a scorer for configure() and makes it the default"""
+
+    def __init__(self, kwargs, generation):
+        threading.Thread.__init__(self, name='passwordmetrics-configure')
+        self.daemon = True
+        self.kwargs = kwargs
+        self.generation = generation
+        self.scorer = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.scorer = _build_scorer(self.kwargs)
+        except Exception as e:
+            self.error = e
+            return
+        _install(self.scorer, self.generation)
+
+
+def _build_scorer(kwargs):
+    """Creates a scorer, with the default word list loaded if it's used"""
+    scorer = Scorer(**kwargs)
+    if isinstance(scorer.words, _DefaultWordlist):
+        scorer.words.load()
+    return scorer
+
+
+def _install(scorer, generation=None):
+    """Makes the scorer the default
+
+    Scoring uses one reference to the scorer, so a call to metrics() never
+    sees half of an old and half of a new configuration. generation is the
+    number the build of the scorer got when it started. If a later build is
+    already installed the scorer is dropped, and False is returned.
+    """
+    global config, _scorer, _generation
+    if generation is None:
+        generation = next(_generations)
+    with _install_lock:
+        if generation < _generation:
+            return False
+        _generation = generation
+        _scorer = scorer
+        config = {'groups': scorer.groups,
+                  'words': scorer.words,
+                  'substitutions': scorer.substitutions,
+                  }
+        if _cache is not None:
+            # The old entries can't be hit any more.
+            _cache.clear()
+    return True
+
+
+def share(path, **kwargs):
+    """Compiles a configuration into a file that processes can attach() to
+
+    Takes the same arguments as configure(), except background. The file
+    is replaced as a whole, so you can share() again while processes are
+    attached to the old one.
+    """
+    from passwordmetrics.shared import write_shared
+    write_shared(_build_scorer(kwargs), path)
+
+
+def attach(path, detectors=None):
+    """Configures the default scorer from a file written by share()
+
+    The word list is memory mapped read-only, so attaching is fast, and all
+    processes attached to the same file share its memory. The file only
+    names the built-in pattern detectors, so custom ones must be given again
+    in detectors, by the kind of pattern.
+    """
+    from passwordmetrics.shared import load_shared
+    generation = next(_generations)
+    _install(load_shared(path, detectors), generation)
+
+
+class Watcher(object):
+    """Rebuilds a scorer when its files change
+
+    The word lists and blocklist given as file names are checked every
+    interval seconds. When one of them has changed, a new scorer is built
+    from the same arguments in the watcher's thread, and passed to callback,
+    which by default makes it the default scorer. Scoring goes on with the
+    old scorer in the meantime. If building the new one fails, the old one is
+    kept and the exception is in error.
+
+    Replace the files by renaming a new file over the old, so a half written
+    file is never read. A file that changes while it's read is read again at
+    the next check.
+    """
+
+    def __init__(self, interval=60.0, callback=None, **kwargs):
+        self.interval = interval
+        self.callback = callback
+        self.kwargs = kwargs
+        self.scorer = None
+        self.error = None
+        self.reloads = 0
+        self._stamps = None
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def paths(self):
+        """The files of the configuration"""
+        return _paths(self.kwargs)
+
+    def _stat(self):
+        stamps = []
+        for path in self.paths():
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamps.append(None)
+            else:
+                # A renamed file has a new inode, even with the same time and size.
+                stamps.append((st.st_mtime, st.st_size, st.st_ino))
+        return stamps
+
+    def reload(self):
+        """Builds a new scorer and passes it on, whether the files changed or not"""
+        with self._lock:
+            # Stat before reading, so a change while reading is seen next time.
+            stamps = self._stat()
+            generation = next(_generations)
+            scorer = _build_scorer(self.kwargs)
+            self._stamps = stamps
+            self.scorer = scorer
+            self.error = None
+            self.reloads += 1
+            if self.callback is None:
+                _install(scorer, generation)
+            else:
+                self.callback(scorer)
+            return scorer
+
+    def check(self):
+        """Reloads if any of the files changed, returns if it did"""
+        with self._lock:
+            stamps = self._stat()
+            if stamps == self._stamps:
+                return False
+            try:
+                self.reload()
+            except Exception as e:
+                # Don't try again until the files change again.
+                self._stamps = stamps
+                self.error = e
+                return False
+            return True
+
+    def start(self):
+        """Checks the files in a daemon thread"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='passwordmetrics-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def watch(interval=60.0, callback=None, **kwargs):
+    """Configures the default scorer, and rebuilds it when its files change
+
+    The keyword arguments are the same as for configure(). Returns the
+    started Watcher, call its stop() method to stop watching.
+    """
+    watcher = Watcher(interval, callback, **kwargs)
+    watcher.reload()
+    return watcher.start()
+
+
+def enable_cache(maxsize=1024, hash_passwords=False):
+    """Caches the results of metrics(), and returns the MetricsCache"""
+    global _cache
+    _cache = MetricsCache(maxsize, hash_passwords)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    _cache = None
+
+
+def _find_groups(pw):
+    return _scorer.find_groups(pw)
+
+
+def _find_words(pw, words):
+    """Returns the found words and the non-word characters"""
+    return _scorer.find_words(pw, words)
+
+
+def _character_entropy(pw):
+    return _scorer.character_entropy(pw)
+
+
+def metrics(pw, collector=None, compact=False):
+    cache = _cache
+    if cache is not None:
+        return cache.metrics(_scorer, pw, collector, compact)
+    return _scorer.metrics(pw, collector, compact)
+
+
+def entropy(pw):
+    """Returns only the entropy of a password"""
+    return _scorer.entropy(pw)
+
+
+def session(pw=''):
+    """Returns a Session for incrementally scoring a password"""
+    return _scorer.session(pw)
+
+
+def metrics_iter(passwords, workers=None, chunksize=1000, compact=False):
+    """Yields the metrics of each password, in order
+
+    Pass workers to score the passwords in that many processes.
+    """
+    return _scorer.metrics_iter(passwords, workers, chunksize, compact)
+
+
+def metrics_batch(passwords, entropy_only=False, workers=None, chunksize=1000, compact=False):
+    """Returns the metrics of many passwords, in order
+
+    With entropy_only the character groups and word sets are not collected,
+    and instead of a list of dicts you get a dict of the 'entropy',
+    'word_entropy' and 'character_entropy' columns as compact arrays.
+    With compact you get a list of Metrics tuples.
+
+    Pass workers to score the passwords in that many processes.
+    """
+    return _scorer.metrics_batch(passwords, entropy_only, workers, chunksize, compact)
@@ -0,0 +1,5 @@
+import sys
+
+from passwordmetrics.cli import main
+
+sys.exit(main())
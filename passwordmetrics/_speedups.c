@@ -0,0 +1,928 @@
+/*
+ * Optional C versions of the inner loops of passwordmetrics.
+ *
+ * They work on the same data as the Python code: the goto, fail and output
+ * lists of a _WordAutomaton, the flat arrays of a CompiledWordlist, the
+ * alternatives of the substitutions, and the latin1 table and index of a
+ * _GroupTable. passwordmetrics uses them when this module can be imported,
+ * and the Python code otherwise. The results are the same either way.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#define NO_GROUP 255
+#define MAX_GROUPS 64
+
+#if PY_VERSION_HEX >= 0x030C0000
+/* Strings are always ready from Python 3.12 */
+#define READY(o) 0
+#else
+#define READY(o) PyUnicode_READY(o)
+#endif
+
+/* The lowercase of each Latin-1 character, as a string */
+static PyObject *lowercase[256];
+
+
+/* Returns the state after reading c in state, or -1 on errors */
+static Py_ssize_t
+step(PyObject *goto_, PyObject *fail, Py_ssize_t state, PyObject *c)
+{
+    Py_ssize_t size = PyList_GET_SIZE(goto_);
+    for (;;) {
+        PyObject *edges, *next;
+        if (state < 0 || state >= size) {
+            PyErr_SetString(PyExc_ValueError, "Invalid automaton state");
+            return -1;
+        }
+        edges = PyList_GET_ITEM(goto_, state);
+        if (!PyDict_Check(edges)) {
+            PyErr_SetString(PyExc_TypeError, "goto must be a list of dicts");
+            return -1;
+        }
+        next = PyDict_GetItemWithError(edges, c);
+        if (next != NULL)
+            return PyLong_AsSsize_t(next);
+        if (PyErr_Occurred())
+            return -1;
+        if (state == 0)
+            return 0;
+        state = PyLong_AsSsize_t(PyList_GET_ITEM(fail, state));
+        if (state == -1 && PyErr_Occurred())
+            return -1;
+    }
+}
+
+
+/* Returns a new reference to the characters c can be read as, a sequence */
+static PyObject *
+readings(PyObject *alternatives, PyObject *c, Py_UCS4 code)
+{
+    PyObject *chars, *lower;
+
+    chars = PyDict_GetItemWithError(alternatives, c);
+    if (chars != NULL) {
+        int is_true = PyObject_IsTrue(chars);
+        if (is_true < 0)
+            return NULL;
+        if (is_true)
+            return PySequence_Fast(chars, "alternatives must be sequences");
+    }
+    else if (PyErr_Occurred())
+        return NULL;
+
+    if (code < 256) {
+        lower = lowercase[code];
+        Py_INCREF(lower);
+    }
+    else {
+        lower = PyObject_CallMethod(c, "lower", NULL);
+        if (lower == NULL)
+            return NULL;
+    }
+    chars = PyTuple_Pack(1, lower);
+    Py_DECREF(lower);
+    return chars;
+}
+
+
+/* Reads one character that may be any of chars, in any of the states.
+ * Replaces states with the new states, and returns a new reference to the
+ * tuple of the words that end here. Like _WordAutomaton.advance().
+ */
+static PyObject *
+advance(PyObject *goto_, PyObject *fail, PyObject *output,
+        Py_ssize_t **states, Py_ssize_t *count, Py_ssize_t *allocated, PyObject *chars)
+{
+    PyObject *next_states, *words = NULL, *result = NULL, *item, *iterator = NULL;
+    Py_ssize_t i, j, k, n_chars = PySequence_Fast_GET_SIZE(chars);
+
+    next_states = PySet_New(NULL);
+    if (next_states == NULL)
+        return NULL;
+    for (i = 0; i < *count; i++) {
+        for (j = 0; j < n_chars; j++) {
+            /* Each alternative is read from the same state. */
+            Py_ssize_t state = (*states)[i];
+            PyObject *edges, *next;
+            PyObject *c = PySequence_Fast_GET_ITEM(chars, j);
+            for (;;) {
+                edges = PyList_GET_ITEM(goto_, state);
+                next = PyDict_GetItemWithError(edges, c);
+                if (next != NULL || PyErr_Occurred() || state == 0)
+                    break;
+                state = PyLong_AsSsize_t(PyList_GET_ITEM(fail, state));
+                if (state == -1 && PyErr_Occurred())
+                    goto done;
+                if (state < 0 || state >= PyList_GET_SIZE(goto_)) {
+                    PyErr_SetString(PyExc_ValueError, "Invalid automaton state");
+                    goto done;
+                }
+            }
+            if (next == NULL) {
+                if (PyErr_Occurred())
+                    goto done;
+                item = PyLong_FromLong(0);
+            }
+            else {
+                Py_INCREF(next);
+                item = next;
+            }
+            if (item == NULL || PySet_Add(next_states, item) < 0) {
+                Py_XDECREF(item);
+                goto done;
+            }
+            Py_DECREF(item);
+        }
+    }
+    if (PySet_GET_SIZE(next_states) > 1) {
+        /* Any other state will find all that the root state would. */
+        item = PyLong_FromLong(0);
+        if (item == NULL || PySet_Discard(next_states, item) < 0) {
+            Py_XDECREF(item);
+            goto done;
+        }
+        Py_DECREF(item);
+    }
+
+    words = PySet_New(NULL);
+    if (words == NULL)
+        goto done;
+    if (PySet_GET_SIZE(next_states) > *allocated) {
+        Py_ssize_t *resized = PyMem_Realloc(*states, PySet_GET_SIZE(next_states) * sizeof(Py_ssize_t));
+        if (resized == NULL) {
+            PyErr_NoMemory();
+            goto done;
+        }
+        *states = resized;
+        *allocated = PySet_GET_SIZE(next_states);
+    }
+    iterator = PyObject_GetIter(next_states);
+    if (iterator == NULL)
+        goto done;
+    k = 0;
+    while ((item = PyIter_Next(iterator)) != NULL) {
+        Py_ssize_t state = PyLong_AsSsize_t(item);
+        PyObject *found;
+        Py_DECREF(item);
+        if (state == -1 && PyErr_Occurred())
+            goto done;
+        if (state < 0 || state >= PyList_GET_SIZE(output)) {
+            PyErr_SetString(PyExc_ValueError, "Invalid automaton state");
+            goto done;
+        }
+        (*states)[k++] = state;
+        found = PyList_GET_ITEM(output, state);
+        if (!PyTuple_Check(found)) {
+            PyErr_SetString(PyExc_TypeError, "output must be a list of tuples");
+            goto done;
+        }
+        for (j = 0; j < PyTuple_GET_SIZE(found); j++) {
+            if (PySet_Add(words, PyTuple_GET_ITEM(found, j)) < 0)
+                goto done;
+        }
+    }
+    if (PyErr_Occurred())
+        goto done;
+    *count = k;
+    result = PySequence_Tuple(words);
+
+done:
+    Py_XDECREF(iterator);
+    Py_XDECREF(words);
+    Py_DECREF(next_states);
+    return result;
+}
+
+
+PyDoc_STRVAR(scan_doc,
+"scan(goto, fail, output, pw, alternatives)\n\n"
+"Returns the words that end at each character of the password, like\n"
+"_WordAutomaton.scan().");
+
+static PyObject *
+scan(PyObject *self, PyObject *args)
+{
+    PyObject *goto_, *fail, *output, *pw, *alternatives, *result;
+    Py_ssize_t i, length, state, count = 1, allocated = 4;
+    Py_ssize_t *states;
+
+    if (!PyArg_ParseTuple(args, "O!O!O!UO!:scan", &PyList_Type, &goto_, &PyList_Type, &fail,
+                          &PyList_Type, &output, &pw, &PyDict_Type, &alternatives))
+        return NULL;
+    if (PyList_GET_SIZE(goto_) == 0 || PyList_GET_SIZE(fail) != PyList_GET_SIZE(goto_) ||
+            PyList_GET_SIZE(output) != PyList_GET_SIZE(goto_)) {
+        PyErr_SetString(PyExc_ValueError, "goto, fail and output must have the same length");
+        return NULL;
+    }
+    if (READY(pw) < 0)
+        return NULL;
+
+    length = PyUnicode_GET_LENGTH(pw);
+    result = PyList_New(length);
+    if (result == NULL)
+        return NULL;
+    states = PyMem_Malloc(allocated * sizeof(Py_ssize_t));
+    if (states == NULL) {
+        Py_DECREF(result);
+        return PyErr_NoMemory();
+    }
+    states[0] = 0;
+
+    for (i = 0; i < length; i++) {
+        Py_UCS4 code = PyUnicode_READ_CHAR(pw, i);
+        PyObject *c, *chars, *words;
+
+        c = PyUnicode_Substring(pw, i, i + 1);
+        if (c == NULL)
+            goto error;
+        chars = readings(alternatives, c, code);
+        Py_DECREF(c);
+        if (chars == NULL)
+            goto error;
+
+        if (count == 1 && PySequence_Fast_GET_SIZE(chars) == 1) {
+            /* The usual case, there is only one way to read the password. */
+            state = step(goto_, fail, states[0], PySequence_Fast_GET_ITEM(chars, 0));
+            Py_DECREF(chars);
+            if (state < 0)
+                goto error;
+            if (state >= PyList_GET_SIZE(output)) {
+                PyErr_SetString(PyExc_ValueError, "Invalid automaton state");
+                goto error;
+            }
+            states[0] = state;
+            words = PyList_GET_ITEM(output, state);
+            Py_INCREF(words);
+        }
+        else {
+            words = advance(goto_, fail, output, &states, &count, &allocated, chars);
+            Py_DECREF(chars);
+            if (words == NULL)
+                goto error;
+        }
+        PyList_SET_ITEM(result, i, words);
+    }
+    PyMem_Free(states);
+    return result;
+
+error:
+    PyMem_Free(states);
+    Py_DECREF(result);
+    return NULL;
+}
+
+
+/* The flat arrays of a CompiledWordlist */
+typedef struct {
+    Py_buffer views[8];
+    int n_views;
+    const unsigned int *first_edge, *fail, *own, *dict_link, *edge_chars, *edge_targets;
+    const unsigned int *key_offsets;
+    const char *keys;
+    Py_ssize_t nodes, edges, words, keys_size;
+} compiled_t;
+
+#define NO_WORD 0xFFFFFFFFU
+
+
+/* Gets a buffer attribute of the word list, returns NULL on errors */
+static const void *
+compiled_buffer(compiled_t *a, PyObject *wordlist, const char *name, Py_ssize_t itemsize,
+                Py_ssize_t *count)
+{
+    Py_buffer *view = &a->views[a->n_views];
+    PyObject *obj = PyObject_GetAttrString(wordlist, name);
+    int failed;
+    if (obj == NULL)
+        return NULL;
+    failed = PyObject_GetBuffer(obj, view, PyBUF_SIMPLE);
+    Py_DECREF(obj);
+    if (failed < 0)
+        return NULL;
+    a->n_views++;
+    if (view->len % itemsize) {
+        PyErr_SetString(PyExc_ValueError, "Invalid word list");
+        return NULL;
+    }
+    *count = view->len / itemsize;
+    return view->buf;
+}
+
+
+static void
+release_compiled(compiled_t *a)
+{
+    while (a->n_views)
+        PyBuffer_Release(&a->views[--a->n_views]);
+}
+
+
+/* Gets the arrays of a CompiledWordlist, returns -1 on errors */
+static int
+parse_compiled(compiled_t *a, PyObject *wordlist)
+{
+    Py_ssize_t n_first, n_fail, n_own, n_link, n_targets, n_offsets;
+
+    a->n_views = 0;
+    if ((a->first_edge = compiled_buffer(a, wordlist, "_first_edge", 4, &n_first)) == NULL ||
+            (a->fail = compiled_buffer(a, wordlist, "_fail", 4, &n_fail)) == NULL ||
+            (a->own = compiled_buffer(a, wordlist, "_own", 4, &n_own)) == NULL ||
+            (a->dict_link = compiled_buffer(a, wordlist, "_dict_link", 4, &n_link)) == NULL ||
+            (a->edge_chars = compiled_buffer(a, wordlist, "_edge_chars", 4, &a->edges)) == NULL ||
+            (a->edge_targets = compiled_buffer(a, wordlist, "_edge_targets", 4,
+                                               &n_targets)) == NULL ||
+            (a->key_offsets = compiled_buffer(a, wordlist, "_key_offsets", 4,
+                                              &n_offsets)) == NULL ||
+            (a->keys = compiled_buffer(a, wordlist, "_keys", 1, &a->keys_size)) == NULL) {
+        release_compiled(a);
+        return -1;
+    }
+    a->nodes = n_first - 1;
+    a->words = n_offsets - 1;
+    if (a->nodes < 1 || a->words < 0 || n_fail != a->nodes || n_own != a->nodes ||
+            n_link != a->nodes || n_targets != a->edges) {
+        release_compiled(a);
+        PyErr_SetString(PyExc_ValueError, "Invalid word list");
+        return -1;
+    }
+    return 0;
+}
+
+
+/* Returns a new reference to the word with the id */
+static PyObject *
+compiled_word(const compiled_t *a, unsigned int word_id)
+{
+    Py_ssize_t start, end;
+    if (word_id >= (size_t)a->words) {
+        PyErr_SetString(PyExc_ValueError, "Invalid word list");
+        return NULL;
+    }
+    start = a->key_offsets[word_id];
+    end = a->key_offsets[word_id + 1];
+    if (start > end || end > a->keys_size) {
+        PyErr_SetString(PyExc_ValueError, "Invalid word list");
+        return NULL;
+    }
+    return PyUnicode_DecodeUTF8(a->keys + start, end - start, NULL);
+}
+
+
+/* Returns the state after reading the character code in state, or -1 on
+ * errors. Like CompiledWordlist.step().
+ */
+static Py_ssize_t
+compiled_step(const compiled_t *a, Py_ssize_t state, Py_UCS4 code)
+{
+    for (;;) {
+        Py_ssize_t lo = a->first_edge[state], hi = a->first_edge[state + 1], end = hi;
+        if (lo > hi || hi > a->edges) {
+            PyErr_SetString(PyExc_ValueError, "Invalid word list");
+            return -1;
+        }
+        /* The edges of a node are sorted by character. */
+        while (lo < hi) {
+            Py_ssize_t mid = lo + (hi - lo) / 2;
+            if (a->edge_chars[mid] < code)
+                lo = mid + 1;
+            else
+                hi = mid;
+        }
+        if (lo < end && a->edge_chars[lo] == code) {
+            state = a->edge_targets[lo];
+            if (state >= a->nodes) {
+                PyErr_SetString(PyExc_ValueError, "Invalid automaton state");
+                return -1;
+            }
+            return state;
+        }
+        if (state == 0)
+            return 0;
+        state = a->fail[state];
+        if (state >= a->nodes) {
+            PyErr_SetString(PyExc_ValueError, "Invalid automaton state");
+            return -1;
+        }
+    }
+}
+
+
+/* Returns the state after reading c, a one character string. Anything
+ * else, such as a lowercase of several characters, is never in a word.
+ */
+static Py_ssize_t
+compiled_read(const compiled_t *a, Py_ssize_t state, PyObject *c)
+{
+    if (!PyUnicode_Check(c) || READY(c) < 0 || PyUnicode_GET_LENGTH(c) != 1) {
+        if (PyErr_Occurred())
+            return -1;
+        return 0;
+    }
+    return compiled_step(a, state, PyUnicode_READ_CHAR(c, 0));
+}
+
+
+/* Returns the next state on the dictionary links with a word of its own,
+ * or 0 at the end, or -1 on errors. Like CompiledWordlist.words_at().
+ */
+static Py_ssize_t
+next_word_state(const compiled_t *a, Py_ssize_t state, Py_ssize_t *links)
+{
+    do {
+        state = a->dict_link[state];
+        if (state >= a->nodes || ++*links > a->nodes) {
+            PyErr_SetString(PyExc_ValueError, "Invalid word list");
+            return -1;
+        }
+    } while (state && a->own[state] == NO_WORD);
+    return state;
+}
+
+
+/* Returns a new reference to the tuple of the words that end in state */
+static PyObject *
+compiled_words(const compiled_t *a, Py_ssize_t state, PyObject *empty)
+{
+    PyObject *words;
+    Py_ssize_t s, count = 0, links = 0;
+
+    s = a->own[state] != NO_WORD ? state : next_word_state(a, state, &links);
+    for (; s > 0; s = next_word_state(a, s, &links))
+        count++;
+    if (s < 0)
+        return NULL;
+    if (count == 0) {
+        Py_INCREF(empty);
+        return empty;
+    }
+
+    words = PyTuple_New(count);
+    if (words == NULL)
+        return NULL;
+    links = 0;
+    count = 0;
+    s = a->own[state] != NO_WORD ? state : next_word_state(a, state, &links);
+    for (; s > 0; s = next_word_state(a, s, &links)) {
+        PyObject *word = compiled_word(a, a->own[s]);
+        if (word == NULL) {
+            Py_DECREF(words);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(words, count++, word);
+    }
+    return words;
+}
+
+
+/* Adds the words that end in state to the set, returns -1 on errors */
+static int
+add_compiled_words(const compiled_t *a, Py_ssize_t state, PyObject *set)
+{
+    Py_ssize_t s, links = 0;
+
+    s = a->own[state] != NO_WORD ? state : next_word_state(a, state, &links);
+    for (; s > 0; s = next_word_state(a, s, &links)) {
+        PyObject *word = compiled_word(a, a->own[s]);
+        if (word == NULL || PySet_Add(set, word) < 0) {
+            Py_XDECREF(word);
+            return -1;
+        }
+        Py_DECREF(word);
+    }
+    return s < 0 ? -1 : 0;
+}
+
+
+PyDoc_STRVAR(scan_compiled_doc,
+"scan_compiled(wordlist, pw, alternatives)\n\n"
+"Returns the words that end at each character of the password, like\n"
+"CompiledWordlist.scan(), reading the arrays of the word list directly.");
+
+static PyObject *
+scan_compiled(PyObject *self, PyObject *args)
+{
+    PyObject *wordlist, *pw, *alternatives, *result = NULL, *empty = NULL;
+    compiled_t a;
+    Py_ssize_t i, j, k, length, count = 1;
+    Py_ssize_t *states = NULL, *next_states = NULL;
+
+    if (!PyArg_ParseTuple(args, "OUO!:scan_compiled", &wordlist, &pw,
+                          &PyDict_Type, &alternatives))
+        return NULL;
+    if (READY(pw) < 0 || parse_compiled(&a, wordlist) < 0)
+        return NULL;
+
+    length = PyUnicode_GET_LENGTH(pw);
+    empty = PyTuple_New(0);
+    if (empty == NULL)
+        goto error;
+    result = PyList_New(length);
+    if (result == NULL)
+        goto error;
+    states = PyMem_Malloc(sizeof(Py_ssize_t));
+    if (states == NULL) {
+        PyErr_NoMemory();
+        goto error;
+    }
+    states[0] = 0;
+
+    for (i = 0; i < length; i++) {
+        PyObject *c, *chars, *words;
+        Py_ssize_t n_chars, next_count = 0;
+
+        c = PyUnicode_Substring(pw, i, i + 1);
+        if (c == NULL)
+            goto error;
+        chars = readings(alternatives, c, PyUnicode_READ_CHAR(pw, i));
+        Py_DECREF(c);
+        if (chars == NULL)
+            goto error;
+        n_chars = PySequence_Fast_GET_SIZE(chars);
+
+        if (count == 1 && n_chars == 1) {
+            /* The usual case, there is only one way to read the password. */
+            Py_ssize_t state = compiled_read(&a, states[0], PySequence_Fast_GET_ITEM(chars, 0));
+            Py_DECREF(chars);
+            if (state < 0)
+                goto error;
+            states[0] = state;
+            words = compiled_words(&a, state, empty);
+            if (words == NULL)
+                goto error;
+            PyList_SET_ITEM(result, i, words);
+            continue;
+        }
+
+        /* Each alternative is read from each of the states. */
+        next_states = PyMem_Malloc(count * n_chars * sizeof(Py_ssize_t));
+        if (next_states == NULL) {
+            Py_DECREF(chars);
+            PyErr_NoMemory();
+            goto error;
+        }
+        for (j = 0; j < count; j++) {
+            for (k = 0; k < n_chars; k++) {
+                Py_ssize_t m, state;
+                state = compiled_read(&a, states[j], PySequence_Fast_GET_ITEM(chars, k));
+                if (state < 0) {
+                    Py_DECREF(chars);
+                    goto error;
+                }
+                for (m = 0; m < next_count && next_states[m] != state; m++)
+                    ;
+                if (m == next_count)
+                    next_states[next_count++] = state;
+            }
+        }
+        Py_DECREF(chars);
+        if (next_count > 1) {
+            /* Any other state will find all that the root state would. */
+            for (j = 0; j < next_count && next_states[j] != 0; j++)
+                ;
+            if (j < next_count)
+                next_states[j] = next_states[--next_count];
+        }
+        PyMem_Free(states);
+        states = next_states;
+        next_states = NULL;
+        count = next_count;
+
+        c = PySet_New(NULL);
+        if (c == NULL)
+            goto error;
+        for (j = 0; j < count; j++) {
+            if (add_compiled_words(&a, states[j], c) < 0) {
+                Py_DECREF(c);
+                goto error;
+            }
+        }
+        words = PySequence_Tuple(c);
+        Py_DECREF(c);
+        if (words == NULL)
+            goto error;
+        PyList_SET_ITEM(result, i, words);
+    }
+    PyMem_Free(states);
+    Py_DECREF(empty);
+    release_compiled(&a);
+    return result;
+
+error:
+    PyMem_Free(states);
+    PyMem_Free(next_states);
+    Py_XDECREF(empty);
+    Py_XDECREF(result);
+    release_compiled(&a);
+    return NULL;
+}
+
+
+PyDoc_STRVAR(word_id_doc,
+"word_id(wordlist, word)\n\n"
+"Returns the id of the word in the CompiledWordlist, or None, like\n"
+"CompiledWordlist._word_id().");
+
+static PyObject *
+word_id(PyObject *self, PyObject *args)
+{
+    PyObject *wordlist, *word;
+    compiled_t a;
+    Py_ssize_t i, length, state = 0;
+
+    if (!PyArg_ParseTuple(args, "OU:word_id", &wordlist, &word))
+        return NULL;
+    if (READY(word) < 0 || parse_compiled(&a, wordlist) < 0)
+        return NULL;
+    length = PyUnicode_GET_LENGTH(word);
+    for (i = 0; i < length && state >= 0; i++) {
+        /* Only the edges, a word is never found on a failure link. */
+        Py_UCS4 code = PyUnicode_READ_CHAR(word, i);
+        Py_ssize_t lo = a.first_edge[state], hi = a.first_edge[state + 1], end = hi;
+        if (lo > hi || hi > a.edges) {
+            PyErr_SetString(PyExc_ValueError, "Invalid word list");
+            release_compiled(&a);
+            return NULL;
+        }
+        while (lo < hi) {
+            Py_ssize_t mid = lo + (hi - lo) / 2;
+            if (a.edge_chars[mid] < code)
+                lo = mid + 1;
+            else
+                hi = mid;
+        }
+        if (lo < end && a.edge_chars[lo] == code && a.edge_targets[lo] < (size_t)a.nodes)
+            state = a.edge_targets[lo];
+        else
+            state = -1;
+    }
+    if (state < 0 || a.own[state] == NO_WORD) {
+        release_compiled(&a);
+        Py_RETURN_NONE;
+    }
+    i = a.own[state];
+    release_compiled(&a);
+    return PyLong_FromSsize_t(i);
+}
+
+
+/* Gets the code of a one character string, or returns 0 for anything else */
+static int
+character_code(PyObject *c, Py_UCS4 *code)
+{
+    if (PyUnicode_Check(c)) {
+        if (READY(c) < 0 || PyUnicode_GET_LENGTH(c) != 1)
+            return 0;
+        *code = PyUnicode_READ_CHAR(c, 0);
+        return 1;
+    }
+    if (PyBytes_Check(c) && PyBytes_GET_SIZE(c) == 1) {
+        *code = (unsigned char)PyBytes_AS_STRING(c)[0];
+        return 1;
+    }
+    return 0;
+}
+
+
+static int
+parse_table(PyObject *latin1, Py_buffer *view)
+{
+    if (PyObject_GetBuffer(latin1, view, PyBUF_SIMPLE) < 0)
+        return -1;
+    if (view->len != 256) {
+        PyBuffer_Release(view);
+        PyErr_SetString(PyExc_ValueError, "latin1 must have 256 entries");
+        return -1;
+    }
+    return 0;
+}
+
+
+/* Returns the group of an index entry, or -1 on errors */
+static long
+group_id(PyObject *group_ids, Py_ssize_t i)
+{
+    long group = PyLong_AsLong(PySequence_Fast_GET_ITEM(group_ids, i));
+    if (group == -1 && PyErr_Occurred())
+        return -1;
+    if (group < 0 || group >= MAX_GROUPS) {
+        PyErr_SetString(PyExc_ValueError, "Too many groups");
+        return -1;
+    }
+    return group;
+}
+
+
+PyDoc_STRVAR(group_mask_doc,
+"group_mask(chars, used, latin1, index, groups)\n\n"
+"Adds the groups used by the characters to the used bit mask, like\n"
+"Scorer._group_mask(). groups is the number of groups, at most 64.");
+
+static PyObject *
+group_mask(PyObject *self, PyObject *args)
+{
+    PyObject *chars, *latin1, *index, *iterator, *c;
+    unsigned long long used, all_groups;
+    int groups;
+    Py_buffer view;
+    const unsigned char *table;
+
+    if (!PyArg_ParseTuple(args, "OKOO!i:group_mask", &chars, &used, &latin1,
+                          &PyDict_Type, &index, &groups))
+        return NULL;
+    if (groups < 0 || groups > MAX_GROUPS) {
+        PyErr_SetString(PyExc_ValueError, "Too many groups");
+        return NULL;
+    }
+    all_groups = groups == MAX_GROUPS ? ~0ULL : (1ULL << groups) - 1;
+    if (parse_table(latin1, &view) < 0)
+        return NULL;
+    table = view.buf;
+    iterator = PyObject_GetIter(chars);
+    if (iterator == NULL) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+
+    while ((c = PyIter_Next(iterator)) != NULL) {
+        Py_UCS4 code;
+        if (!character_code(c, &code)) {
+            /* Bytes on Python 3, which are in no group. */
+            Py_DECREF(c);
+            continue;
+        }
+        if (code < 256 && table[code] != NO_GROUP) {
+            used |= 1ULL << table[code];
+        }
+        else {
+            /* Characters in several groups mark the first one not yet used. */
+            PyObject *group_ids = PyDict_GetItemWithError(index, c);
+            if (group_ids != NULL) {
+                Py_ssize_t i;
+                group_ids = PySequence_Fast(group_ids, "index values must be sequences");
+                if (group_ids == NULL) {
+                    Py_DECREF(c);
+                    goto error;
+                }
+                for (i = 0; i < PySequence_Fast_GET_SIZE(group_ids); i++) {
+                    long group = group_id(group_ids, i);
+                    if (group < 0) {
+                        Py_DECREF(group_ids);
+                        Py_DECREF(c);
+                        goto error;
+                    }
+                    if (!(used & 1ULL << group)) {
+                        used |= 1ULL << group;
+                        break;
+                    }
+                }
+                Py_DECREF(group_ids);
+            }
+            else if (PyErr_Occurred()) {
+                Py_DECREF(c);
+                goto error;
+            }
+        }
+        Py_DECREF(c);
+        if (used == all_groups)
+            break;
+    }
+    if (PyErr_Occurred())
+        goto error;
+    Py_DECREF(iterator);
+    PyBuffer_Release(&view);
+    return PyLong_FromUnsignedLongLong(used);
+
+error:
+    Py_DECREF(iterator);
+    PyBuffer_Release(&view);
+    return NULL;
+}
+
+
+PyDoc_STRVAR(character_groups_doc,
+"character_groups(pw, latin1, index)\n\n"
+"Returns the bit mask of the groups of the characters in the password, the\n"
+"set of characters in no group and the number of different characters, as\n"
+"Scorer.character_entropy() finds them. Characters in several groups count\n"
+"as their first group.");
+
+static PyObject *
+character_groups(PyObject *self, PyObject *args)
+{
+    PyObject *pw, *latin1, *index, *unknown = NULL, *others = NULL, *c = NULL;
+    unsigned long long used = 0;
+    unsigned char seen[256] = {0};
+    Py_ssize_t i, length, unique = 0;
+    Py_buffer view;
+    const unsigned char *table;
+
+    if (!PyArg_ParseTuple(args, "UOO!:character_groups", &pw, &latin1, &PyDict_Type, &index))
+        return NULL;
+    if (READY(pw) < 0)
+        return NULL;
+    if (parse_table(latin1, &view) < 0)
+        return NULL;
+    table = view.buf;
+    unknown = PySet_New(NULL);
+    others = PySet_New(NULL);
+    if (unknown == NULL || others == NULL)
+        goto error;
+
+    length = PyUnicode_GET_LENGTH(pw);
+    for (i = 0; i < length; i++) {
+        Py_UCS4 code = PyUnicode_READ_CHAR(pw, i);
+        PyObject *group_ids;
+        if (code < 256) {
+            if (seen[code])
+                continue;
+            seen[code] = 1;
+        }
+        c = PyUnicode_Substring(pw, i, i + 1);
+        if (c == NULL)
+            goto error;
+        if (code >= 256) {
+            int contains = PySet_Contains(others, c);
+            if (contains < 0 || (!contains && PySet_Add(others, c) < 0))
+                goto error;
+            if (contains) {
+                Py_CLEAR(c);
+                continue;
+            }
+        }
+        unique++;
+
+        if (code < 256 && table[code] != NO_GROUP) {
+            used |= 1ULL << table[code];
+        }
+        else if ((group_ids = PyDict_GetItemWithError(index, c)) != NULL) {
+            long group;
+            group_ids = PySequence_Fast(group_ids, "index values must be sequences");
+            if (group_ids == NULL)
+                goto error;
+            group = PySequence_Fast_GET_SIZE(group_ids) ? group_id(group_ids, 0) : -2;
+            Py_DECREF(group_ids);
+            if (group == -2) {
+                PyErr_SetString(PyExc_IndexError, "Empty index entry");
+                goto error;
+            }
+            if (group < 0)
+                goto error;
+            used |= 1ULL << group;
+        }
+        else if (PyErr_Occurred()) {
+            goto error;
+        }
+        else if (PySet_Add(unknown, c) < 0) {
+            /* The character is in none of the groups */
+            goto error;
+        }
+        Py_CLEAR(c);
+    }
+    Py_DECREF(others);
+    PyBuffer_Release(&view);
+    return Py_BuildValue("KNn", used, unknown, unique);
+
+error:
+    Py_XDECREF(c);
+    Py_XDECREF(unknown);
+    Py_XDECREF(others);
+    PyBuffer_Release(&view);
+    return NULL;
+}
+
+
+static PyMethodDef methods[] = {
+    {"scan", scan, METH_VARARGS, scan_doc},
+    {"scan_compiled", scan_compiled, METH_VARARGS, scan_compiled_doc},
+    {"word_id", word_id, METH_VARARGS, word_id_doc},
+    {"group_mask", group_mask, METH_VARARGS, group_mask_doc},
+    {"character_groups", character_groups, METH_VARARGS, character_groups_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT,
+    "passwordmetrics._speedups",
+    "C versions of the inner loops of passwordmetrics.",
+    -1,
+    methods
+};
+
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    int i;
+    for (i = 0; i < 256; i++) {
+        PyObject *c = PyUnicode_FromOrdinal(i);
+        if (c == NULL)
+            return NULL;
+        lowercase[i] = PyObject_CallMethod(c, "lower", NULL);
+        Py_DECREF(c);
+        if (lowercase[i] == NULL)
+            return NULL;
+    }
+    return PyModule_Create(&module);
+}
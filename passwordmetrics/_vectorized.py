@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Character groups and character entropy for many strings at once.
+
+This uses NumPy if it's installed. It's imported the first time it's
+needed, as it takes longer to import than all of passwordmetrics. All the
+strings are encoded into one array of code points, and the unique
+characters of each string are looked up in the group table with array
+operations. The entropies are then calculated per string with the same
+math as Scorer.character_entropy(), so the results are exactly the same.
+
+When NumPy isn't installed, or for strings or groups it can't handle, the
+functions return None and the caller does it in Python.
+"""
+# The numpy module, once _import_numpy() has found it.
+numpy = None
+_imported = False
+
+try:
+    _chr = unichr
+except NameError:  # Python 3
+    _chr = chr
+
+_text_type = type(u'')
+
+# The groups used are a bit mask in an unsigned 64 bit integer.
+_MAX_GROUPS = 63
+_NO_GROUP = 255
+# Code points are at most 21 bits, the rest of the key is the string number.
+_CODE_BITS = 21
+
+
+def _import_numpy():
+    global numpy, _imported
+    if not _imported:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+        _imported = True
+    return numpy
+
+
+def available():
+    """Returns True if NumPy is installed"""
+    return _import_numpy() is not None
+
+
+def _analyze(table, strings):
+    """Returns the number of unique characters, used groups and unknown
+    characters of each string, or None if it can't be done with NumPy
+
+    Characters in several groups count as their first group, like in
+    Scorer.character_entropy().
+    """
+    if _import_numpy() is None or len(table.names) > _MAX_GROUPS:
+        return None
+    for s in strings:
+        if not isinstance(s, _text_type):
+            return None
+
+    count = len(strings)
+    lengths = numpy.fromiter((len(s) for s in strings), dtype=numpy.int64, count=count)
+    codes = numpy.frombuffer(u''.join(strings).encode('utf-32-le', 'surrogatepass'),
+                             dtype='<u4').astype(numpy.uint64)
+    if len(codes) != lengths.sum():
+        # A narrow Python 2 build, where a character can be two code units.
+        return None
+
+    # Sorting the keys of string number and code point gives the unique
+    # characters of each string, in string order.
+    strings_of = numpy.repeat(numpy.arange(count, dtype=numpy.uint64), lengths)
+    keys = (strings_of << numpy.uint64(_CODE_BITS)) | codes
+    keys.sort()
+    if len(keys):
+        keys = keys[numpy.concatenate(([True], keys[1:] != keys[:-1]))]
+    strings_of = (keys >> numpy.uint64(_CODE_BITS)).astype(numpy.intp)
+    codes = keys & numpy.uint64((1 << _CODE_BITS) - 1)
+    unique = numpy.bincount(strings_of, minlength=count)
+
+    group_ids = numpy.full(len(codes), _NO_GROUP, dtype=numpy.uint8)
+    low = codes < 256
+    group_ids[low] = numpy.frombuffer(bytes(table.first_latin1), dtype=numpy.uint8)[
+        codes[low].astype(numpy.intp)]
+    index = table.index
+    for i in numpy.flatnonzero(~low):
+        group_ids[i] = index.get(_chr(int(codes[i])), (_NO_GROUP,))[0]
+
+    known = group_ids != _NO_GROUP
+    bits = numpy.zeros(len(codes), dtype=numpy.uint64)
+    bits[known] = numpy.left_shift(numpy.uint64(1), group_ids[known].astype(numpy.uint64))
+    masks = numpy.zeros(count, dtype=numpy.uint64)
+    nonempty = unique > 0
+    if nonempty.any():
+        starts = numpy.concatenate(([0], numpy.cumsum(unique)[:-1]))[nonempty]
+        masks[nonempty] = numpy.bitwise_or.reduceat(bits, starts)
+
+    unknown = {}
+    for i in numpy.flatnonzero(~known):
+        unknown.setdefault(int(strings_of[i]), set()).add(_chr(int(codes[i])))
+    return unique, masks, unknown
+
+
+def group_masks(table, strings):
+    """Returns the bit mask of used groups of each string, or None
+
+    Only for disjoint groups, otherwise the order of the characters matters.
+    """
+    if not table.disjoint:
+        return None
+    result = _analyze(table, strings)
+    if result is None:
+        return None
+    return [int(mask) for mask in result[1].tolist()]
+
+
+def character_entropies(table, strings):
+    """Returns the character entropy and unknown characters of each string, or None"""
+    result = _analyze(table, strings)
+    if result is None:
+        return None
+    unique, masks, unknown = result
+    nonempty = unique > 0
+    # There are only a few different sets of groups, so their bits are found
+    # by the group table like in Python, and then looked up for each string.
+    distinct, inverse = numpy.unique(masks, return_inverse=True)
+    bits = numpy.array([table.bits(mask) for mask in distinct.tolist()])
+    entropies = (unique * bits[inverse.reshape(-1)]).tolist()
+    for i in numpy.flatnonzero(nonempty & (masks == 0)).tolist():
+        # Only unknown characters, which are a group of their own.
+        entropies[i] = int(unique[i]) * table.bits(0, len(unknown[i]))
+    return [(entropies[i], unknown.get(i, set())) if has_chars else (0, set())
+            for i, has_chars in enumerate(nonempty.tolist())]
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Scoring passwords from asyncio code.
+
+Scoring a long passphrase can take milliseconds, which blocks the event loop
+if you call metrics() from a coroutine. The functions here instead score the
+passwords in an executor, and give the same results as metrics().
+
+This module needs Python 3.5 or later.
+"""
+import asyncio
+import collections
+import multiprocessing
+import threading
+import weakref
+
+import passwordmetrics
+
+# The scorers jobs have been sent, by fingerprint. Each process of a process
+# pool has its own, so a scorer is only sent to a process once. In a worker
+# process the registry is all that keeps the scorers, so it holds the last
+# few. In the main process the callers have them, and the registry only
+# holds weak references, so replaced configurations aren't kept alive.
+_scorers = collections.OrderedDict()
+_weak_scorers = weakref.WeakValueDictionary()
+_scorers_lock = threading.Lock()
+_MAX_SCORERS = 4
+
+
+def _in_worker():
+    return multiprocessing.current_process().name != 'MainProcess'
+
+
+def _metrics(pw, scorer):
+    return scorer.metrics(pw)
+
+
+def _job(function, fingerprint, arg, scorer=None):
+    """Calls function(arg, scorer) with the scorer of the fingerprint
+
+    Returns None if the scorer isn't known here, and then the job is sent
+    again with the scorer.
+    """
+    in_worker = _in_worker()
+    with _scorers_lock:
+        if scorer is not None:
+            if in_worker:
+                _scorers[fingerprint] = scorer
+                while len(_scorers) > _MAX_SCORERS:
+                    _scorers.popitem(last=False)
+            else:
+                _weak_scorers[fingerprint] = scorer
+        else:
+            scorer = (_scorers if in_worker else _weak_scorers).get(fingerprint)
+            if scorer is None:
+                return None
+    return function(arg, scorer)
+
+
+class AsyncScorer(object):
+    """Scores passwords in an executor, for use with asyncio
+
+    scorer is the Scorer to use. By default it's the one that configure()
+    set up, at the time of each call.
+
+    executor is a concurrent.futures executor, by default the default
+    executor of the event loop. Jobs only send the fingerprint of the
+    scorer, and the scorer itself is sent once to each process that doesn't
+    have it yet.
+
+    Concurrent requests for the same password are scored once, and at most
+    max_pending jobs are in the executor at a time. Further calls wait until
+    there is room.
+    """
+
+    def __init__(self, scorer=None, executor=None, max_pending=64):
+        if max_pending < 1:
+            raise ValueError('max_pending must be at least 1')
+        self.scorer = scorer
+        self.executor = executor
+        self.max_pending = max_pending
+        # The semaphore and the requests in flight, for each event loop.
+        self._loops = weakref.WeakKeyDictionary()
+
+    def _state(self, loop):
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = (asyncio.Semaphore(self.max_pending), {})
+        return state
+
+    async def _run(self, loop, semaphore, function, arg, scorer):
+        async with semaphore:
+            result = await loop.run_in_executor(self.executor, _job, function,
+                                                scorer.fingerprint, arg)
+            if result is None:
+                # The process that got the job hasn't got the scorer yet.
+                result = await loop.run_in_executor(self.executor, _job, function,
+                                                    scorer.fingerprint, arg, scorer)
+            return result
+
+    async def metrics(self, pw):
+        """Returns the metrics of a password"""
+        loop = asyncio.get_event_loop()
+        semaphore, in_flight = self._state(loop)
+        scorer = self.scorer or passwordmetrics._scorer
+        key = (scorer.fingerprint, pw)
+        future = in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(loop, semaphore, _metrics, pw, scorer))
+            in_flight[key] = future
+            future.add_done_callback(lambda f: in_flight.pop(key, None))
+        # shield(), so one caller being cancelled doesn't cancel the others.
+        result = await asyncio.shield(future)
+        # Everyone waiting for the same password gets their own copy.
+        return passwordmetrics._copy_metrics(result)
+
+    async def metrics_batch(self, passwords, chunksize=100):
+        """Returns the metrics of many passwords, in order
+
+        The passwords are sent to the executor in chunks of chunksize.
+        """
+        loop = asyncio.get_event_loop()
+        semaphore, in_flight = self._state(loop)
+        scorer = self.scorer or passwordmetrics._scorer
+        passwords = list(passwords)
+        jobs = [self._run(loop, semaphore, passwordmetrics._metrics_chunk,
+                          passwords[i:i + chunksize], scorer)
+                for i in range(0, len(passwords), chunksize)]
+        result = []
+        for chunk in await asyncio.gather(*jobs):
+            result.extend(chunk)
+        return result
+
+
+_default = AsyncScorer()
+
+
+async def ametrics(pw):
+    """Returns the metrics of a password, scored in the default executor"""
+    return await _default.metrics(pw)
+
+
+async def ametrics_batch(passwords, chunksize=100):
+    """Returns the metrics of many passwords, scored in the default executor"""
+    return await _default.metrics_batch(passwords, chunksize)
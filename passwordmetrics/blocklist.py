@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""A memory mapped Bloom filter of breached passwords.
+
+A password that has been leaked is easy to guess however random it looks,
+as attackers try the leaked passwords first. Lists of them can have hundreds
+of millions of passwords, so instead of keeping them in a set they are
+built into a Bloom filter file once, which is then memory mapped.
+
+A Bloom filter never misses a password that is in it, but with a chosen
+probability, the false positive rate, it says that a password is in it that
+isn't. The file holds a header and the bit array:
+
+    magic, version, number of hashes, number of bits, number of passwords
+
+All numbers are little-endian.
+"""
+from __future__ import print_function
+
+import argparse
+import codecs
+import hashlib
+import math
+import mmap
+import struct
+from io import open
+
+from passwordmetrics.compiled import _array_view, _align, _view
+
+MAGIC = b'PWMBLOOM'
+VERSION = 1
+
+# magic, version, hashes, bits, passwords
+_HEADER = struct.Struct('<8sIIQQ')
+_OFFSET = _align(_HEADER.size)
+_DIGEST = struct.Struct('<QQ')
+
+try:
+    codecs.lookup_error('surrogateescape')
+    _ERRORS = 'surrogateescape'
+except LookupError:  # Python 2
+    _ERRORS = 'strict'
+
+try:
+    # MD5 only spreads the passwords over the filter here, it isn't used for
+    # security, and saying so makes it work on FIPS mode Pythons.
+    hashlib.md5(usedforsecurity=False)
+    _MD5_ARGS = {'usedforsecurity': False}
+except TypeError:  # Before Python 3.9
+    _MD5_ARGS = {}
+
+
+def _parameters(count, fp_rate):
+    """Returns the number of bits and hashes for count passwords"""
+    if not 0 < fp_rate < 1:
+        raise ValueError('fp_rate must be between 0 and 1')
+    count = max(count, 1)
+    bits = int(math.ceil(-count * math.log(fp_rate) / math.log(2) ** 2))
+    hashes = max(int(round(float(bits) / count * math.log(2))), 1)
+    return bits, hashes
+
+
+def _positions(pw, hashes, bits):
+    """Returns the bits of the password, with double hashing"""
+    if not isinstance(pw, bytes):
+        pw = pw.encode('utf-8', 'surrogatepass')
+    h1, h2 = _DIGEST.unpack(hashlib.md5(pw, **_MD5_ARGS).digest())
+    # An odd step never has a cycle shorter than the filter.
+    h2 |= 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def write_blocklist(passwords, path, count, fp_rate=0.001):
+    """Builds a filter of the passwords into a file
+
+    count is the number of passwords, which sets the size of the filter.
+    The bit array is built in memory, it's about 1.8 bytes per password for
+    a false positive rate of 0.001.
+    """
+    bits, hashes = _parameters(count, fp_rate)
+    data = bytearray((bits + 7) // 8)
+    added = 0
+    for pw in passwords:
+        for position in _positions(pw, hashes, bits):
+            data[position >> 3] |= 1 << (position & 7)
+        added += 1
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, hashes, bits, added))
+        f.write(b'\0' * (_OFFSET - _HEADER.size))
+        f.write(bytes(data))
+
+
+def _read_passwords(path, encoding):
+    with open(path, 'rt', encoding=encoding, errors=_ERRORS, newline='\n') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.endswith('\r'):
+                line = line[:-1]
+            if line:
+                yield line
+
+
+def build_blocklist(infile, outfile, fp_rate=0.001, encoding='utf-8'):
+    """Builds a filter from a file with one password per line
+
+    The file is read twice, first to count the passwords, so it's never
+    all in memory.
+    """
+    count = sum(1 for pw in _read_passwords(infile, encoding))
+    write_blocklist(_read_passwords(infile, encoding), outfile, count, fp_rate)
+
+
+class Blocklist(object):
+    """A memory mapped filter of breached passwords
+
+    It can be passed as ``blocklist`` to configure(), or used directly with
+    ``password in blocklist``.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < _OFFSET:
+            raise ValueError('Not a blocklist')
+        magic, version, self.hashes, self.bits, self.count = \
+            _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a blocklist')
+        if version != VERSION:
+            raise ValueError('Unsupported blocklist version %s' % version)
+        size = (self.bits + 7) // 8
+        if len(self._buffer) < _OFFSET + size:
+            # Otherwise it would only fail when a password hits the missing part.
+            raise ValueError('The blocklist is truncated, it should have %s bytes of bits'
+                             % size)
+        self._data = _array_view(_view(self._buffer), _OFFSET, size, 'B')
+
+    def __reduce__(self):
+        # Other processes map the same file rather than get a copy.
+        return (Blocklist, (self._path,))
+
+    def __contains__(self, pw):
+        data = self._data
+        for position in _positions(pw, self.hashes, self.bits):
+            if not data[position >> 3] & 1 << (position & 7):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def fp_rate(self):
+        """The expected false positive rate"""
+        if not self.count:
+            return 0.0
+        return (1 - math.exp(-float(self.hashes) * self.count / self.bits)) ** self.hashes
+
+    @property
+    def entropy(self):
+        """The entropy of a password in the list
+
+        An attacker can guess it by trying every password in the list.
+        """
+        if self.count < 2:
+            return 0.0
+        return math.log(self.count, 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Builds a blocklist from a file with one breached password per line.')
+    parser.add_argument('infile')
+    parser.add_argument('outfile')
+    parser.add_argument('--fp-rate', type=float, default=0.001,
+                        help='The rate of false positives, by default 0.001')
+    parser.add_argument('--encoding', default='utf-8')
+    args = parser.parse_args(argv)
+    build_blocklist(args.infile, args.outfile, args.fp_rate, args.encoding)
+    blocklist = Blocklist(args.outfile)
+    print('%s passwords, %s bytes, %s hashes' % (len(blocklist), (blocklist.bits + 7) // 8,
+                                                  blocklist.hashes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Scores passwords from the command line.
+
+Reads one password per line, from a file or stdin, and writes the metrics
+as CSV or JSON lines. For example, to find the weak passwords in a list:
+
+    passwordmetrics --max-entropy 40 --fields password,entropy,words passwords.txt
+"""
+from __future__ import print_function
+
+import argparse
+import codecs
+import csv
+import errno
+import io
+import itertools
+import json
+import os
+import re
+import sys
+
+import passwordmetrics
+
+try:
+    from itertools import izip as zip
+except ImportError:  # Python 3
+    pass
+
+FIELDS = ('password', 'entropy', 'word_entropy', 'character_entropy', 'length',
+          'words', 'used_groups', 'unused_groups', 'unknown_chars')
+
+# Big reads and writes, as the files can have millions of passwords.
+BUFFER_SIZE = 1 << 20
+
+try:
+    # Passwords that aren't valid in the encoding are written out as they were.
+    codecs.lookup_error('surrogateescape')
+    ERRORS = 'surrogateescape'
+except LookupError:  # Python 2
+    def _escape(error):
+        """Decodes each undecodable byte to a lone surrogate, like surrogateescape"""
+        if not isinstance(error, UnicodeDecodeError):
+            raise error
+        return (u''.join(unichr(0xdc00 + ord(b)) for b in error.object[error.start:error.end]),
+                error.end)
+
+    codecs.register_error('passwordmetrics.surrogateescape', _escape)
+    ERRORS = 'passwordmetrics.surrogateescape'
+
+# The bytes escaped when reading, written back by _Py2Writer
+_ESCAPED = re.compile(u'[\udc80-\udcff]+')
+
+
+def _open_input(path, encoding):
+    if path == '-':
+        raw = io.open(sys.stdin.fileno(), 'rb', buffering=BUFFER_SIZE, closefd=False)
+    else:
+        raw = io.open(path, 'rb', buffering=BUFFER_SIZE)
+    # Only split on newlines, a password can have a carriage return in it.
+    return io.TextIOWrapper(raw, encoding=encoding, errors=ERRORS, newline='\n')
+
+
+def _open_output(path, encoding):
+    if path == '-':
+        raw = io.open(sys.stdout.fileno(), 'wb', buffering=BUFFER_SIZE, closefd=False)
+    else:
+        raw = io.open(path, 'wb', buffering=BUFFER_SIZE)
+    if str is bytes:
+        # Python 2 can't encode the escaped bytes back, _Py2Writer does.
+        return raw
+    # newline='' as the csv module writes its own line endings.
+    return io.TextIOWrapper(raw, encoding=encoding, errors=ERRORS, newline='')
+
+
+def read_passwords(lines):
+    """Yields the passwords, without the line endings"""
+    for line in lines:
+        if line.endswith('\n'):
+            line = line[:-1]
+            if line.endswith('\r'):
+                line = line[:-1]
+        yield line
+
+
+def _value(value):
+    if isinstance(value, set):
+        return sorted(value)
+    return value
+
+
+def score(passwords, scorer, fields, min_entropy=None, max_entropy=None, workers=None,
+          chunksize=1000):
+    """Yields a tuple of the fields for each password within the thresholds"""
+    passwords, copy = itertools.tee(passwords)
+    for pw, result in zip(copy, scorer.metrics_iter(passwords, workers, chunksize)):
+        entropy = result['entropy']
+        if min_entropy is not None and entropy < min_entropy:
+            continue
+        if max_entropy is not None and entropy >= max_entropy:
+            continue
+        result['password'] = pw
+        yield tuple(_value(result[field]) for field in fields)
+
+
+def _int_at_least(minimum):
+    def parse(value):
+        number = int(value)
+        if number < minimum:
+            raise argparse.ArgumentTypeError('Must be at least %s' % minimum)
+        return number
+    return parse
+
+
+def parse_fields(value):
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    for field in fields:
+        if field not in FIELDS:
+            raise argparse.ArgumentTypeError('Unknown field %r, choose from %s' % (
+                field, ', '.join(FIELDS)))
+    if not fields:
+        raise argparse.ArgumentTypeError('No fields given')
+    return fields
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='passwordmetrics',
+                                     description=__doc__.splitlines()[0])
+    parser.add_argument('input', nargs='?', default='-',
+                        help='A file with one password per line, by default stdin')
+    parser.add_argument('-o', '--output', default='-', help='By default stdout')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--fields', type=parse_fields, default=['password', 'entropy'],
+                        help='Comma separated, any of %s' % ', '.join(FIELDS))
+    parser.add_argument('--no-header', action='store_true', help="Don't write a CSV header")
+    parser.add_argument('--wordlist', help='A text or compiled word list')
+    parser.add_argument('--segmentation', choices=passwordmetrics.SEGMENTATIONS,
+                        default='greedy')
+    parser.add_argument('--max-length', type=_int_at_least(0),
+                        help='Only look for words this far in')
+    parser.add_argument('--min-entropy', type=float,
+                        help='Only write passwords with at least this entropy')
+    parser.add_argument('--max-entropy', type=float,
+                        help='Only write passwords with less than this entropy')
+    parser.add_argument('--workers', type=_int_at_least(0), help='Score in this many processes')
+    parser.add_argument('--chunksize', type=_int_at_least(1), default=1000)
+    parser.add_argument('--encoding', default='utf-8')
+    return parser
+
+
+class _Py2Writer(object):
+    """Writes the UTF-8 byte strings of Python 2's csv and json to a binary file
+
+    They are written in the encoding, with the bytes that were escaped when
+    reading written back as they were.
+    """
+
+    def __init__(self, outfile, encoding):
+        self.outfile = outfile
+        self.encoding = encoding
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        position = 0
+        for match in _ESCAPED.finditer(data):
+            self.outfile.write(data[position:match.start()].encode(self.encoding))
+            self.outfile.write(bytes(bytearray(ord(c) - 0xdc00 for c in match.group())))
+            position = match.end()
+        return self.outfile.write(data[position:].encode(self.encoding))
+
+
+def _cell(value):
+    if isinstance(value, list):
+        value = ' '.join(value)
+    if str is bytes and isinstance(value, type(u'')):
+        # The csv module of Python 2 only handles byte strings.
+        value = value.encode('utf-8')
+    return value
+
+
+def write(outfile, args, rows):
+    if str is bytes:
+        outfile = _Py2Writer(outfile, args.encoding)
+    if args.format == 'csv':
+        writer = csv.writer(outfile)
+        if not args.no_header:
+            writer.writerow([_cell(field) for field in args.fields])
+        for row in rows:
+            writer.writerow([_cell(value) for value in row])
+    else:
+        for row in rows:
+            outfile.write(json.dumps(dict(zip(args.fields, row)), sort_keys=True,
+                                     ensure_ascii=False))
+            outfile.write('\n')
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    scorer = passwordmetrics.Scorer(words=args.wordlist, segmentation=args.segmentation,
+                                    max_length=args.max_length)
+
+    infile = _open_input(args.input, args.encoding)
+    outfile = _open_output(args.output, args.encoding)
+    try:
+        try:
+            write(outfile, args, score(read_passwords(infile), scorer, args.fields,
+                                       args.min_entropy, args.max_entropy, args.workers,
+                                       args.chunksize))
+            outfile.flush()
+        except (IOError, OSError) as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # The reader has gone, as in "passwordmetrics passwords.txt | head".
+            # What is left in the buffer goes nowhere when it's closed.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, outfile.fileno())
+            os.close(devnull)
+            return 1
+    finally:
+        outfile.close()
+        infile.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""A compiled, memory mapped word list format.
+
+Parsing the text word list into a dict takes time and memory in every process
+that calls configure(). A compiled word list is instead written once, and then
+memory mapped read-only, so starting up is nearly free and all processes on a
+machine share the same pages.
+
+The file holds the words sorted, their entropies as packed doubles, and the
+Aho-Corasick automaton used to find words in passwords as flat arrays. All
+numbers are little-endian.
+"""
+import bisect
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b'PWMWORDS'
+VERSION = 1
+
+# magic, version, word count, node count, edge count, key blob size
+_HEADER = struct.Struct('<8sIIIII')
+_NONE = 0xFFFFFFFF
+
+if array('I').itemsize == 4:
+    _UINT32 = 'I'
+else:
+    _UINT32 = 'L'
+
+
+def _tobytes(data):
+    if hasattr(data, 'tobytes'):
+        return data.tobytes()
+    return data.tostring()
+
+
+def _frombytes(data, raw):
+    if hasattr(data, 'frombytes'):
+        data.frombytes(raw)
+    else:
+        data.fromstring(raw)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _sections(word_count, node_count, edge_count, blob_size):
+    """Returns the (offset, size) of each section, in file order"""
+    sizes = [('entropies', 8 * word_count),
+             ('key_offsets', 4 * (word_count + 1)),
+             ('first_edge', 4 * (node_count + 1)),
+             ('fail', 4 * node_count),
+             ('own', 4 * node_count),
+             ('dict_link', 4 * node_count),
+             ('edge_chars', 4 * edge_count),
+             ('edge_targets', 4 * edge_count),
+             ('keys', blob_size),
+             ]
+    sections = {}
+    offset = _align(_HEADER.size)
+    for name, size in sizes:
+        sections[name] = (offset, size)
+        offset = _align(offset + size)
+    return sections, offset
+
+
+def is_compiled(path):
+    """Returns True if the file at path is a compiled word list"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_compiled(words, path):
+    """Compiles a mapping of words to entropies into a file"""
+    with open(path, 'wb') as outfile:
+        _write_compiled(words, outfile)
+
+
+def _write_compiled(words, outfile, automaton=None):
+    """Writes the compiled word list to the file from where it is now
+
+    An automaton already built from the words can be passed to save time.
+    Returns the words, in the order of their ids.
+    """
+    from passwordmetrics import _WordAutomaton
+
+    keys = sorted(word for word in words if word)
+    ids = dict((word, i) for i, word in enumerate(keys))
+    if automaton is None:
+        automaton = _WordAutomaton(keys)
+    goto = automaton.goto
+    fail = automaton.fail
+    output = automaton.output
+    node_count = len(goto)
+
+    # A node has its own word if it has more output than its failure node.
+    own = array(_UINT32, [_NONE]) * node_count
+    for state in range(1, node_count):
+        if len(output[state]) > len(output[fail[state]]):
+            own[state] = ids[output[state][0]]
+
+    # The dictionary link of a node is the nearest node on its failure chain
+    # that has a word of its own. Following them finds all words at a node.
+    dict_link = array(_UINT32, [0]) * node_count
+    for state in range(1, node_count):
+        f = fail[state]
+        while f and own[f] == _NONE:
+            f = fail[f]
+        dict_link[state] = f
+
+    first_edge = array(_UINT32, [0]) * (node_count + 1)
+    edge_chars = array(_UINT32)
+    edge_targets = array(_UINT32)
+    for state in range(node_count):
+        first_edge[state] = len(edge_chars)
+        for c, target in sorted(goto[state].items()):
+            edge_chars.append(ord(c))
+            edge_targets.append(target)
+    first_edge[node_count] = len(edge_chars)
+
+    entropies = array('d', [float(words[word]) for word in keys])
+    key_offsets = array(_UINT32, [0]) * (len(keys) + 1)
+    encoded = []
+    position = 0
+    for i, word in enumerate(keys):
+        data = word.encode('utf-8')
+        encoded.append(data)
+        position += len(data)
+        key_offsets[i + 1] = position
+    blob = b''.join(encoded)
+
+    arrays = {'entropies': entropies,
+              'key_offsets': key_offsets,
+              'first_edge': first_edge,
+              'fail': array(_UINT32, fail),
+              'own': own,
+              'dict_link': dict_link,
+              'edge_chars': edge_chars,
+              'edge_targets': edge_targets,
+              }
+    if sys.byteorder != 'little':
+        for data in arrays.values():
+            data.byteswap()
+
+    sections, total = _sections(len(keys), node_count, len(edge_chars), len(blob))
+    start = outfile.tell()
+    outfile.write(_HEADER.pack(MAGIC, VERSION, len(keys), node_count,
+                             len(edge_chars), len(blob)))
+    for name, (offset, size) in sorted(sections.items(), key=lambda x: x[1]):
+        outfile.write(b'\0' * (start + offset - outfile.tell()))
+        if name == 'keys':
+            outfile.write(blob)
+        else:
+            outfile.write(_tobytes(arrays[name]))
+    outfile.write(b'\0' * (start + total - outfile.tell()))
+    return keys
+
+
+def _view(buffer):
+    """Returns a memoryview of the buffer, or on Python 2 the buffer itself
+
+    Python 2 can't make a memoryview of an mmap, but slicing the mmap gives
+    a copy of the bytes, which is what _array_view() makes there anyway.
+    """
+    try:
+        return memoryview(buffer)
+    except TypeError:
+        return buffer
+
+
+def _array_view(buffer, offset, size, typecode):
+    data = buffer[offset:offset + size]
+    if sys.byteorder == 'little' and hasattr(data, 'cast'):
+        # Zero copy, the pages stay shared with other processes.
+        return data.cast(typecode)
+    # Python 2 or a big-endian machine, we need our own copy.
+    result = array(typecode)
+    _frombytes(result, bytes(data))
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+class CompiledWordlist(object):
+    """A read-only mapping of words to entropies backed by a compiled file
+
+    It can be passed as ``words`` to configure(), and is then used directly
+    to find words in passwords, without building anything in memory.
+    """
+
+    def __init__(self, path=None, buffer=None, offset=0):
+        if buffer is None:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._path = path
+        self._buffer = buffer
+        self._offset = offset
+        view = _view(buffer)
+
+        # The word list can be a part of a bigger file, see passwordmetrics.shared
+        magic, version, word_count, node_count, edge_count, blob_size = \
+            _HEADER.unpack_from(view, offset)
+        if magic != MAGIC:
+            raise ValueError('Not a compiled word list')
+        if version != VERSION:
+            raise ValueError('Unsupported compiled word list version %s' % version)
+
+        sections, total = _sections(word_count, node_count, edge_count, blob_size)
+        self._word_count = word_count
+        for name, (start, size) in sections.items():
+            start += offset
+            if name == 'keys':
+                self._keys = view[start:start + size]
+            elif name == 'entropies':
+                self._entropies = _array_view(view, start, size, 'd')
+            else:
+                setattr(self, '_' + name, _array_view(view, start, size, _UINT32))
+
+    def __reduce__(self):
+        # Other processes map the same file rather than get a copy.
+        if self._path is None:
+            raise TypeError('Only a compiled word list loaded from a file can be pickled')
+        return (CompiledWordlist, (self._path, None, self._offset))
+
+    def _word(self, word_id):
+        return bytes(self._keys[self._key_offsets[word_id]:
+                                self._key_offsets[word_id + 1]]).decode('utf-8')
+
+    def _child(self, state, code):
+        lo = self._first_edge[state]
+        hi = self._first_edge[state + 1]
+        i = bisect.bisect_left(self._edge_chars, code, lo, hi)
+        if i < hi and self._edge_chars[i] == code:
+            return self._edge_targets[i]
+        return None
+
+    def _word_id(self, word):
+        from passwordmetrics import _speedups, text_type
+
+        if _speedups is not None and type(word) is text_type:
+            return _speedups.word_id(self, word)
+        state = 0
+        for c in word:
+            state = self._child(state, ord(c))
+            if state is None:
+                return None
+        word_id = self._own[state]
+        if word_id == _NONE:
+            return None
+        return word_id
+
+    def step(self, state, c):
+        """Returns the state of the automaton after reading c in state"""
+        try:
+            code = ord(c)
+        except TypeError:
+            # Lowercase that is several characters, never in a word.
+            return 0
+        next_state = self._child(state, code)
+        while next_state is None and state:
+            state = self._fail[state]
+            next_state = self._child(state, code)
+        return next_state or 0
+
+    def words_at(self, state):
+        """Returns the words that end in state"""
+        own = self._own
+        dict_link = self._dict_link
+        words = []
+        while state:
+            if own[state] != _NONE:
+                words.append(self._word(own[state]))
+            state = dict_link[state]
+        return tuple(words)
+
+    def advance(self, states, alternatives):
+        """Reads one character that may be any of the alternatives
+
+        Returns the new states and the words that end here.
+        """
+        step = self.step
+        next_states = set()
+        for state in states:
+            for c in alternatives:
+                next_states.add(step(state, c))
+        if len(next_states) > 1:
+            # Any other state will find all that the root state would.
+            next_states.discard(0)
+        words = set()
+        for state in next_states:
+            words.update(self.words_at(state))
+        return tuple(next_states), tuple(words)
+
+    def scan(self, pw, alternatives):
+        """Returns the words that end at each character of the password
+
+        alternatives maps characters to the tuple of characters they can be
+        read as. Characters not in it are read as their lowercase self.
+        """
+        from passwordmetrics import _speedups, text_type
+
+        if _speedups is not None and type(pw) is text_type:
+            # The C code reads the arrays in the mapped file directly.
+            return _speedups.scan_compiled(self, pw, alternatives)
+        result = []
+        states = (0,)
+        for c in pw:
+            states, words = self.advance(states, alternatives.get(c) or (c.lower(),))
+            result.append(words)
+        return result
+
+    def __getitem__(self, word):
+        word_id = self._word_id(word)
+        if word_id is None:
+            raise KeyError(word)
+        return self._entropies[word_id]
+
+    def get(self, word, default=None):
+        word_id = self._word_id(word)
+        if word_id is None:
+            return default
+        return self._entropies[word_id]
+
+    def __contains__(self, word):
+        return self._word_id(word) is not None
+
+    def __iter__(self):
+        for word_id in range(self._word_count):
+            yield self._word(word_id)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(self._word(i), self._entropies[i]) for i in range(self._word_count)]
+
+    def __len__(self):
+        return self._word_count
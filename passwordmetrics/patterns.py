@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""Finds patterns that are easy to guess, but aren't words.
+
+Passwords like ``qwertyuiop``, ``abcdefgh`` or ``19851231`` have no words
+in them, so their characters would be scored one by one, as if they were
+random. The detectors here find keyboard walks, sequences, repeats and
+dates, and estimate how many bits it takes to guess them.
+
+A detector is a function that takes a string and yields a ``(start, end,
+entropy)`` tuple for each match, in one pass over the string. Pass a
+mapping of kinds to detectors as ``patterns`` to configure() to use your
+own, or ``True`` for the ones here, which are in DETECTORS.
+"""
+import collections
+import math
+import string
+
+Pattern = collections.namedtuple('Pattern', ['kind', 'token', 'start', 'entropy'])
+
+# The year dates are scored from, fixed so that scores don't change with the
+# year the process runs in, and how far back or forward a year is taken to be
+# guessed, at least.
+REFERENCE_YEAR = 2025
+MIN_YEAR_SPACE = 20
+
+# The rows of a US keyboard, and the same rows with shift. Each row is half
+# a key to the right of the row above it.
+_ROWS = ('`1234567890-=', 'qwertyuiop[]\\', "asdfghjkl;'", 'zxcvbnm,./')
+_SHIFTED_ROWS = ('~!@#$%^&*()_+', 'QWERTYUIOP{}|', 'ASDFGHJKL:"', 'ZXCVBNM<>?')
+
+
+def _keyboard(rows, shifted_rows):
+    """Returns the (row, column, shifted) of each key, columns in half keys"""
+    keys = {}
+    for row, (keys_row, shifted_row) in enumerate(zip(rows, shifted_rows)):
+        for column, (key, shifted_key) in enumerate(zip(keys_row, shifted_row)):
+            # The second row starts one and a half keys in, the rest a half
+            # key further than the one above.
+            position = (row, 2 * column + (row + 2 if row else 0))
+            keys[key] = position + (False,)
+            keys[shifted_key] = position + (True,)
+    return keys
+
+
+_KEYS = _keyboard(_ROWS, _SHIFTED_ROWS)
+_KEY_COUNT = len(_KEYS) // 2
+# A key has at most six neighbours: left, right, and two above and below.
+_DIRECTIONS = 6
+
+
+def _direction(a, b):
+    """Returns which way key b is from key a, or None if they are not neighbours"""
+    row_a, column_a = a[:2]
+    row_b, column_b = b[:2]
+    rows = row_b - row_a
+    columns = column_b - column_a
+    if rows == 0 and abs(columns) == 2 or abs(rows) == 1 and abs(columns) == 1:
+        return rows, columns
+    return None
+
+
+def _character_bits(c):
+    """The bits needed to guess a character, knowing what kind it is"""
+    if c in string.digits:
+        return math.log(10, 2)
+    if c in string.ascii_letters:
+        return math.log(26, 2)
+    if c in string.punctuation:
+        return math.log(len(string.punctuation), 2)
+    return math.log(128, 2)
+
+
+def character_bits(token):
+    """The bits needed to guess the characters of the token, one by one"""
+    return math.fsum(_character_bits(c) for c in set(token))
+
+
+def _walk_entropy(token, turns):
+    entropy = math.log(_KEY_COUNT, 2) + math.log(len(token), 2) + turns * math.log(_DIRECTIONS, 2)
+    shifted = sum(1 for c in token if _KEYS[c][2])
+    if shifted == len(token):
+        entropy += 1
+    else:
+        entropy += min(shifted, len(token) - shifted)
+    return entropy
+
+
+def keyboard_walks(text, min_length=4):
+    """Finds runs of neighbouring keys, like 'qwerty' or 'zaq1'
+
+    It's cheaper to guess walks that keep going in the same direction.
+    """
+    start = 0
+    direction = None
+    turns = 0
+    for i in range(1, len(text) + 1):
+        step = None
+        if i < len(text) and text[i - 1] in _KEYS and text[i] in _KEYS:
+            step = _direction(_KEYS[text[i - 1]], _KEYS[text[i]])
+        if step is not None:
+            if direction is not None and step != direction:
+                turns += 1
+            direction = step
+            continue
+        if i - start >= min_length:
+            yield start, i, _walk_entropy(text[start:i], turns)
+        start = i
+        direction = None
+        turns = 0
+
+
+def _sequence_kind(c):
+    for kind in (string.digits, string.ascii_lowercase, string.ascii_uppercase):
+        if c in kind:
+            return kind
+    return None
+
+
+def _sequence_entropy(token, step):
+    kind = _sequence_kind(token[0])
+    if token[0] in 'aAzZ019':
+        # The obvious places to start
+        entropy = 2.0
+    else:
+        entropy = math.log(len(kind), 2)
+    entropy += math.log(len(token), 2)
+    if step < 0:
+        entropy += 1
+    if abs(step) > 1:
+        entropy += 1
+    return entropy
+
+
+def sequences(text, min_length=3):
+    """Finds runs of letters or digits in order, like 'abcd', '4321' or '2468'"""
+    start = 0
+    step = None
+    for i in range(1, len(text) + 1):
+        delta = None
+        if i < len(text):
+            kind = _sequence_kind(text[i])
+            if kind is not None and kind is _sequence_kind(text[i - 1]):
+                delta = ord(text[i]) - ord(text[i - 1])
+        if delta is not None and (delta == step or step is None and 0 < abs(delta) <= 2):
+            step = delta
+            continue
+        if i - start >= min_length:
+            yield start, i, _sequence_entropy(text[start:i], step)
+        if delta is not None and 0 < abs(delta) <= 2:
+            # The last character starts the next sequence, as in 'abcba'.
+            start = i - 1
+            step = delta
+        else:
+            start = i
+            step = None
+
+
+def _unit_entropy(unit):
+    """The entropy of a repeated unit, which can be a pattern itself"""
+    entropy = character_bits(unit)
+    if len(unit) > 1:
+        for detector in (keyboard_walks, sequences):
+            for start, end, pattern_entropy in detector(unit, min_length=len(unit)):
+                entropy = min(entropy, pattern_entropy)
+    return entropy
+
+
+def repeats(text, max_unit=4):
+    """Finds a few characters repeated, like 'abcabc' or '1212'
+
+    Units of up to max_unit characters are looked for, each length in one
+    pass.
+    """
+    for unit_length in range(1, max_unit + 1):
+        start = 0
+        for i in range(unit_length, len(text) + 1):
+            if i < len(text) and text[i] == text[i - unit_length]:
+                continue
+            # text[start:i] repeats with the unit length, count whole units.
+            count = (i - start) // unit_length
+            if count >= 2 and count * unit_length >= 3:
+                end = start + count * unit_length
+                unit = text[start:start + unit_length]
+                if len(set(unit)) == unit_length or unit_length == 1:
+                    yield start, end, _unit_entropy(unit) + math.log(count, 2)
+            start = i - unit_length + 1
+
+
+_DATE_SEPARATORS = '-/._ '
+
+
+def _year(year, digits):
+    if digits == 2:
+        year += 1900 if year > 50 else 2000
+    if 1900 <= year <= 2099:
+        return year
+    return None
+
+
+def _split_date(token):
+    """Returns the possible (year, month, day) of a token, day None for a year"""
+    separators = [c for c in token if c in _DATE_SEPARATORS]
+    if separators:
+        parts = token.split(separators[0])
+        if len(parts) != 3 or separators[0] != separators[-1] or not all(parts):
+            return []
+        if not all(part.isdigit() for part in parts):
+            return []
+        orders = [(parts[0], parts[1], parts[2]),  # year, month, day
+                  (parts[2], parts[1], parts[0]),
+                  (parts[2], parts[0], parts[1])]
+        return [(year, month, day) for year, month, day in orders
+                if len(year) in (2, 4) and len(month) <= 2 and len(day) <= 2]
+    if len(token) == 4:
+        return [(token, None, None)]
+    if len(token) == 6:
+        return [(token[:2], token[2:4], token[4:]),
+                (token[4:], token[2:4], token[:2]),
+                (token[4:], token[:2], token[2:4])]
+    if len(token) == 8:
+        return [(token[:4], token[4:6], token[6:]),
+                (token[4:], token[2:4], token[:2]),
+                (token[4:], token[:2], token[2:4])]
+    return []
+
+
+def _date_entropy(token, reference_year):
+    entropy = None
+    for year, month, day in _split_date(token):
+        year = _year(int(year), len(year))
+        if year is None:
+            continue
+        if month is not None and not (1 <= int(month) <= 12 and 1 <= int(day) <= 31):
+            continue
+        candidate = math.log(max(abs(year - reference_year), MIN_YEAR_SPACE), 2)
+        if month is not None:
+            candidate += math.log(365, 2)
+            if not token.isdigit():
+                candidate += 2
+        if entropy is None or candidate < entropy:
+            entropy = candidate
+    return entropy
+
+
+def dates(text, max_length=10, reference_year=REFERENCE_YEAR):
+    """Finds dates and years, like '19851231', '31/12/85' or '1985'
+
+    The whole run of digits and separators has to be a date. A year is
+    harder to guess the further it is from reference_year.
+    """
+    start = 0
+    for i in range(len(text) + 1):
+        if i < len(text) and i - start < max_length and (
+                text[i] in string.digits or text[i] in _DATE_SEPARATORS and i > start):
+            continue
+        end = i
+        while end > start and text[end - 1] in _DATE_SEPARATORS:
+            end -= 1
+        if end - start >= 4:
+            entropy = _date_entropy(text[start:end], reference_year)
+            if entropy is not None:
+                yield start, end, entropy
+        # A digit after a run that was too long starts the next one.
+        start = i if i < len(text) and text[i] in string.digits else i + 1
+
+
+DETECTORS = collections.OrderedDict([
+    ('keyboard', keyboard_walks),
+    ('sequence', sequences),
+    ('repeat', repeats),
+    ('date', dates),
+])
+
+
+def find_patterns(text, detectors=DETECTORS):
+    """Returns the patterns in the text, in order
+
+    Where patterns overlap the longest one is picked, and of those the one
+    with the lowest entropy. A pattern is only used if it's cheaper than
+    guessing its characters.
+    """
+    matches = []
+    for kind, detector in detectors.items():
+        for start, end, entropy in detector(text):
+            if entropy < character_bits(text[start:end]):
+                matches.append((start, end, kind, entropy))
+    if not matches:
+        return []
+
+    matches.sort(key=lambda match: (match[0] - match[1], match[3], match[0]))
+    taken = [False] * len(text)
+    found = []
+    for start, end, kind, entropy in matches:
+        if not any(taken[start:end]):
+            taken[start:end] = [True] * (end - start)
+            found.append(Pattern(kind, text[start:end], start, entropy))
+    found.sort(key=lambda pattern: pattern.start)
+    return found
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""A configuration compiled once and memory mapped by many processes.
+
+A pre-fork server has many worker processes, and if each of them calls
+configure() each has its own word list dict and automaton. Even when they
+are forked with the configuration, touching the Python objects updates
+their reference counts, which copies the pages to every worker in time.
+
+Instead the master process writes the configuration to a file with share(),
+and the workers attach() to it. The word list is a compiled word list in
+the file, which is memory mapped read-only, so all processes share the same
+pages and attaching is nearly free. The file holds a header, the small parts
+of the configuration as JSON, the word list each word is from, and the
+compiled word list:
+
+    magic, version, config offset, config size, sources offset,
+    sources size, word list offset
+
+All numbers are little-endian. Pattern detectors are code, so the file only
+names the built-in ones, and holds just the kind of custom ones, which are
+given to attach() again. Nothing in the file is imported or run, but the
+configuration in it decides how strong passwords are taken to be, so it
+should only be writable by the user that shares it.
+"""
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from passwordmetrics.compiled import (CompiledWordlist, _UINT32, _align, _array_view,
+                                      _tobytes, _view, _write_compiled)
+from passwordmetrics.patterns import DETECTORS
+
+MAGIC = b'PWMSHARE'
+VERSION = 1
+
+# magic, version, config offset, config size, sources offset, sources size,
+# word list offset
+_HEADER = struct.Struct('<8sIQQQQQ')
+
+
+class _SharedSources(object):
+    """The names of the word lists each word is in, read from the shared file
+
+    The words are numbered like in the compiled word list, and for each
+    word the file has the number of its tuple of names.
+    """
+
+    def __init__(self, path, words, source_ids, names):
+        self._path = path
+        self._words = words
+        self._source_ids = source_ids
+        self._names = names
+
+    def __reduce__(self):
+        return (_load_sources, (self._path,))
+
+    def __getitem__(self, word):
+        word_id = self._words._word_id(word)
+        if word_id is None:
+            raise KeyError(word)
+        return self._names[self._source_ids[word_id]]
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def __contains__(self, word):
+        return word in self._words
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __len__(self):
+        return len(self._words)
+
+
+def _load_sources(path):
+    buffer, config_data, sources_offset, sources_size, words_offset = _open(path)
+    _, source_names = _load_config(config_data)
+    words = CompiledWordlist(path, buffer, words_offset)
+    return _sources(path, buffer, words, sources_offset, sources_size, source_names)
+
+
+def _sources(path, buffer, words, sources_offset, sources_size, source_names):
+    if source_names is None:
+        return None
+    source_ids = _array_view(_view(buffer), sources_offset, sources_size, _UINT32)
+    return _SharedSources(path, words, source_ids, source_names)
+
+
+def _builtin_detectors():
+    """Returns the detectors of passwordmetrics.patterns by 'module:name'"""
+    return dict(('%s:%s' % (detector.__module__, detector.__name__), detector)
+                for detector in DETECTORS.values())
+
+
+def _dump_patterns(patterns):
+    """Returns [kind, name] of the detectors, with None as the name of custom ones"""
+    names = dict((detector, name) for name, detector in _builtin_detectors().items())
+    return [[kind, names.get(detector)] for kind, detector in patterns.items()]
+
+
+def _load_patterns(patterns, detectors):
+    """Returns the detectors of the [kind, name] pairs
+
+    Only the built-in detectors are looked up by name, and the detectors
+    given by kind are used for the others. Any other name raises ValueError,
+    so a file can't make a process call something else.
+    """
+    builtin = _builtin_detectors()
+    detectors = detectors or {}
+    result = collections.OrderedDict()
+    for kind, name in patterns:
+        if kind in detectors:
+            result[kind] = detectors[kind]
+        elif name in builtin:
+            result[kind] = builtin[name]
+        elif name is None:
+            raise ValueError('No detector given for the %r patterns' % (kind,))
+        else:
+            raise ValueError('%r is not a passwordmetrics detector' % (name,))
+    return result
+
+
+def _dump_string(value):
+    """Returns the string for JSON, with byte strings as {'bytes': latin-1 text}
+
+    On Python 2 the default groups are byte strings, and JSON only has text.
+    """
+    if isinstance(value, bytes):
+        return {'bytes': value.decode('latin-1')}
+    return value
+
+
+def _load_string(value):
+    if isinstance(value, dict):
+        return value['bytes'].encode('latin-1')
+    return value
+
+
+def _dump_config(scorer, source_names):
+    """Returns the configuration of the scorer, without the words, as JSON"""
+    from passwordmetrics import string_types, text_type
+    from passwordmetrics.blocklist import Blocklist
+
+    blocklist = scorer.blocklist
+    if blocklist is not None:
+        if not isinstance(blocklist, Blocklist):
+            raise ValueError('Only a blocklist file can be shared')
+        blocklist = os.path.abspath(blocklist._path)
+    patterns = scorer.patterns
+    if patterns is not None:
+        patterns = _dump_patterns(patterns)
+    substitutions = []
+    for c, substitution in scorer.substitutions.items():
+        if isinstance(substitution, (tuple, list, set, frozenset)):
+            substitution = [_dump_string(s) for s in sorted(substitution)]
+        elif isinstance(substitution, string_types):
+            substitution = _dump_string(substitution)
+        else:
+            substitution = text_type(substitution)
+        substitutions.append([_dump_string(c), substitution])
+    config = {'groups': [[name, [_dump_string(c) for c in sorted(group)]]
+                         for name, group in scorer.groups.items()],
+              'substitutions': substitutions,
+              'segmentation': scorer.segmentation,
+              'max_length': scorer.max_length,
+              'max_candidates': scorer.max_candidates,
+              'blocklist': blocklist,
+              'patterns': patterns,
+              'source_names': source_names,
+              }
+    return json.dumps(config, sort_keys=True).encode('utf-8')
+
+
+def _load_config(data):
+    """Returns the arguments of Scorer, and the word list names, from the JSON
+
+    The patterns are left as [kind, name] pairs, see _load_patterns().
+    """
+    config = json.loads(data.decode('utf-8'))
+    config['groups'] = collections.OrderedDict(
+        (name, set(_load_string(c) for c in group)) for name, group in config['groups'])
+    substitutions = {}
+    for c, substitution in config['substitutions']:
+        if isinstance(substitution, list):
+            substitution = [_load_string(s) for s in substitution]
+        else:
+            substitution = _load_string(substitution)
+        substitutions[_load_string(c)] = substitution
+    config['substitutions'] = substitutions
+    source_names = config.pop('source_names')
+    if source_names is not None:
+        source_names = [tuple(names) for names in source_names]
+    return config, source_names
+
+
+def write_shared(scorer, path):
+    """Writes the configuration of the scorer to a file
+
+    The file is written next to path and then renamed, so processes that
+    have the old file mapped keep using it, and new ones get the new one.
+    The built-in pattern detectors are saved by name and other detectors
+    only by kind, so give them to load_shared() again. A blocklist must be
+    a file.
+    """
+    from passwordmetrics import _WordAutomaton
+
+    automaton = scorer._automaton
+    if not isinstance(automaton, _WordAutomaton):
+        automaton = None
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.passwordmetrics-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * _align(_HEADER.size))
+            words_offset = f.tell()
+            keys = _write_compiled(scorer.words, f, automaton)
+
+            source_names = None
+            sources_offset = _align(f.tell())
+            source_data = b''
+            if scorer.word_sources is not None:
+                source_names = []
+                numbers = {}
+                source_ids = array(_UINT32)
+                for word in keys:
+                    names = tuple(scorer.word_sources[word])
+                    if names not in numbers:
+                        numbers[names] = len(source_names)
+                        source_names.append(names)
+                    source_ids.append(numbers[names])
+                if sys.byteorder != 'little':
+                    source_ids.byteswap()
+                source_data = _tobytes(source_ids)
+            f.write(b'\0' * (sources_offset - f.tell()))
+            f.write(source_data)
+
+            config_data = _dump_config(scorer, source_names)
+            config_offset = _align(f.tell())
+            f.write(b'\0' * (config_offset - f.tell()))
+            f.write(config_data)
+
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, config_offset, len(config_data),
+                                 sources_offset, len(source_data), words_offset))
+        # Workers may run as another user than the one writing the file.
+        os.chmod(temp_path, 0o644)
+        getattr(os, 'replace', os.rename)(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _open(path):
+    """Maps the file, and returns it with the JSON and the offsets of the parts"""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, config_offset, config_size, sources_offset, sources_size, words_offset = \
+        _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a shared configuration')
+    if version != VERSION:
+        raise ValueError('Unsupported shared configuration version %s' % version)
+    config_data = buffer[config_offset:config_offset + config_size]
+    return buffer, config_data, sources_offset, sources_size, words_offset
+
+
+def load_shared(path, detectors=None):
+    """Returns a Scorer for the configuration in the file at path
+
+    detectors maps the kinds of patterns to the detectors to use for them.
+    It must have the custom detectors the scorer was shared with, as the
+    file only names the built-in ones.
+    """
+    from passwordmetrics import Scorer
+
+    buffer, config_data, sources_offset, sources_size, words_offset = _open(path)
+    config, source_names = _load_config(config_data)
+    if config['patterns'] is not None:
+        config['patterns'] = _load_patterns(config['patterns'], detectors)
+    words = CompiledWordlist(path, buffer, words_offset)
+    scorer = Scorer(words=words, **config)
+    sources = _sources(path, buffer, words, sources_offset, sources_size, source_names)
+    if sources is not None:
+        # Like Scorer.__setstate__, the sources were merged when the file was written.
+        object.__setattr__(scorer, 'word_sources', sources)
+    return scorer
@@ -2,16 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import os
+import platform
 import sys
 
 
 try:
-    from setuptools import setup
+    from setuptools import setup, Extension
+    from setuptools.command.build_ext import build_ext
 except ImportError:
-    from distutils.core import setup
+    from distutils.core import setup, Extension
+    from distutils.command.build_ext import build_ext
 
 import passwordmetrics
 
+
+class optional_build_ext(build_ext):
+    """Builds the C speedups if possible, the pure Python code works without them"""
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except Exception as e:
+            self.warn('Not building the C speedups: %s' % e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except Exception as e:
+            self.warn('Not building the C speedups: %s' % e)
+
+
+ext_modules = []
+if (platform.python_implementation() == 'CPython' and sys.version_info >= (3, 3) and
+        not os.environ.get('PASSWORDMETRICS_NO_EXTENSIONS')):
+    ext_modules.append(Extension('passwordmetrics._speedups', ['passwordmetrics/_speedups.c']))
+
 readme = open('README.rst').read()
 history = open('HISTORY.rst').read().replace('.. :changelog:', '')
 
@@ -29,8 +54,17 @@ setup(
     tests_require=[
         'manuel',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     package_dir={'passwordmetrics':
                  'passwordmetrics'},
+    package_data={'passwordmetrics': ['wordlist_en.txt']},
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': optional_build_ext},
+    entry_points={
+        'console_scripts': ['passwordmetrics = passwordmetrics.cli:main'],
+    },
     include_package_data=True,
     license="MIT",
     zip_safe=False,
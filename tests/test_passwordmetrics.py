@@ -9,9 +9,36 @@ Tests for `passwordmetrics` module.
 """
 from __future__ import unicode_literals
 import unittest
+import binascii
+import collections
+import gc
+import json
+import math
+import operator
+import os
 import passwordmetrics
+import pickle
+import re
+import shutil
 import string
+import subprocess
+import sys
+import tempfile
+import threading
+import weakref
 from io import open
+from passwordmetrics import _vectorized, cli
+from passwordmetrics.blocklist import Blocklist, build_blocklist, write_blocklist
+from passwordmetrics.compiled import CompiledWordlist, write_compiled
+from passwordmetrics.patterns import dates, find_patterns, keyboard_walks
+from passwordmetrics.shared import load_shared
+
+try:
+    import asyncio
+    import concurrent.futures
+    from passwordmetrics import aio
+except (ImportError, SyntaxError):  # Python 2
+    aio = None
 
 class TestPasswordMetrics(unittest.TestCase):
 
@@ -118,6 +145,45 @@ class TestPasswordMetrics(unittest.TestCase):
                             passwordmetrics.metrics('b4ttery84ttery')['entropy'])
 
 
+class TestWordAutomaton(unittest.TestCase):
+
+    def find(self, automaton, text):
+        return set().union(*automaton.scan(text, {}))
+
+    def test_find(self):
+        automaton = passwordmetrics._WordAutomaton(['canotier', 'can', 'not', 'tier', 'an', 'no', 'a'])
+        self.assertEqual(self.find(automaton, 'canotier'),
+                         {'canotier', 'can', 'not', 'tier', 'an', 'no', 'a'})
+        self.assertEqual(self.find(automaton, 'xyz'), set())
+        self.assertEqual(self.find(automaton, ''), set())
+
+        # Words that end inside other words are found through the failure links
+        automaton = passwordmetrics._WordAutomaton(['he', 'she', 'his', 'hers'])
+        self.assertEqual(self.find(automaton, 'ushers'), {'he', 'she', 'hers'})
+
+    def test_substitutions(self):
+        # A substitution can be read as several letters
+        scorer = passwordmetrics.Scorer(words={'lamp': 3, 'ink': 4},
+                                        substitutions={'1': 'il', '4': 'a'})
+        words, rest = scorer.find_words('14mp1nk')
+        self.assertEqual(words, {'lamp', 'ink'})
+        # The substituted characters are added to the rest
+        self.assertEqual(sorted(rest), ['1', '4'])
+
+        # An alternative that doesn't continue the word doesn't stop the
+        # others, whichever is tried first.
+        scorer = passwordmetrics.Scorer(words={'hello': 5}, substitutions={'1': 'il'})
+        self.assertEqual(scorer.find_words('hel1o'), ({'hello'}, '1'))
+        scorer = passwordmetrics.Scorer(words={'abc': 5}, substitutions={'8': 'ab'})
+        self.assertEqual(scorer.find_words('a8c'), ({'abc'}, '8'))
+
+    def test_joined_words(self):
+        # Words can be found where other words have been cut out
+        scorer = passwordmetrics.Scorer(words={'xy': 1, 'ab': 2})
+        self.assertEqual(scorer.find_words('abaxyb'), ({'xy', 'ab'}, ''))
+        self.assertEqual(scorer.find_words('axyb'), ({'xy'}, 'ab'))
+
+
 class TestCustomConfig(unittest.TestCase):
 
     def test_nonascii_chars(self):
@@ -147,6 +213,20 @@ class TestCustomConfig(unittest.TestCase):
         entropy, unkown = passwordmetrics._character_entropy('abcdefghö\N{LATIN CAPITAL LETTER H WITH STROKE}')
         self.assertEqual(unkown, set())
 
+    def test_overlapping_groups(self):
+        # A character counts as the first of its groups that isn't used yet,
+        # so overlapping groups must be in order.
+        groups = collections.OrderedDict([('letters', set('abcdef')),
+                                          ('hex', set('abcdef0123456789'))])
+        passwordmetrics.configure(groups=groups, words={'a': 1})
+
+        # The character entropy uses the union of the groups, not the sum
+        entropy, unknown = passwordmetrics._character_entropy('a0')
+        self.assertAlmostEqual(entropy, 2 * math.log(16, 2))
+
+        self.assertEqual(passwordmetrics._find_groups('a0'), ({'letters', 'hex'}, set()))
+        self.assertEqual(passwordmetrics._find_groups('x'), (set(), {'letters', 'hex'}))
+
     def test_custom_wordlist(self):
         # You might want to include non-english words in the word list.
         words = {}
@@ -167,5 +247,868 @@ class TestCustomConfig(unittest.TestCase):
         self.assertEqual(res['words'], set([u'batteri', u'korrekt', u'h\xe4ftapparat', u'h\xe4st']))
 
 
+class TestScorer(unittest.TestCase):
+
+    def setUp(self):
+        self.swedish = passwordmetrics.Scorer(words=passwordmetrics.load_wordlist('docs/ordlista_sv.txt'))
+        self.english = passwordmetrics.Scorer(words={'correct': 1, 'horse': 2, 'battery': 3, 'staple': 4})
+
+    def test_several_scorers(self):
+        self.assertEqual(self.swedish.metrics('korrekthorsebatteri')['words'], {'korrekt', 'batteri'})
+        self.assertEqual(self.english.metrics('korrekthorsebatteri')['words'], {'horse'})
+
+        # The module level functions use their own scorer
+        passwordmetrics.configure(words={'horse': 5})
+        self.assertEqual(passwordmetrics.metrics('korrekthorsebatteri')['word_entropy'], 5)
+        self.assertEqual(self.english.metrics('korrekthorsebatteri')['word_entropy'], 2)
+
+    def test_only_unknown_characters(self):
+        # When no group is used, the unknown characters are a group of their own.
+        speedups = passwordmetrics._speedups
+        try:
+            for passwordmetrics._speedups in (speedups, None):
+                self.assertEqual(self.swedish.character_entropy('\u20ac'), (0.0, {'\u20ac'}))
+                self.assertEqual(self.swedish.character_entropy('\u20ac\u20ac\u2122'),
+                                 (2.0, {'\u20ac', '\u2122'}))
+        finally:
+            passwordmetrics._speedups = speedups
+        self.assertEqual(self.swedish.metrics_batch(['\u20ac', '\u20ac\u20ac\u2122', 'b4tteri']),
+                         [self.swedish.metrics(pw) for pw in ['\u20ac', '\u20ac\u20ac\u2122', 'b4tteri']])
+
+    def test_compact(self):
+        result = self.swedish.metrics('korrekth\xe4st!!', compact=True)
+        self.assertEqual(result.words, ('h\xe4st', 'korrekt'))
+        self.assertEqual(result.used_groups, {'lowercase', 'punctuation', 'other'})
+        self.assertEqual(result.groups, sum(1 << result.group_names.index(name)
+                                            for name in result.used_groups))
+        self.assertEqual(result.as_dict(), self.swedish.metrics('korrekth\xe4st!!'))
+        self.assertEqual(self.swedish.entropy('korrekth\xe4st!!'), result.entropy)
+        self.assertEqual(pickle.loads(pickle.dumps(result)), result)
+
+        passwords = ['korrekthorsebatteri', 'b4tteri', 'h\xe4st!'] * 3
+        self.assertEqual(self.swedish.metrics_batch(passwords, workers=2, chunksize=2, compact=True),
+                         [self.swedish.metrics(pw, compact=True) for pw in passwords])
+
+    def test_wordlists(self):
+        scorer = passwordmetrics.Scorer(wordlists={'sv': 'docs/ordlista_sv.txt',
+                                                   'en': {'correct': 1, 'horse': 2, 'h\xe4st': 9}})
+        result = scorer.metrics('korrekthorseh\xe4st')
+        self.assertEqual(result['words'], {'korrekt', 'horse', 'h\xe4st'})
+        self.assertEqual(result['word_sources'], {'korrekt': ('sv',), 'horse': ('en',),
+                                                  'h\xe4st': ('en', 'sv')})
+        # The lowest entropy of a word is used
+        self.assertEqual(result['word_entropy'], 1.2 + 2 + 2.7)
+        self.assertEqual(scorer.metrics('korrekthorseh\xe4st', compact=True).as_dict(), result)
+
+        # Without wordlists there is no word_sources
+        self.assertNotIn('word_sources', self.swedish.metrics('korrekt'))
+        self.assertRaises(ValueError, passwordmetrics.Scorer, words={}, wordlists={})
+
+    def test_default_wordlist(self):
+        # The default word list is shared, and loaded when first used
+        scorer = passwordmetrics.Scorer()
+        self.assertIs(scorer.words, passwordmetrics.Scorer().words)
+        scorer = pickle.loads(pickle.dumps(scorer))
+        self.assertIs(scorer.words, passwordmetrics.Scorer().words)
+
+    def test_immutable(self):
+        self.assertRaises(AttributeError, setattr, self.english, 'words', {})
+        self.assertRaises(AttributeError, setattr, self.english, 'foo', 'bar')
+        self.assertRaises(AttributeError, delattr, self.english, 'words')
+
+        # Changing the mappings it was made from doesn't change it.
+        words = {'abc': 1.0}
+        groups = {'lowercase': set('abc')}
+        scorer = passwordmetrics.Scorer(words=words, groups=groups)
+        expected = scorer.metrics('abc')
+        del words['abc']
+        groups['lowercase'].add('d')
+        self.assertEqual(scorer.metrics('abc'), expected)
+
+        # Nor can the mappings it has be changed.
+        self.assertRaises(TypeError, operator.setitem, scorer.words, 'abc', 5.0)
+        self.assertRaises(TypeError, operator.setitem, scorer.groups, 'digits', frozenset('0'))
+        self.assertRaises(TypeError, operator.setitem, scorer.substitutions, 'a', '4')
+
+    def test_pickle(self):
+        scorer = pickle.loads(pickle.dumps(self.swedish, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(scorer.metrics('korrekthorsebatteri'),
+                         self.swedish.metrics('korrekthorsebatteri'))
+        self.assertEqual(scorer.groups, self.swedish.groups)
+        self.assertRaises(TypeError, operator.setitem, scorer.words, 'abc', 5.0)
+
+        # A copy has the same fingerprint, and scorers made in other processes
+        # don't, so a cache never mixes them up.
+        self.assertEqual(scorer.fingerprint, self.swedish.fingerprint)
+        script = ('import binascii, passwordmetrics; '
+                  'print(binascii.hexlify(passwordmetrics.Scorer(words={}).fingerprint).decode())')
+        other = subprocess.check_output([sys.executable, '-c', script]).strip()
+        self.assertNotIn(binascii.unhexlify(other),
+                         (self.swedish.fingerprint, self.english.fingerprint))
+
+    def test_collector(self):
+        timings = []
+        result = self.swedish.metrics('korrekthorsebatteri', collector=timings.append)
+        self.assertEqual(result, self.swedish.metrics('korrekthorsebatteri'))
+        self.assertEqual(len(timings), 1)
+        self.assertEqual(timings[0]['length'], 19)
+        self.assertEqual(timings[0]['words'], 2)
+        self.assertTrue(timings[0]['candidates'] >= 2)
+        self.assertTrue(timings[0]['total'] >= timings[0]['scan'] >= 0)
+
+        collector = passwordmetrics.StageTimings()
+        for pw in ['korrekt', 'h\xe4st', 'batteri!!!!']:
+            self.swedish.metrics(pw, collector)
+        stats = collector.stats()
+        self.assertEqual(stats['count'], 3)
+        self.assertIn(stats['slowest']['length'], (7, 4, 11))
+        self.assertEqual(sorted(stats['mean']), sorted(passwordmetrics.StageTimings.STAGES))
+
+    def test_limits(self):
+        english = passwordmetrics.Scorer(words=self.english.words, max_length=7)
+        self.assertEqual(english.find_words('correcthorse'), ({'correct'}, 'horse'))
+        result = english.metrics('correcthorse')
+        self.assertEqual(result['length'], 12)
+        self.assertEqual(result['character_entropy'], english.character_entropy('horse')[0])
+        self.assertEqual(english.session('correcthorse').metrics(), result)
+
+        # Only the first candidate word is within the budget
+        english = passwordmetrics.Scorer(words=self.english.words, max_candidates=1)
+        self.assertEqual(english.find_words('correcthorse'), ({'correct'}, 'horse'))
+        self.assertEqual(english.session('correcthorse').metrics(), english.metrics('correcthorse'))
+
+        # Not enough to find anything
+        english = passwordmetrics.Scorer(words=self.english.words, max_length=0,
+                                         segmentation='optimal')
+        self.assertEqual(english.find_words('correcthorse'), (set(), 'correcthorse'))
+
+        self.assertRaises(ValueError, passwordmetrics.Scorer, words={}, max_length=-1)
+
+    def test_workers(self):
+        passwords = ['korrekthorsebatteri', 'b4tteri', 'h\xe4st!'] * 5
+        self.assertEqual(self.swedish.metrics_batch(passwords, workers=2, chunksize=2),
+                         [self.swedish.metrics(pw) for pw in passwords])
+        # Only the workers have the scorer, the parent doesn't keep it.
+        self.assertIsNone(passwordmetrics._worker_scorer)
+
+
+class TestSegmentation(unittest.TestCase):
+
+    words = {'bcde': 20, 'ab': 1, 'ef': 1, 'cd': 1}
+
+    def test_optimal(self):
+        # The greedy selection takes the longest word first
+        greedy = passwordmetrics.Scorer(words=self.words)
+        self.assertEqual(greedy.find_words('abcdef'), ({'bcde'}, 'af'))
+
+        optimal = passwordmetrics.Scorer(words=self.words, segmentation='optimal')
+        self.assertEqual(optimal.find_words('abcdef'), ({'ab', 'cd', 'ef'}, ''))
+        self.assertEqual(optimal.find_words('4bcdef'), ({'ab', 'cd', 'ef'}, '4'))
+        self.assertEqual(optimal.find_words('abcdef', {'def': 2.0}), ({'def'}, 'abc'))
+        self.assertTrue(optimal.metrics('abcdef')['entropy'] < greedy.metrics('abcdef')['entropy'])
+
+        session = optimal.session('abcd')
+        session.append('ef')
+        self.assertEqual(session.metrics(), optimal.metrics('abcdef'))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, passwordmetrics.Scorer, words=self.words, segmentation='best')
+
+
+class TestPatterns(unittest.TestCase):
+
+    words = {'correct': 10.0, 'horse': 10.0, 'dress': 12.0}
+
+    def test_find_patterns(self):
+        for pw, kind in (('qwertyuiop', 'keyboard'), ('zaq1xsw2', 'keyboard'),
+                         ('abcdefgh', 'sequence'), ('87654321', 'sequence'),
+                         ('abcabcabc', 'repeat'), ('19851231', 'date'),
+                         ('31/12/85', 'date')):
+            patterns = find_patterns(pw)
+            self.assertEqual(set(pattern.kind for pattern in patterns), {kind}, pw)
+            self.assertEqual(''.join(pattern.token for pattern in patterns), pw)
+            self.assertTrue(sum(pattern.entropy for pattern in patterns) <
+                            passwordmetrics.Scorer().character_entropy(pw)[0])
+
+        year = find_patterns('1985')[0]
+        self.assertEqual(find_patterns('x1985y'), [('date', '1985', 1, year.entropy)])
+        # Years are scored from a fixed year, not the one the tests run in.
+        self.assertEqual(year.entropy, math.log(2025 - 1985, 2))
+        self.assertEqual(list(dates('1985', reference_year=2000)), [(0, 4, math.log(20, 2))])
+        self.assertEqual(list(dates('1985', reference_year=2045)), [(0, 4, math.log(60, 2))])
+        # Not a date, and one character repeated is cheaper as characters.
+        self.assertEqual(find_patterns('19851399'), [])
+        self.assertEqual(find_patterns('aaaa'), [])
+
+    def test_metrics(self):
+        plain = passwordmetrics.Scorer(words=self.words)
+        for segmentation in passwordmetrics.SEGMENTATIONS:
+            scorer = passwordmetrics.Scorer(words=self.words, patterns=True,
+                                            segmentation=segmentation)
+            result = scorer.metrics('correct12345678horse')
+            self.assertEqual(result['words'], {'correct', 'horse'})
+            self.assertEqual([(p.kind, p.token, p.start) for p in result['patterns']],
+                             [('sequence', '12345678', 7)])
+            self.assertEqual(result['character_entropy'], 0)
+            self.assertEqual(result['word_entropy'], 20.0 + result['patterns'][0].entropy)
+            self.assertTrue(result['entropy'] < plain.entropy('correct12345678horse'))
+
+            # Words win over patterns that are no longer.
+            self.assertEqual(scorer.metrics('dress')['patterns'], [])
+            self.assertEqual(scorer.metrics('x', compact=True).patterns, ())
+            self.assertEqual(scorer.session('correct1234').metrics(),
+                             scorer.metrics('correct1234'))
+
+        self.assertNotIn('patterns', plain.metrics('correct12345678horse'))
+
+    def test_custom(self):
+        def pins(text):
+            if text.isdigit() and len(text) == 4:
+                yield 0, 4, 1.0
+        scorer = passwordmetrics.Scorer(words=self.words, patterns={'pin': pins})
+        self.assertEqual(scorer.metrics('2580')['patterns'], [('pin', '2580', 0, 1.0)])
+        self.assertEqual(scorer.metrics('2580')['entropy'], 1.0)
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        passwordmetrics.configure(words=passwordmetrics.load_wordlist('docs/ordlista_sv.txt'))
+
+    def test_typing(self):
+        session = passwordmetrics.session()
+        typed = ''
+        for c in 'korrekth\xe4stb4tterih\xe4ftapparat!':
+            session.append(c)
+            typed += c
+            self.assertEqual(session.password, typed)
+            self.assertEqual(session.metrics(), passwordmetrics.metrics(typed))
+
+        session.backspace(8)
+        self.assertEqual(session.password, 'korrekth\xe4stb4tterih\xe4ft')
+        self.assertEqual(session.metrics(), passwordmetrics.metrics('korrekth\xe4stb4tterih\xe4ft'))
+
+    def test_update(self):
+        session = passwordmetrics.session('korrekthorsebatteri')
+        self.assertEqual(session.metrics()['words'], {'korrekt', 'batteri'})
+
+        session.update('korrekth\xe4stbatteri')
+        self.assertEqual(session.metrics(), passwordmetrics.metrics('korrekth\xe4stbatteri'))
+
+        session.update('')
+        self.assertEqual(session.metrics(), passwordmetrics.metrics(''))
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        passwordmetrics.configure(words=passwordmetrics.load_wordlist('docs/ordlista_sv.txt'))
+
+    def tearDown(self):
+        passwordmetrics.disable_cache()
+
+    def test_cache(self):
+        cache = passwordmetrics.enable_cache(maxsize=2)
+        expected = passwordmetrics._scorer.metrics('korrekthorse')
+        self.assertEqual(passwordmetrics.metrics('korrekthorse'), expected)
+        self.assertEqual(passwordmetrics.metrics('korrekthorse'), expected)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0,
+                                         'size': 1, 'maxsize': 2})
+
+        # Modifying the result does not modify the cache
+        passwordmetrics.metrics('korrekthorse')['words'].add('horse')
+        self.assertEqual(passwordmetrics.metrics('korrekthorse'), expected)
+
+        passwordmetrics.metrics('batteri')
+        passwordmetrics.metrics('h\xe4st')
+        self.assertEqual(cache.evictions, 1)
+        # The least recently used password was evicted
+        passwordmetrics.metrics('korrekthorse')
+        self.assertEqual(cache.misses, 4)
+
+    def test_configure_invalidates(self):
+        cache = passwordmetrics.enable_cache()
+        passwordmetrics.metrics('korrekthorse')
+        passwordmetrics.configure(words={'horse': 5})
+        self.assertEqual(passwordmetrics.metrics('korrekthorse')['words'], {'horse'})
+        self.assertEqual(cache.hits, 0)
+
+    def test_hash_passwords(self):
+        cache = passwordmetrics.enable_cache(hash_passwords=True)
+        passwordmetrics.metrics('korrekthorse')
+        passwordmetrics.metrics('korrekthorse')
+        self.assertEqual(cache.hits, 1)
+        for fingerprint, key in cache._data:
+            self.assertNotEqual(key, 'korrekthorse')
+
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'words.txt')
+        self.write_words({'correct': 10.0})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        passwordmetrics.configure(words=passwordmetrics.load_wordlist('docs/ordlista_sv.txt'))
+
+    def write_words(self, words):
+        # Replaced by renaming, like it should be done.
+        new = self.path + '.new'
+        with open(new, 'wt', encoding='latin-1') as f:
+            for word, entropy in words.items():
+                f.write(u'%s %s\n' % (word, entropy))
+        os.rename(new, self.path)
+
+    def test_background(self):
+        passwordmetrics.configure(words={'horse': 10.0})
+        thread = passwordmetrics.configure(words=self.path, background=True)
+        thread.join()
+        self.assertEqual(passwordmetrics.metrics('correcthorse')['words'], {'correct'})
+
+    def test_background_overtaken(self):
+        # A background build that finishes after a later configure() is dropped.
+        started = threading.Event()
+        finish = threading.Event()
+        build_scorer = passwordmetrics._build_scorer
+
+        def slow_build(kwargs):
+            started.set()
+            finish.wait()
+            return build_scorer(kwargs)
+
+        passwordmetrics._build_scorer = slow_build
+        try:
+            thread = passwordmetrics.configure(words={'correct': 10.0}, background=True)
+            started.wait()
+            passwordmetrics.configure(words={'horse': 10.0})
+            finish.set()
+            thread.join()
+        finally:
+            passwordmetrics._build_scorer = build_scorer
+        self.assertEqual(passwordmetrics.metrics('correcthorse')['words'], {'horse'})
+
+    def test_background_errors(self):
+        passwordmetrics.configure(words={'horse': 10.0})
+        # Bad arguments and missing files raise before the thread starts.
+        self.assertRaises(ValueError, passwordmetrics.configure, words=self.path,
+                          segmentation='nonsense', background=True)
+        self.assertRaises(IOError, passwordmetrics.configure,
+                          words=os.path.join(self.tempdir, 'missing.txt'), background=True)
+
+        # A build that fails anyway keeps its error, and the old configuration.
+        with open(self.path, 'wt', encoding='latin-1') as f:
+            f.write(u'correct ten\n')
+        thread = passwordmetrics.configure(words=self.path, background=True)
+        thread.join()
+        self.assertIsInstance(thread.error, ValueError)
+        self.assertIsNone(thread.scorer)
+        self.assertEqual(passwordmetrics.metrics('correcthorse')['words'], {'horse'})
+
+    def test_watch(self):
+        watcher = passwordmetrics.watch(interval=3600, words=self.path)
+        try:
+            self.assertEqual(passwordmetrics.metrics('correcthorse')['words'], {'correct'})
+            self.assertFalse(watcher.check())
+
+            self.write_words({'correct': 10.0, 'horse': 10.0})
+            self.assertTrue(watcher.check())
+            self.assertEqual(passwordmetrics.metrics('correcthorse')['words'],
+                             {'correct', 'horse'})
+            self.assertEqual(watcher.reloads, 2)
+
+            # A broken file keeps the old configuration.
+            with open(self.path, 'wt', encoding='latin-1') as f:
+                f.write(u'horse\n')
+            self.assertFalse(watcher.check())
+            self.assertIsInstance(watcher.error, ValueError)
+            self.assertEqual(passwordmetrics.metrics('correcthorse')['words'],
+                             {'correct', 'horse'})
+        finally:
+            watcher.stop()
+
+    def test_callback(self):
+        scorers = []
+        watcher = passwordmetrics.Watcher(callback=scorers.append, words=self.path)
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(scorers, [watcher.scorer])
+        self.assertEqual(watcher.paths(), [self.path])
+
+
+class TestBatch(unittest.TestCase):
+
+    passwords = [u'korrekth\xe4stbatterih\xe4ftapparat', 'b4tteri', 'xyFg98%!', '', 'h\xe4st' * 3]
+
+    def setUp(self):
+        passwordmetrics.configure(words=passwordmetrics.load_wordlist('docs/ordlista_sv.txt'))
+
+    def test_metrics_batch(self):
+        expected = [passwordmetrics.metrics(pw) for pw in self.passwords]
+        self.assertEqual(passwordmetrics.metrics_batch(self.passwords), expected)
+        self.assertEqual(list(passwordmetrics.metrics_iter(iter(self.passwords))), expected)
+
+    def test_entropy_only(self):
+        columns = passwordmetrics.metrics_batch(iter(self.passwords), entropy_only=True)
+        for i, pw in enumerate(self.passwords):
+            expected = passwordmetrics.metrics(pw)
+            for column in ('entropy', 'word_entropy', 'character_entropy'):
+                self.assertEqual(columns[column][i], expected[column])
+
+    def test_workers(self):
+        passwords = self.passwords * 10
+        expected = passwordmetrics.metrics_batch(passwords)
+        self.assertEqual(passwordmetrics.metrics_batch(passwords, workers=2, chunksize=3), expected)
+
+        columns = passwordmetrics.metrics_batch(passwords, entropy_only=True, workers=2, chunksize=3)
+        self.assertEqual(list(columns['entropy']), [m['entropy'] for m in expected])
+
+    def test_bad_chunks(self):
+        self.assertRaises(ValueError, passwordmetrics.metrics_batch, self.passwords, chunksize=0)
+        self.assertRaises(ValueError, passwordmetrics.metrics_batch, self.passwords,
+                          entropy_only=True, chunksize=0)
+        self.assertRaises(ValueError, passwordmetrics.metrics_iter, self.passwords, workers=-1)
+
+    @unittest.skipIf(not _vectorized.available(), 'Needs NumPy')
+    def test_vectorized(self):
+        # NumPy is only imported when it's used.
+        script = 'import sys, passwordmetrics; print("numpy" in sys.modules)'
+        self.assertEqual(subprocess.check_output([sys.executable, '-c', script]).strip(), b'False')
+
+        groups = {'letters': set(string.ascii_letters), 'vowels': set('aeiou\xe4'),
+                  'other': set('0123456789\u20ac')}
+        scorer = passwordmetrics.Scorer(groups=groups, words={'troll': 10.0})
+        passwords = ['trollsoup', '', '\u20ac99\u2603', '\xe4\xe4', 'z\U0001f600']
+        expected = [scorer.character_entropy(pw) for pw in passwords]
+        self.assertEqual(_vectorized.character_entropies(scorer._group_table, passwords),
+                         expected)
+        self.assertEqual(scorer.metrics_batch(passwords),
+                         [scorer.metrics(pw) for pw in passwords])
+
+
+@unittest.skipIf(passwordmetrics._speedups is None, 'Needs the C speedups')
+class TestSpeedups(unittest.TestCase):
+
+    passwords = ['korrekth\xe4stbatterih\xe4ftapparat', 'b4tteri', 'K0RREKT1', 'xyFg98%!', '',
+                 'h\xe4st' * 3, 'qwerty19851231', 'tr\u0131ll\u20ac', 'batter\U0001f600ih\xe4st']
+
+    def setUp(self):
+        self.speedups = passwordmetrics._speedups
+        self.tempdir = tempfile.mkdtemp()
+        self.words = passwordmetrics.load_wordlist('docs/ordlista_sv.txt')
+        self.compiled = os.path.join(self.tempdir, 'ordlista_sv.pmw')
+        write_compiled(self.words, self.compiled)
+
+    def tearDown(self):
+        passwordmetrics._speedups = self.speedups
+        shutil.rmtree(self.tempdir)
+
+    def assertSameMetrics(self, **kwargs):
+        # The C code, the Python code, and the compiled word list, which
+        # has its own C and Python code for finding words.
+        results = []
+        for speedups, words in ((self.speedups, self.words), (None, self.words),
+                                (self.speedups, self.compiled), (None, self.compiled)):
+            passwordmetrics._speedups = speedups
+            scorer = passwordmetrics.Scorer(words=words, **kwargs)
+            results.append([scorer.metrics(pw) for pw in self.passwords])
+        for result in results[1:]:
+            self.assertEqual(results[0], result)
+
+    def test_default(self):
+        self.assertSameMetrics()
+        self.assertSameMetrics(segmentation='optimal', patterns=True)
+
+    def test_substitutions(self):
+        self.assertSameMetrics(substitutions={'1': 'il', '4': 'a', '\u0131': 'i'})
+
+    def test_expected(self):
+        # Agreeing isn't enough, they must also be right.
+        scorer = passwordmetrics.Scorer(words={'hello': 5, 'abc': 5},
+                                        substitutions={'1': 'il', '8': 'ab'})
+        self.assertEqual(scorer.find_words('hel1o'), ({'hello'}, '1'))
+        self.assertEqual(scorer.find_words('a8c'), ({'abc'}, '8'))
+        scorer = passwordmetrics.Scorer(words=self.words)
+        self.assertEqual(scorer.find_words('b4tteri'), ({'batteri'}, '4'))
+        self.assertEqual(scorer.character_entropy('b4tteri'),
+                         (6 * math.log(36, 2), set()))
+
+    def test_compiled_scan(self):
+        compiled = CompiledWordlist(self.compiled)
+        alternatives = passwordmetrics._compile_substitutions({'1': 'il', '4': 'a', '3': 'e'})
+        for pw in self.passwords + ['\u0130nte1', 'b4tt3r1h\xe4st1']:
+            passwordmetrics._speedups = self.speedups
+            fast = compiled.scan(pw, alternatives)
+            passwordmetrics._speedups = None
+            self.assertEqual([set(words) for words in fast],
+                             [set(words) for words in compiled.scan(pw, alternatives)])
+        for word in ['batteri', 'h\xe4st', 'batt', 'batterix', '', '\u20ac']:
+            passwordmetrics._speedups = self.speedups
+            fast = compiled.get(word)
+            passwordmetrics._speedups = None
+            self.assertEqual(fast, compiled.get(word))
+            self.assertEqual(fast, self.words.get(word))
+
+    def test_groups(self):
+        # Overlapping groups, where the order of the characters matters
+        self.assertSameMetrics(groups={'letters': set(string.ascii_letters + '\xe4\u0131'),
+                                       'vowels': set('aeiouAEIOU'),
+                                       'other': set(string.digits + string.punctuation + '\u20ac')})
+
+
+@unittest.skipIf(aio is None, 'Needs asyncio')
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.scorer = passwordmetrics.Scorer(words=passwordmetrics.load_wordlist('docs/ordlista_sv.txt'))
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_metrics(self):
+        scorer = aio.AsyncScorer(self.scorer, max_pending=1)
+        passwords = ['korrekthorsebatteri', 'b4tteri', 'korrekthorsebatteri']
+        results = self.loop.run_until_complete(
+            asyncio.gather(*[scorer.metrics(pw) for pw in passwords]))
+        self.assertEqual(results, [self.scorer.metrics(pw) for pw in passwords])
+        # The same password was only scored once, but each got a copy
+        self.assertIsNot(results[0]['words'], results[2]['words'])
+
+    def test_batch(self):
+        scorer = aio.AsyncScorer(self.scorer)
+        passwords = ['korrekthorsebatteri', 'b4tteri', 'h\xe4st!'] * 5
+        results = self.loop.run_until_complete(scorer.metrics_batch(passwords, chunksize=4))
+        self.assertEqual(results, [self.scorer.metrics(pw) for pw in passwords])
+
+    def test_no_strong_references(self):
+        # With a thread executor the registry doesn't keep old scorers alive.
+        scorer = passwordmetrics.Scorer(words={'batteri': 10.0})
+        self.loop.run_until_complete(aio.AsyncScorer(scorer).metrics('b4tteri'))
+        self.assertIs(aio._weak_scorers[scorer.fingerprint], scorer)
+        self.assertNotIn(scorer.fingerprint, aio._scorers)
+        reference = weakref.ref(scorer)
+        del scorer
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_process_pool(self):
+        sent = []
+
+        class Executor(concurrent.futures.ProcessPoolExecutor):
+            def submit(self, function, *args):
+                sent.append(len(args) == 4)
+                return super(Executor, self).submit(function, *args)
+
+        with Executor(1) as executor:
+            scorer = aio.AsyncScorer(self.scorer, executor)
+            passwords = ['korrekthorsebatteri', 'b4tteri', 'h\xe4st!']
+            results = [self.loop.run_until_complete(scorer.metrics(pw)) for pw in passwords]
+            results.append(self.loop.run_until_complete(scorer.metrics_batch(passwords)))
+        self.assertEqual(results, [self.scorer.metrics(pw) for pw in passwords] +
+                         [[self.scorer.metrics(pw) for pw in passwords]])
+        # The scorer was only sent to the worker once.
+        self.assertEqual(sent.count(True), 1)
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tempdir, 'passwords.txt')
+        self.outfile = os.path.join(self.tempdir, 'out')
+        with open(self.infile, 'wt', encoding='utf-8', newline='') as f:
+            f.write('korrekthorsebatteri\nb4tteri\r\nh\xe4st!\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_cli(self, *args):
+        cli.main(['--wordlist', 'docs/ordlista_sv.txt', '-o', self.outfile, self.infile] + list(args))
+        with open(self.outfile, 'rt', encoding='utf-8') as f:
+            return f.read()
+
+    def test_csv(self):
+        self.assertEqual(self.run_cli('--fields', 'password,words,length').splitlines(),
+                         ['password,words,length',
+                          'korrekthorsebatteri,batteri korrekt,19',
+                          'b4tteri,batteri,7',
+                          'h\xe4st!,h\xe4st,5'])
+
+    def test_jsonl(self):
+        scorer = passwordmetrics.Scorer(words='docs/ordlista_sv.txt')
+        lines = self.run_cli('--format', 'jsonl', '--fields', 'password,entropy',
+                             '--max-entropy', '20', '--workers', '2').splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'password': pw, 'entropy': scorer.metrics(pw)['entropy']}
+                          for pw in ['b4tteri', 'h\xe4st!']])
+
+    def test_unknown_characters(self):
+        # Lines of only characters in no group, or that can't be decoded
+        with open(self.infile, 'ab') as f:
+            f.write('\u20ac\n'.encode('utf-8') + b'\xff\xfe\n')
+        lines = self.run_cli('--fields', 'entropy').splitlines()
+        self.assertEqual(lines[4:], ['0.0', '2.0'])
+
+        # The bytes that can't be decoded are written back as they were.
+        cli.main(['--wordlist', 'docs/ordlista_sv.txt', '-o', self.outfile, self.infile,
+                  '--fields', 'password,entropy', '--format', 'jsonl'])
+        with open(self.outfile, 'rb') as f:
+            self.assertEqual(f.read().splitlines()[-1],
+                             b'{"entropy": 2.0, "password": "\xff\xfe"}')
+
+    def test_broken_pipe(self):
+        with open(self.infile, 'wt', encoding='utf-8') as f:
+            for i in range(50000):
+                f.write('b4tteri%s\n' % i)
+        process = subprocess.Popen([sys.executable, '-m', 'passwordmetrics', '--wordlist',
+                                    'docs/ordlista_sv.txt', self.infile],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(process.stdout.readline(), b'password,entropy\r\n')
+        process.stdout.close()
+        process.wait()
+        self.assertEqual(process.stderr.read(), b'')
+        process.stderr.close()
+
+    def test_bad_chunksize(self):
+        self.assertRaises(SystemExit, cli.make_parser().parse_args, ['--chunksize', '0'])
+        self.assertRaises(SystemExit, cli.make_parser().parse_args, ['--workers', '-1'])
+        self.assertRaises(SystemExit, cli.make_parser().parse_args, ['--max-length', '-1'])
+
+
+class TestWordlistCompile(unittest.TestCase):
+
+    text = ('The quick brown fox jumps over the lazy dog. The dog sleeps, the fox '
+            'runs and the quick dog barks at the fox over the hill.\n') * 3
+
+    @classmethod
+    def setUpClass(cls):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), 'utils'))
+        import wordlist_compile
+        cls.compile = wordlist_compile
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_count_words(self):
+        pairs = list(self.compile.read_text(self.text.splitlines()))
+        expected = collections.Counter()
+        for word, count in pairs:
+            expected[word] += count
+        # Few enough words per chunk that it spills several times
+        counts = list(self.compile.count_words(iter(pairs), 3, self.tempdir))
+        self.assertTrue(len(os.listdir(self.tempdir)) > 2)
+        self.assertEqual(counts, sorted(expected.items()))
+
+    def test_min_count(self):
+        pairs = self.compile.read_text(self.text.splitlines())
+        words = dict(self.compile.make_wordlist(pairs, min_count=7, chunk_words=2))
+        self.assertEqual(sorted(words), ['dog', 'fox', 'the', 'troubador'])
+        self.assertEqual(words['the'], 0.5)
+
+    def test_compiled(self):
+        infile = os.path.join(self.tempdir, 'text.txt')
+        outfile = os.path.join(self.tempdir, 'words.pmw')
+        with open(infile, 'wt', encoding='utf-8') as f:
+            f.write(self.text)
+        self.compile.main(['--format', 'text', '--encoding', 'utf-8', '--chunk-words', '2',
+                           '--min-count', '3', '--compiled', outfile, infile])
+        pairs = self.compile.read_text(self.text.splitlines())
+        expected = dict(self.compile.make_wordlist(pairs, min_count=3))
+        self.assertEqual(dict(CompiledWordlist(outfile).items()), expected)
+        scorer = passwordmetrics.Scorer(words=outfile)
+        self.assertEqual(scorer.find_words('quickfox1'), ({'quick', 'fox'}, '1'))
+
+
+class TestBlocklist(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'breached.pmb')
+        self.breached = ['Tr0ub4dor&3', 'korrekthorsebatteri', 'h\xe4st!'] + \
+            ['password%s' % i for i in range(1000)]
+        write_blocklist(self.breached, self.path, len(self.breached), fp_rate=0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_blocklist(self):
+        blocklist = Blocklist(self.path)
+        self.assertEqual(len(blocklist), 1003)
+        for pw in self.breached:
+            self.assertIn(pw, blocklist)
+        false_positives = sum(1 for i in range(10000) if 'other%s' % i in blocklist)
+        self.assertTrue(false_positives < 300)
+        self.assertAlmostEqual(blocklist.fp_rate, 0.01, 2)
+
+    def test_truncated(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for size in (len(data) - 1, 16):
+            with open(self.path, 'wb') as f:
+                f.write(data[:size])
+            self.assertRaises(ValueError, Blocklist, self.path)
+
+    def test_build(self):
+        infile = os.path.join(self.tempdir, 'breached.txt')
+        with open(infile, 'wt', encoding='utf-8') as f:
+            f.write('\n'.join(self.breached) + '\n')
+        build_blocklist(infile, self.path)
+        blocklist = Blocklist(self.path)
+        self.assertEqual(len(blocklist), 1003)
+        self.assertIn('h\xe4st!', blocklist)
+
+    def test_metrics(self):
+        words = passwordmetrics.load_wordlist('docs/ordlista_sv.txt')
+        scorer = passwordmetrics.Scorer(words=words, blocklist=self.path)
+        result = scorer.metrics('korrekthorsebatteri')
+        self.assertTrue(result['breached'])
+        # The entropy is that of guessing from the list
+        self.assertEqual(result['entropy'], math.log(1003, 2))
+        self.assertEqual(scorer.entropy('korrekthorsebatteri'), math.log(1003, 2))
+        self.assertEqual(scorer.metrics_batch(['korrekthorsebatteri'], entropy_only=True)['entropy'][0],
+                         math.log(1003, 2))
+        self.assertEqual(scorer.metrics('korrekthorsebatteri', compact=True).as_dict(), result)
+
+        result = scorer.metrics('h\xe4st!')
+        self.assertTrue(result['breached'])
+        # It was already lower than that
+        self.assertEqual(result['entropy'], 7.7)
+
+        self.assertFalse(scorer.metrics('batteri!horse')['breached'])
+        self.assertNotIn('breached', passwordmetrics.Scorer(words=words).metrics('h\xe4st!'))
+
+        scorer = pickle.loads(pickle.dumps(scorer))
+        self.assertTrue(scorer.metrics('Tr0ub4dor&3')['breached'])
+
+
+class TestCompiledWordlist(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.words = passwordmetrics.load_wordlist('docs/ordlista_sv.txt')
+        self.path = os.path.join(self.tempdir, 'ordlista_sv.pmw')
+        write_compiled(self.words, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_mapping(self):
+        compiled = passwordmetrics.load_wordlist(self.path)
+        self.assertTrue(isinstance(compiled, CompiledWordlist))
+        self.assertEqual(len(compiled), len(self.words))
+        self.assertEqual(dict(compiled.items()), self.words)
+        self.assertEqual(compiled[u'h\xe4st'], self.words[u'h\xe4st'])
+        self.assertTrue('korrekt' in compiled)
+        self.assertFalse('korrek' in compiled)
+        self.assertRaises(KeyError, compiled.__getitem__, 'correct')
+
+    def test_metrics(self):
+        passwordmetrics.configure(words=self.words)
+        expected = passwordmetrics.metrics(u'korrekth\xe4stbatterih\xe4ftapparat')
+
+        passwordmetrics.configure(words=self.path)
+        self.assertTrue(isinstance(passwordmetrics.config['words'], CompiledWordlist))
+        self.assertEqual(passwordmetrics.metrics(u'korrekth\xe4stbatterih\xe4ftapparat'), expected)
+
+
+
+class TestShared(unittest.TestCase):
+
+    passwords = [u'korrekth\xe4stbatterih\xe4ftapparat', 'b4tteri', 'qwerty1985', 'xyFg98%!', '']
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'config.pms')
+        self.words = passwordmetrics.load_wordlist('docs/ordlista_sv.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        passwordmetrics.configure(words=self.words)
+
+    def test_attach(self):
+        kwargs = dict(words=self.words, segmentation='optimal', patterns=True,
+                      substitutions={'4': 'a', '1': 'il'}, max_length=30)
+        scorer = passwordmetrics.Scorer(**kwargs)
+        passwordmetrics.share(self.path, **kwargs)
+        passwordmetrics.attach(self.path)
+        self.assertTrue(isinstance(passwordmetrics.config['words'], CompiledWordlist))
+        for pw in self.passwords:
+            self.assertEqual(passwordmetrics.metrics(pw), scorer.metrics(pw))
+
+    def test_wordlists(self):
+        wordlists = {'sv': self.words, 'other': {'batteri': 5.0, 'xyz': 3.0}}
+        scorer = passwordmetrics.Scorer(wordlists=wordlists)
+        passwordmetrics.share(self.path, wordlists=wordlists)
+        shared = load_shared(self.path)
+        for pw in self.passwords:
+            self.assertEqual(shared.metrics(pw), scorer.metrics(pw))
+        # Pickled scorers, as sent to workers, map the same file.
+        copy = pickle.loads(pickle.dumps(shared))
+        self.assertEqual(copy.metrics(self.passwords[0]), scorer.metrics(self.passwords[0]))
+
+    def test_replace(self):
+        passwordmetrics.share(self.path, words={'correct': 10.0})
+        old = load_shared(self.path)
+        passwordmetrics.share(self.path, words={'horse': 10.0})
+        self.assertEqual(old.metrics('correcthorse')['words'], {'correct'})
+        self.assertEqual(load_shared(self.path).metrics('correcthorse')['words'], {'horse'})
+        self.assertEqual(os.listdir(self.tempdir), ['config.pms'])
+
+    def test_settings(self):
+        blocklist = os.path.join(self.tempdir, 'breached.pmb')
+        write_blocklist(['b4tteri'], blocklist, 1)
+        kwargs = dict(words={'batteri': 10.0}, blocklist=blocklist,
+                      patterns={'date': dates, 'keyboard': keyboard_walks},
+                      substitutions={'4': ('a', 'h')})
+        passwordmetrics.share(self.path, **kwargs)
+        shared = load_shared(self.path)
+        self.assertEqual(list(shared.patterns.values()), [dates, keyboard_walks])
+        scorer = passwordmetrics.Scorer(**kwargs)
+        # On Python 2 the Latin-1 characters of the groups are byte strings.
+        self.assertEqual(shared.groups, scorer.groups)
+        for pw in self.passwords + [str('b') + chr(0xe4) + str('tteri')]:
+            self.assertEqual(shared.metrics(pw), scorer.metrics(pw))
+
+    def test_detectors(self):
+        # Custom detectors are saved by kind, and must be given again.
+        def digits(text):
+            return [(match.start(), match.end(), 3.3 * len(match.group()))
+                    for match in re.finditer('[0-9]+', text)]
+        patterns = collections.OrderedDict([('digits', digits), ('date', dates)])
+        kwargs = dict(words={'batteri': 10.0}, patterns=patterns)
+        passwordmetrics.share(self.path, **kwargs)
+        self.assertRaises(ValueError, load_shared, self.path)
+        self.assertRaises(ValueError, passwordmetrics.attach, self.path)
+        shared = load_shared(self.path, detectors={'digits': digits})
+        self.assertEqual(list(shared.patterns.values()), [digits, dates])
+        scorer = passwordmetrics.Scorer(**kwargs)
+        for pw in self.passwords:
+            self.assertEqual(shared.metrics(pw), scorer.metrics(pw))
+
+    def test_outside_callable(self):
+        # Only the library's own detectors are looked up by name.
+        passwordmetrics.share(self.path, words={'batteri': 10.0}, patterns={'date': dates})
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        config = data.find(b'"passwordmetrics.patterns:dates"')
+        name = b'"os:system"'.ljust(len(b'"passwordmetrics.patterns:dates"'))
+        with open(self.path, 'wb') as f:
+            f.write(data[:config] + name + data[config + len(name):])
+        self.assertRaises(ValueError, load_shared, self.path)
+
+    def test_not_shared(self):
+        path = os.path.join(self.tempdir, 'words.pmw')
+        write_compiled(self.words, path)
+        self.assertRaises(ValueError, load_shared, path)
+
+
 if __name__ == '__main__':
     unittest.main()
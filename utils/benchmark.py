@@ -0,0 +1,492 @@
+"""Benchmarks for passwordmetrics.
+
+Run from the root of the checkout, for example:
+
+    python utils/benchmark.py wordlist passwordmetrics/wordlist_en.txt
+
+The stages benchmark needs nothing but the checkout, save a baseline with
+--save and check for regressions against it with --compare.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Run in a fresh interpreter, to measure what a newly started worker pays.
+COLD_START = """
+import json, sys, time
+start = time.time()
+import passwordmetrics
+passwordmetrics.configure(words=sys.argv[1])
+passwordmetrics.metrics('correcthorseb!wdbatterystaplerWd3t')
+elapsed = time.time() - start
+# Shared pages are part of RSS, but only private pages cost memory per worker.
+rss = private = None
+try:
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith('Rss:'):
+                rss = int(line.split()[1])
+            elif line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                private = (private or 0) + int(line.split()[1])
+except IOError:
+    pass
+print(json.dumps({'seconds': elapsed, 'rss_kb': rss, 'private_kb': private}))
+"""
+
+
+# Runs the word list compiler, and reports its time and peak memory.
+COMPILE = """
+import json, resource, runpy, sys, time
+start = time.time()
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+elapsed = time.time() - start
+print(json.dumps({'seconds': elapsed,
+                  'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+
+def cold_start(path, repeat):
+    runs = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', COLD_START, path], cwd=ROOT)
+        runs.append(json.loads(output.decode('ascii')))
+    runs.sort(key=lambda x: x['seconds'])
+    return runs[len(runs) // 2]
+
+
+def sample_passwords(words, count, seed=0):
+    """Makes passwords from a couple of words, some leet and random characters"""
+    rnd = random.Random(seed)
+    words = sorted(words)
+    leet = {'a': '4', 'e': '3', 'i': '1', 'o': '0', 's': '$', 't': '7'}
+    passwords = []
+    for i in range(count):
+        parts = [rnd.choice(words) for j in range(rnd.randint(1, 4))]
+        pw = ''.join(parts)
+        pw = ''.join(leet[c] if c in leet and rnd.random() < 0.2 else c for c in pw)
+        pw += ''.join(rnd.choice('0123456789!#%&ABCXYZ') for j in range(rnd.randint(0, 4)))
+        passwords.append(pw)
+    return passwords
+
+
+def synthetic_words(count, seed=0):
+    """Makes a word list of random lowercase words, the common ones short"""
+    rnd = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = {}
+    while len(words) < count:
+        length = min(3 + int(rnd.expovariate(0.3)), 16)
+        word = ''.join(rnd.choice(letters) for i in range(length))
+        if word not in words:
+            # Entropy grows with the rank, like in the real word lists.
+            words[word] = round(math.log(len(words) + 2, 2), 2)
+    return words
+
+
+def stage_passwords(words, substitutions, length, density, count, seed=0):
+    """Makes passwords of words, where density of the letters are substituted"""
+    rnd = random.Random(seed)
+    vocabulary = sorted(words)
+    leet = {}
+    for c, alternatives in sorted(substitutions.items()):
+        for alternative in alternatives:
+            leet.setdefault(alternative, []).append(c)
+    passwords = []
+    for i in range(count):
+        pw = ''
+        while len(pw) < length:
+            pw += rnd.choice(vocabulary)
+        pw = ''.join(rnd.choice(leet[c]) if c in leet and rnd.random() < density else c
+                     for c in pw[:length])
+        passwords.append(pw)
+    return passwords
+
+
+def time_stage(function, passwords, repeat):
+    """Returns the best time of calling function on all the passwords"""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for pw in passwords:
+            function(pw)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def allocations(function, passwords):
+    """Returns the peak and total kB allocated while calling function"""
+    if tracemalloc is None:
+        return None, None
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for pw in passwords:
+            function(pw)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # Everything allocated and not freed yet, which includes any caches.
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                if stat.size_diff > 0)
+    return peak / 1024.0, total / 1024.0
+
+
+def bench_stages(args):
+    """Times configure() and each scoring stage, for many configuration sizes"""
+    import passwordmetrics
+
+    stages = [('find_groups', passwordmetrics._find_groups),
+              ('find_words', lambda pw: passwordmetrics._find_words(pw, passwordmetrics.config['words'])),
+              ('character_entropy', passwordmetrics._character_entropy),
+              ('metrics', passwordmetrics.metrics),
+              ]
+    wordlists = [(os.path.basename(args.wordlist), passwordmetrics.load_wordlist(args.wordlist))]
+    for size in args.sizes:
+        wordlists.append(('synthetic-%s' % size, synthetic_words(size)))
+
+    results = {}
+    print('%-18s %6s %6s %-18s %12s %10s %10s' % ('words', 'length', 'subs', 'stage',
+                                                  'per second', 'peak kB', 'kept kB'))
+    for name, words in wordlists:
+        start = time.time()
+        passwordmetrics.configure(words=words)
+        elapsed = time.time() - start
+        results['%s/configure' % name] = {'seconds': elapsed}
+        print('%-18s %6s %6s %-18s %12.2f %10s %10s' % (name, '', '', 'configure', 1 / elapsed,
+                                                        '', ''))
+        for length in args.lengths:
+            for density in args.densities:
+                passwords = stage_passwords(words, passwordmetrics.config['substitutions'],
+                                            length, density, args.count)
+                for stage, function in stages:
+                    elapsed = time_stage(function, passwords, args.repeat)
+                    result = {'per_second': args.count / elapsed}
+                    if args.allocations:
+                        result['peak_kb'], result['kept_kb'] = allocations(function, passwords)
+                    results['%s/%s/%s/%s' % (name, length, density, stage)] = result
+                    print('%-18s %6s %6s %-18s %12.0f %10s %10s' % (
+                        name, length, density, stage, result['per_second'],
+                        _kb(result.get('peak_kb')), _kb(result.get('kept_kb'))))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+def _kb(value):
+    if value is None:
+        return '-'
+    return '%.1f' % value
+
+
+def compare(baseline, results, tolerance):
+    """Prints the changes from a saved baseline, returns False on a regression"""
+    regressions = 0
+    print()
+    print('%-50s %12s %12s %8s' % ('case', 'baseline', 'now', 'change'))
+    for key in sorted(set(baseline) & set(results)):
+        if 'seconds' in results[key]:
+            # Less is better, turn it into a rate like the rest.
+            before = 1 / baseline[key]['seconds']
+            after = 1 / results[key]['seconds']
+        else:
+            before = baseline[key]['per_second']
+            after = results[key]['per_second']
+        change = after / before - 1
+        flag = ''
+        if change < -tolerance:
+            flag = ' SLOWER'
+            regressions += 1
+        print('%-50s %12.1f %12.1f %+7.1f%%%s' % (key, before, after, change * 100, flag))
+    print('%s of %s cases are more than %.0f%% slower' % (
+        regressions, len(set(baseline) & set(results)), tolerance * 100))
+    return regressions == 0
+
+
+def adversarial_cases(words):
+    """Returns (name, word list, password maker) for inputs made to be slow"""
+    rnd = random.Random(0)
+    vocabulary = sorted(words)
+    return [
+        # Every substring is a word.
+        ('repeated', dict(('a' * i, i) for i in range(1, 33)), lambda n: 'a' * n),
+        # Cutting out a word makes a new one, over and over.
+        ('nested', {'ab': 1.0, 'b': 2.0}, lambda n: 'a' * (n // 2) + 'b' * (n - n // 2)),
+        # Every character can be read as many letters.
+        ('substituted', words, lambda n: ''.join(rnd.choice('013457@$!') for i in range(n))),
+        ('words', words, lambda n: ''.join(rnd.choice(vocabulary) for i in range(n))[:n]),
+    ]
+
+
+def bench_adversarial(args):
+    """Time per character of hostile passwords, with and without limits"""
+    import passwordmetrics
+
+    words = passwordmetrics.load_wordlist(args.wordlist)
+    limits = {'max_length': args.max_length, 'max_candidates': args.max_candidates}
+    print('%-12s %-8s %-8s %8s %10s %10s' % ('case', 'mode', 'limits', 'length', 'seconds',
+                                              'us/char'))
+    for name, case_words, make in adversarial_cases(words):
+        for mode in passwordmetrics.SEGMENTATIONS:
+            scorers = [('none', passwordmetrics.Scorer(words=case_words, segmentation=mode)),
+                       ('on', passwordmetrics.Scorer(words=case_words, segmentation=mode,
+                                                     **limits))]
+            for label, scorer in scorers:
+                for length in args.lengths:
+                    pw = make(length)
+                    elapsed = time_stage(scorer.metrics, [pw], args.repeat)
+                    # Linear time shows as the same time per character.
+                    print('%-12s %-8s %-8s %8s %10.4f %10.2f' % (
+                        name, mode, label, length, elapsed, elapsed / length * 1e6))
+
+
+def synthetic_corpus(path, lines, vocabulary, seed=0):
+    """Writes ANC style word counts, where common words are much more common"""
+    rnd = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    with open(path, 'w') as f:
+        for i in range(lines):
+            # Low ranks are common, and every rank is its own word.
+            rank = int(vocabulary ** rnd.random()) - 1
+            word = ''
+            while True:
+                rank, letter = divmod(rank, 26)
+                word += letters[letter]
+                if not rank:
+                    break
+            f.write('%s\t%s\tNN\t%s\n' % (word, word, rnd.randint(1, 100)))
+
+
+def bench_compile(args):
+    """Time and peak memory of compiling a word list from a big corpus"""
+    tempdir = tempfile.mkdtemp()
+    try:
+        corpus = os.path.join(tempdir, 'corpus.txt')
+        start = time.time()
+        synthetic_corpus(corpus, args.lines, args.vocabulary)
+        print('Made a corpus of %s lines, %.1f MB, in %.1f seconds' % (
+            args.lines, os.path.getsize(corpus) / 1e6, time.time() - start))
+        script = os.path.join(ROOT, 'utils', 'wordlist_compile.py')
+        print('%12s %-9s %10s %12s' % ('chunk words', 'output', 'seconds', 'max rss kB'))
+        for chunk_words in args.chunk_words:
+            for output in ('text', 'compiled'):
+                outfile = os.path.join(tempdir, 'out')
+                command = [sys.executable, '-c', COMPILE, script, corpus,
+                           '--chunk-words', str(chunk_words), '--tempdir', tempdir,
+                           '--min-count', str(args.min_count),
+                           '--compiled' if output == 'compiled' else '--output', outfile]
+                result = json.loads(subprocess.check_output(command, cwd=ROOT).decode('ascii'))
+                print('%12s %-9s %10.2f %12s' % (chunk_words, output, result['seconds'],
+                                                 result['maxrss_kb']))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def bench_blocklist(args):
+    """Build time, size, lookup speed and false positives of a blocklist"""
+    from passwordmetrics.blocklist import Blocklist, write_blocklist
+
+    letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#%&'
+
+    def passwords(count, prefix):
+        rnd = random.Random(0)
+        for i in range(count):
+            yield prefix + ''.join(rnd.choice(letters) for j in range(rnd.randint(6, 14)))
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('%10s %8s %10s %10s %8s %12s %12s %10s' % (
+            'passwords', 'fp rate', 'build s', 'kB', 'bits/pw', 'hits/s', 'misses/s',
+            'measured'))
+        for count in args.count:
+            for fp_rate in args.fp_rate:
+                path = os.path.join(tempdir, 'blocklist')
+                start = time.time()
+                write_blocklist(passwords(count, 'in'), path, count, fp_rate)
+                build = time.time() - start
+                blocklist = Blocklist(path)
+
+                # Prefixed so they can't be in the list by chance.
+                hits = list(itertools.islice(passwords(count, 'in'), args.lookups))
+                misses = list(passwords(args.lookups, 'out'))
+                assert all(pw in blocklist for pw in hits)
+                hit_time = time_stage(blocklist.__contains__, hits, args.repeat)
+                miss_time = time_stage(blocklist.__contains__, misses, args.repeat)
+                measured = sum(1 for pw in misses if pw in blocklist) / float(len(misses))
+                print('%10s %8s %10.2f %10.0f %8.1f %12.0f %12.0f %10.5f' % (
+                    count, fp_rate, build, os.path.getsize(path) / 1024.0,
+                    blocklist.bits / float(count), len(hits) / hit_time,
+                    len(misses) / miss_time, measured))
+                del blocklist
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def bench_wordlist(args):
+    """Cold start time and memory, text word list against a compiled one"""
+    from passwordmetrics import load_wordlist
+    from passwordmetrics.compiled import write_compiled
+
+    fd, compiled = tempfile.mkstemp(suffix='.pmw')
+    os.close(fd)
+    try:
+        write_compiled(load_wordlist(args.wordlist), compiled)
+        print('%-10s %10s %12s %12s' % ('format', 'seconds', 'rss kB', 'private kB'))
+        for name, path in (('text', args.wordlist), ('compiled', compiled)):
+            result = cold_start(path, args.repeat)
+            print('%-10s %10.4f %12s %12s' % (name, result['seconds'], result['rss_kb'],
+                                              result['private_kb']))
+    finally:
+        os.remove(compiled)
+
+
+def bench_parallel(args):
+    """Throughput of metrics_batch() with an increasing number of workers"""
+    import passwordmetrics
+
+    passwordmetrics.configure(words=args.wordlist)
+    passwords = sample_passwords(passwordmetrics.config['words'], args.count)
+    counts = [1]
+    while counts[-1] * 2 <= args.max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.max_workers:
+        counts.append(args.max_workers)
+
+    print('%8s %12s %12s %8s' % ('workers', 'seconds', 'passwords/s', 'speedup'))
+    start = time.time()
+    passwordmetrics.metrics_batch(passwords, entropy_only=args.entropy_only)
+    baseline = time.time() - start
+    print('%8s %12.3f %12.0f %8.2f' % ('none', baseline, args.count / baseline, 1.0))
+    for workers in counts:
+        start = time.time()
+        passwordmetrics.metrics_batch(passwords, entropy_only=args.entropy_only,
+                                      workers=workers, chunksize=args.chunksize)
+        elapsed = time.time() - start
+        print('%8s %12.3f %12.0f %8.2f' % (workers, elapsed, args.count / elapsed,
+                                           baseline / elapsed))
+
+
+def bench_segmentation(args):
+    """Greedy against optimal word segmentation on passphrases"""
+    import passwordmetrics
+
+    words = passwordmetrics.load_wordlist(args.wordlist)
+    rnd = random.Random(0)
+    vocabulary = sorted(word for word in words if len(word) > 2)
+    print('%6s %-8s %12s %12s' % ('words', 'mode', 'seconds', 'mean bits'))
+    for count in args.words:
+        passphrases = [args.separator.join(rnd.choice(vocabulary) for i in range(count))
+                       for j in range(args.count)]
+        for mode in passwordmetrics.SEGMENTATIONS:
+            scorer = passwordmetrics.Scorer(words=words, segmentation=mode)
+            start = time.time()
+            entropies = [scorer.metrics(pw)['entropy'] for pw in passphrases]
+            elapsed = time.time() - start
+            print('%6s %-8s %12.4f %12.2f' % (count, mode, elapsed, sum(entropies) / len(entropies)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    wordlist = subparsers.add_parser('wordlist', help=bench_wordlist.__doc__)
+    wordlist.add_argument('wordlist', nargs='?', default='passwordmetrics/wordlist_en.txt',
+                          help='A text word list')
+    wordlist.add_argument('--repeat', type=int, default=5)
+    wordlist.set_defaults(func=bench_wordlist)
+
+    parallel = subparsers.add_parser('parallel', help=bench_parallel.__doc__)
+    parallel.add_argument('wordlist', nargs='?', default='passwordmetrics/wordlist_en.txt',
+                          help='A text or compiled word list')
+    parallel.add_argument('--count', type=int, default=200000)
+    parallel.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    parallel.add_argument('--chunksize', type=int, default=1000)
+    parallel.add_argument('--entropy-only', action='store_true')
+    parallel.set_defaults(func=bench_parallel)
+
+    segmentation = subparsers.add_parser('segmentation', help=bench_segmentation.__doc__)
+    segmentation.add_argument('wordlist', nargs='?', default='passwordmetrics/wordlist_en.txt',
+                              help='A text or compiled word list')
+    segmentation.add_argument('--count', type=int, default=1000)
+    segmentation.add_argument('--words', type=int, nargs='+', default=[4, 8, 16, 32])
+    segmentation.add_argument('--separator', default='')
+    segmentation.set_defaults(func=bench_segmentation)
+
+    stages = subparsers.add_parser('stages', help=bench_stages.__doc__)
+    stages.add_argument('wordlist', nargs='?', default='docs/ordlista_sv.txt',
+                        help='A text or compiled word list')
+    stages.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000, 400000],
+                        help='Sizes of synthetic word lists to also run with')
+    stages.add_argument('--lengths', type=int, nargs='+', default=[8, 16, 32, 64, 128, 256])
+    stages.add_argument('--densities', type=float, nargs='+', default=[0.0, 0.25, 1.0],
+                        help='How many of the letters that could be are substituted')
+    stages.add_argument('--count', type=int, default=200, help='Passwords per case')
+    stages.add_argument('--repeat', type=int, default=3)
+    stages.add_argument('--allocations', action='store_true',
+                        help='Also measure memory allocations, with tracemalloc')
+    stages.add_argument('--save', metavar='FILE', help='Save the results as a baseline')
+    stages.add_argument('--compare', metavar='FILE', help='Compare with a saved baseline')
+    stages.add_argument('--tolerance', type=float, default=0.1,
+                        help='How much slower than the baseline is a regression')
+    stages.set_defaults(func=bench_stages)
+
+    adversarial = subparsers.add_parser('adversarial', help=bench_adversarial.__doc__)
+    adversarial.add_argument('wordlist', nargs='?', default='docs/ordlista_sv.txt',
+                             help='A text or compiled word list')
+    adversarial.add_argument('--lengths', type=int, nargs='+',
+                             default=[1000, 2000, 4000, 8000, 16000, 32000])
+    adversarial.add_argument('--max-length', type=int, default=256)
+    adversarial.add_argument('--max-candidates', type=int, default=1024)
+    adversarial.add_argument('--repeat', type=int, default=3)
+    adversarial.set_defaults(func=bench_adversarial)
+
+    compiler = subparsers.add_parser('compile', help=bench_compile.__doc__)
+    compiler.add_argument('--lines', type=int, default=2000000)
+    compiler.add_argument('--vocabulary', type=int, default=1000000)
+    compiler.add_argument('--chunk-words', type=int, nargs='+', default=[10000, 100000, 1000000])
+    compiler.add_argument('--min-count', type=int, default=200)
+    compiler.set_defaults(func=bench_compile)
+
+    blocklist = subparsers.add_parser('blocklist', help=bench_blocklist.__doc__)
+    blocklist.add_argument('--count', type=int, nargs='+', default=[100000, 1000000])
+    blocklist.add_argument('--fp-rate', type=float, nargs='+', default=[0.01, 0.001, 0.0001])
+    blocklist.add_argument('--lookups', type=int, default=100000)
+    blocklist.add_argument('--repeat', type=int, default=3)
+    blocklist.set_defaults(func=bench_blocklist)
+
+    args = parser.parse_args()
+    if not hasattr(args, 'func'):
+        parser.error('Choose a benchmark')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Makes a word list from word counts or text.
+
+The counts are added up in chunks of a limited number of words, that are
+sorted and spilled to temporary files when full, and then merged. Memory use
+therefore depends on --chunk-words, not on the size of the corpus.
+"""
+from __future__ import print_function
+
+import argparse
+import heapq
+import itertools
+import os
+import re
+import shutil
+import sys
+import tempfile
 from io import open
 from math import log
-from collections import defaultdict
 
-lemmas = defaultdict(lambda: 0)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
 chr_entropy = log(26, 2)
 
-with open('ANC-written-count.txt', 'rt', encoding='latin-1') as infile:
-    for line in infile.readlines():
+WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def read_anc(infile):
+    """Yields (lemma, count) from the ANC word counts, word<tab>lemma<tab>pos<tab>count"""
+    for line in infile:
         try:
             word, lemma, pos, count = line.strip().split('\t')
         except ValueError:
             # End of file
             break
-        lemmas[lemma] += int(count)
-    
-if 'troubador' not in lemmas:
-    # XKCD hack:
-    lemmas['troubador'] = 1
-    
-most_common = max(lemmas.values())
-
-for lemma, frequency in sorted(lemmas.items(), key=lambda x: x[1], reverse=True):
-    # Calculate the words häufigkeit and use that as entropy.
-    haufigkeit = 0.5 - log(frequency/most_common, 2)
-    # If the entropy is *higher* than what you get with just characters, then it's
-    # not a real word, and we skip it. Examples of this are the 'words' "abcd" and "fgh",
-    # both in this database.
-    if haufigkeit > len(lemma) * chr_entropy:
-        continue
-    print('%s %s' % (lemma, haufigkeit))
-    
\ No newline at end of file
+        yield lemma, int(count)
+
+
+def read_counts(infile):
+    """Yields (word, count) from lines of a word and its count"""
+    for line in infile:
+        parts = line.split()
+        if len(parts) == 2:
+            yield parts[0], int(parts[1])
+
+
+def read_text(infile):
+    """Yields (word, 1) for each word in running text"""
+    for line in infile:
+        for word in WORD_RE.findall(line):
+            yield word.lower(), 1
+
+
+FORMATS = {'anc': read_anc, 'counts': read_counts, 'text': read_text}
+
+
+def _spill(counts, tempdir, number):
+    path = os.path.join(tempdir, 'chunk-%06d.txt' % number)
+    with open(path, 'wt', encoding='utf-8') as f:
+        for word, count in sorted(counts.items()):
+            f.write(u'%s\t%s\n' % (word, count))
+    return path
+
+
+def _read_chunk(path):
+    with open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            word, count = line.rstrip('\n').split('\t')
+            yield word, int(count)
+
+
+def count_words(pairs, chunk_words, tempdir):
+    """Yields (word, total count) sorted on word, for all the (word, count) pairs
+
+    At most chunk_words different words are kept in memory, the rest is in
+    sorted chunks in tempdir.
+    """
+    chunks = []
+    counts = {}
+    for word, count in pairs:
+        if word in counts:
+            counts[word] += count
+        else:
+            if len(counts) >= chunk_words:
+                chunks.append(_spill(counts, tempdir, len(chunks)))
+                counts = {}
+            counts[word] = count
+
+    streams = [_read_chunk(path) for path in chunks]
+    streams.append(iter(sorted(counts.items())))
+    merged = heapq.merge(*streams)
+    for word, group in itertools.groupby(merged, key=lambda x: x[0]):
+        yield word, sum(count for word, count in group)
+
+
+def make_wordlist(pairs, min_count=1, chunk_words=1000000, tempdir=None):
+    """Yields (word, entropy), sorted on word, from (word, count) pairs"""
+    tempdir = tempfile.mkdtemp(dir=tempdir)
+    try:
+        # XKCD hack: count 'troubador' once, if it's not in the corpus.
+        pairs = itertools.chain(pairs, [(u'troubador', 0)])
+
+        # The entropy depends on the most common word, so the totals go to
+        # a file first, and the entropies are calculated in a second pass.
+        totals = os.path.join(tempdir, 'totals.txt')
+        most_common = 0
+        with open(totals, 'wt', encoding='utf-8') as f:
+            for word, count in count_words(pairs, chunk_words, tempdir):
+                count = count or 1
+                if count < min_count and word != u'troubador':
+                    continue
+                most_common = max(most_common, count)
+                f.write(u'%s\t%s\n' % (word, count))
+
+        for word, frequency in _read_chunk(totals):
+            # Calculate the words häufigkeit and use that as entropy.
+            haufigkeit = 0.5 - log(float(frequency) / most_common, 2)
+            # If the entropy is *higher* than what you get with just characters, then it's
+            # not a real word, and we skip it. Examples of this are the 'words' "abcd" and "fgh",
+            # both in this database.
+            if haufigkeit > len(word) * chr_entropy:
+                continue
+            yield word, haufigkeit
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def _latin1(word):
+    try:
+        word.encode('latin-1')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Makes the word list from the ANC word counts, '
+                                                 'or other word counts or text.')
+    parser.add_argument('infiles', nargs='*', default=['ANC-written-count.txt'])
+    parser.add_argument('--format', choices=sorted(FORMATS), default='anc',
+                        help='anc: the ANC word counts, counts: a word and its count per line, '
+                             'text: running text')
+    parser.add_argument('--encoding', default='latin-1')
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='Skip words that are found fewer times than this')
+    parser.add_argument('--chunk-words', type=int, default=1000000,
+                        help='How many different words to count in memory at a time')
+    parser.add_argument('--tempdir', help='Where to keep the chunks, by default the system default')
+    parser.add_argument('-o', '--output', metavar='OUTFILE',
+                        help='Write the text word list to OUTFILE instead of printing it.')
+    parser.add_argument('--compiled', metavar='OUTFILE',
+                        help='Write a compiled word list to OUTFILE instead of printing a text list.')
+    args = parser.parse_args(argv)
+
+    def pairs():
+        read = FORMATS[args.format]
+        for path in args.infiles:
+            with open(path, 'rt', encoding=args.encoding) as infile:
+                for pair in read(infile):
+                    yield pair
+
+    wordlist = make_wordlist(pairs(), args.min_count, args.chunk_words, args.tempdir)
+    if not args.compiled:
+        # configure() reads text word lists as Latin-1
+        wordlist = (pair for pair in wordlist if _latin1(pair[0]))
+    if args.compiled:
+        # The automaton is built in memory, but only from the words that
+        # made it into the list.
+        from passwordmetrics.compiled import write_compiled
+        write_compiled(dict(wordlist), args.compiled)
+    elif args.output:
+        # The same encoding as configure() reads
+        with open(args.output, 'wt', encoding='latin-1') as outfile:
+            for word, haufigkeit in wordlist:
+                outfile.write(u'%s %s\n' % (word, haufigkeit))
+    else:
+        for word, haufigkeit in wordlist:
+            print('%s %s' % (word, haufigkeit))
+
+
+if __name__ == '__main__':
+    main()